@@ -0,0 +1 @@
+"""Benchmarks of the consumers against in-process stand-ins for the broker, Datacite and REMS."""
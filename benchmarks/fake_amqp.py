@@ -0,0 +1,173 @@
+"""In-memory stand-ins for the amqpstorm connection, channel and inbound messages."""
+
+import itertools
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+from pamqp import specification
+
+
+class InboundMessage:
+    """Message delivered to a consumer, recording when and how it was settled."""
+
+    def __init__(self, body: str, delivery_tag: int, correlation_id: str) -> None:
+        """Define the body and delivery tag of the message."""
+        self.body = body
+        self.delivery_tag = delivery_tag
+        self.correlation_id = correlation_id
+        self.received = 0.0
+        self.settled_at: Union[None, float] = None
+        self.outcome: Union[None, str] = None
+        self.done = threading.Event()
+
+    def ack(self) -> None:
+        """Ack the message."""
+        self.settle("acked")
+
+    def reject(self, requeue: bool = True) -> None:
+        """Reject the message."""
+        self.settle("requeued" if requeue else "rejected")
+
+    def settle(self, outcome: str) -> None:
+        """Record the outcome of the message."""
+        if self.settled_at is None:
+            self.settled_at = time.monotonic()
+            self.outcome = outcome
+            self.done.set()
+
+
+class FakeBasic:
+    """Basic class methods of a channel."""
+
+    def __init__(self, channel: "FakeChannel") -> None:
+        """Bind to ``channel``."""
+        self.channel = channel
+
+    def publish(
+        self,
+        body: Union[str, bytes],
+        routing_key: str,
+        exchange: str = "",
+        properties: Union[None, Dict] = None,
+        mandatory: bool = False,
+        immediate: bool = False,
+    ) -> None:
+        """Record a published message, confirming it from the IO thread in confirm mode."""
+        self.channel.connection.published.append((routing_key, body))
+        if self.channel.confirming:
+            self.channel.sequence += 1
+            self.channel.connection.frames.put(
+                (self.channel, specification.Basic.Ack(delivery_tag=self.channel.sequence))
+            )
+
+    def ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        """Ack an inbound message, with ``multiple`` every one up to ``delivery_tag``."""
+        self.channel.connection.settle(delivery_tag, multiple, "acked")
+
+    def reject(self, delivery_tag: int = 0, requeue: bool = True) -> None:
+        """Reject an inbound message."""
+        self.channel.connection.settle(delivery_tag, False, "requeued" if requeue else "rejected")
+
+    def qos(self, prefetch_count: int = 0, prefetch_size: int = 0, global_: bool = False) -> None:
+        """Accept prefetch settings."""
+
+
+class FakeRpc:
+    """RPC frame handling of a channel, wrapped by the publisher in confirm mode."""
+
+    def on_frame(self, frame_in: specification.Frame) -> bool:
+        """Ignore frames nobody waits for."""
+        return False
+
+
+class FakeChannel:
+    """Channel that publishes into the connection's list of published messages."""
+
+    def __init__(self, connection: "FakeConnection", channel_id: int) -> None:
+        """Open the channel on ``connection``."""
+        self.connection = connection
+        self.channel_id = channel_id
+        self.basic = FakeBasic(self)
+        self.rpc = FakeRpc()
+        self.confirming = False
+        self.sequence = 0
+        self.is_open = True
+        self.consumer_tags: List[str] = []
+
+    def rpc_request(self, frame_out: specification.Frame) -> None:
+        """Handle the requests the publisher makes."""
+        if isinstance(frame_out, specification.Confirm.Select):
+            self.confirming = True
+
+    def write_frame(self, frame_out: specification.Frame) -> None:
+        """Drop frames."""
+
+    def write_frames(self, frames_out: List[specification.Frame]) -> None:
+        """Drop frames."""
+
+    def check_for_errors(self) -> None:
+        """Report no errors."""
+
+    def close(self) -> None:
+        """Close the channel."""
+        self.is_open = False
+
+    def __int__(self) -> int:
+        """Return the channel id."""
+        return self.channel_id
+
+
+class FakeConnection:
+    """Connection whose channels keep everything in memory.
+
+    Like amqpstorm, frames from the broker such as publish confirms are handed to
+    the channels from an IO thread.
+    """
+
+    def __init__(self) -> None:
+        """Start with no channels and nothing published."""
+        self.published: List[Tuple[str, Union[str, bytes]]] = []
+        self.frames: "queue.Queue[Union[None, Tuple[FakeChannel, specification.Frame]]]" = queue.Queue()
+        self.inbound: Dict[int, InboundMessage] = {}
+        self._ids = itertools.count(1)
+        self._tags = itertools.count(1)
+        self._lock = threading.Lock()
+        self.is_open = True
+        self.is_closed = False
+        threading.Thread(target=self._io, name="fake-amqp-io", daemon=True).start()
+
+    def channel(self) -> FakeChannel:
+        """Open a channel."""
+        return FakeChannel(self, next(self._ids))
+
+    def deliver(self, body: str) -> InboundMessage:
+        """Create an inbound message with the next delivery tag."""
+        tag = next(self._tags)
+        message = InboundMessage(body, tag, f"corr-{tag}")
+        with self._lock:
+            self.inbound[tag] = message
+        return message
+
+    def settle(self, delivery_tag: int, multiple: bool, outcome: str) -> None:
+        """Settle inbound messages acked or rejected on a channel."""
+        with self._lock:
+            tags = [tag for tag in self.inbound if tag <= delivery_tag] if multiple else [delivery_tag]
+            messages = [self.inbound.pop(tag) for tag in tags if tag in self.inbound]
+        for message in messages:
+            message.settle(outcome)
+
+    def close(self) -> None:
+        """Close the connection."""
+        self.is_open = False
+        self.is_closed = True
+        self.frames.put(None)
+
+    def _io(self) -> None:
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            channel, frame = item
+            channel.rpc.on_frame(frame)
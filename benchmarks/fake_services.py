@@ -0,0 +1,183 @@
+"""Local HTTP server standing in for the Datacite and REMS APIs."""
+
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Union
+from urllib.parse import parse_qs, urlsplit
+
+from sda_orchestrator.config import CONFIG_INFO
+
+
+class ServiceState:
+    """What the fake services know about, shared by the request handlers."""
+
+    def __init__(self, latency: float, catalogue_size: int) -> None:
+        """Define the delay of every response and how many datasets REMS already holds."""
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.ids = itertools.count(catalogue_size + 1)
+        self.requests: Dict[str, int] = {}
+        org = {"organization/id": CONFIG_INFO["rems"]["organization"]["id"]}
+        self.organization = org
+        self.licenses = [
+            {"id": 1, "organization": org, "localizations": CONFIG_INFO["rems"]["license"]["localizations"]}
+        ]
+        self.workflows = [{"id": 1, "organization": org, "title": CONFIG_INFO["rems"]["workflow"]["title"]}]
+        self.forms = [{"form/id": 1, "organization": org, "form/title": CONFIG_INFO["rems"]["form"]["title"]}]
+        # existing datasets of other submitters, making listings as large as a real catalogue
+        self.resources: List[Dict] = [
+            {"id": i, "resid": f"https://doi.org/10.0/existing-{i}", "organization": org}
+            for i in range(1, catalogue_size + 1)
+        ]
+        self.items: List[Dict] = [
+            {"id": i, "resid": resource["resid"], "formid": 1, "wfid": 1, "organization": org}
+            for i, resource in enumerate(self.resources, 1)
+        ]
+
+    def count(self, method: str, path: str) -> None:
+        """Count a request, by method and path without identifiers."""
+        for prefix in ("/dois/", "/api/organizations/"):
+            if path.startswith(prefix):
+                path = f"{prefix}{{id}}"
+        name = f"{method} {path}"
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Answer Datacite and REMS requests from the shared ``ServiceState``."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without this every response waits for a delayed ACK
+    disable_nagle_algorithm = True
+    state: ServiceState
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer lookups."""
+        path, query = self._split()
+        self.state.count("GET", path)
+        if path.startswith("/dois/"):
+            prefix, suffix = path.split("/")[2:4]
+            self._reply(
+                200, {"data": {"attributes": {"doi": f"{prefix}/{suffix}", "suffix": suffix, "state": "findable"}}}
+            )
+        elif path.startswith("/api/organizations/"):
+            self._reply(200, self.state.organization)
+        elif path == "/api/licenses":
+            self._reply(200, self.state.licenses)
+        elif path == "/api/workflows":
+            self._reply(200, self.state.workflows)
+        elif path == "/api/forms":
+            self._reply(200, self.state.forms)
+        elif path == "/api/resources":
+            with self.state.lock:
+                resources = [res for res in self.state.resources if res["resid"] in query.get("resid", [res["resid"]])]
+            self._reply(200, resources)
+        elif path == "/api/catalogue-items":
+            with self.state.lock:
+                items = [item for item in self.state.items if item["resid"] in query.get("resource", [item["resid"]])]
+            self._reply(200, items)
+        else:
+            self._reply(404, {"errors": [{"title": "Not found"}]})
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Create draft DOIs and REMS objects."""
+        path, _ = self._split()
+        payload = self._payload()
+        self.state.count("POST", path)
+        if path == "/dois":
+            doi = payload["data"]["attributes"]["doi"]
+            self._reply(201, {"data": {"attributes": {"doi": doi, "suffix": doi.split("/", 1)[1]}}})
+        elif path == "/api/resources/create":
+            resource = {"id": next(self.state.ids), "resid": payload["resid"], "organization": payload["organization"]}
+            with self.state.lock:
+                self.state.resources.append(resource)
+            self._reply(200, {"success": True, "id": resource["id"]})
+        elif path == "/api/catalogue-items/create":
+            item = {
+                "id": next(self.state.ids),
+                "resid": payload["localizations"]["en"]["infourl"],
+                "formid": payload["form"],
+                "wfid": payload["wfid"],
+                "organization": payload["organization"],
+            }
+            with self.state.lock:
+                self.state.items.append(item)
+            self._reply(200, {"success": True, "id": item["id"]})
+        elif path.startswith("/api/") and path.endswith("/create"):
+            self._reply(200, {"success": True, "id": next(self.state.ids), "organization/id": "NeIC"})
+        else:
+            self._reply(404, {"errors": [{"title": "Not found"}]})
+
+    def do_PUT(self) -> None:  # noqa: N802
+        """Set DOI states."""
+        path, _ = self._split()
+        payload = self._payload()
+        self.state.count("PUT", path)
+        doi = payload["data"]["attributes"]["doi"]
+        self._reply(200, {"data": {"attributes": {"doi": doi, "suffix": doi.split("/", 1)[1]}}})
+
+    def log_message(self, format: str, *args: object) -> None:
+        """Keep benchmark output quiet."""
+
+    def _split(self) -> Tuple[str, Dict[str, List[str]]]:
+        url = urlsplit(self.path)
+        return url.path, parse_qs(url.query)
+
+    def _payload(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _reply(self, status: int, body: Union[Dict, List]) -> None:
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeServices:
+    """Run the fake Datacite and REMS APIs on a local port."""
+
+    def __init__(self, latency: float = 0.0, catalogue_size: int = 0) -> None:
+        """Define response latency in seconds and the number of datasets already in REMS."""
+        self.state = ServiceState(latency, catalogue_size)
+        handler = type("Handler", (ServiceHandler,), {"state": self.state})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """Return the base URL of the services."""
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def environ(self) -> Dict[str, str]:
+        """Return the environment pointing the DOI and REMS handlers at the services."""
+        return {
+            "DOI_PREFIX": "10.0",
+            "DOI_API": f"{self.url}/dois",
+            "DOI_USER": "bench",
+            "DOI_KEY": "bench",
+            "REMS_API": self.url,
+            "REMS_USER": "bench",
+            "REMS_KEY": "bench",
+            # the fake Datacite has no rate limit, keep the client-side limiter out of the measurements
+            "DATACITE_RATE": "100000",
+            "DATACITE_MAX_RATE": "100000",
+            "DATACITE_RATE_BURST": "100000",
+        }
+
+    def start(self) -> None:
+        """Serve from a background thread."""
+        threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,269 @@
+"""Drive the consumers with generated messages and report throughput, latency and memory.
+
+The broker is replaced by the in-memory connection in ``fake_amqp`` and Datacite and
+REMS by the local server in ``fake_services``, so the numbers measure this package.
+Results are saved as JSON in ``benchmarks/results`` to compare releases.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Union
+
+from sda_orchestrator import __version__
+from sda_orchestrator.utils.acker import BatchAcker
+from sda_orchestrator.utils.consumer import Consumer
+from sda_orchestrator.utils.id_ops import DOIHandler
+from sda_orchestrator.utils.logger import LOG
+from sda_orchestrator.utils.rate_limiter import AdaptiveRateLimiter
+from sda_orchestrator.utils.rems_index import ResourceIndex
+
+from .fake_amqp import FakeConnection, InboundMessage
+from .fake_services import FakeServices
+
+RESULTS = Path(__file__).parent / "results"
+
+SHA256 = {"type": "sha256", "value": "82e4e60e7beb3db2e06a00a079788f7d71f75b61a4b75f28c4c942703dabb6d6"}
+MD5 = {"type": "md5", "value": "7ac236b1a8dce2dac89e7cf45d2b48bd"}
+
+STAGES = {
+    "inbox": "sda_orchestrator.inbox_consume",
+    "verified": "sda_orchestrator.verified_consume",
+    "complete": "sda_orchestrator.complete_consume",
+}
+
+
+def sample(stage: str, index: int, datasets: int) -> Dict:
+    """Return the body of message ``index`` for ``stage``, spreading files over ``datasets`` datasets."""
+    filepath = f"bench/dataset{index % datasets}/file{index}.c4gh"
+    if stage == "inbox":
+        return {"operation": "upload", "user": "bench", "filepath": filepath, "encrypted_checksums": [SHA256]}
+    if stage == "verified":
+        return {"user": "bench", "filepath": filepath, "decrypted_checksums": [SHA256, MD5]}
+    return {
+        "user": "bench",
+        "filepath": filepath,
+        "accession_id": f"urn:neic:bench-{index}",
+        "decrypted_checksums": [SHA256, MD5],
+    }
+
+
+@contextmanager
+def environ(values: Dict[str, str]) -> Iterator[None]:
+    """Set environment variables for the duration of the block."""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def create(stage: str, connection: FakeConnection) -> Consumer:
+    """Create the consumer of ``stage`` on the in-memory connection, set up as ``Consumer.start`` would."""
+    consumer: Consumer = importlib.import_module(STAGES[stage]).create_consumer()
+    consumer.connection = connection  # type: ignore
+    consumer.publisher.reset(connection)  # type: ignore
+    if consumer.ack_batch_size > 1:
+        consumer._acker = BatchAcker(connection.channel(), consumer.ack_batch_size, consumer.ack_batch_interval)
+    rems = getattr(consumer, "rems", None)
+    if rems is not None and getattr(consumer, "registers_doi", False):
+        # the index is shared by every handler, start from the catalogue of this run's services
+        rems.index = ResourceIndex(max_age=rems.index.max_age)
+        consumer.loop.run(rems.warm())  # type: ignore
+        # the limiter is shared by every handler, configure it from this run's environment
+        DOIHandler.limiter = AdaptiveRateLimiter.from_environ("datacite")
+    return consumer
+
+
+def drive(
+    consumer: Consumer, connection: FakeConnection, bodies: List[str], rate: float, timeout: float
+) -> List[InboundMessage]:
+    """Call the consumer with every body, at ``rate`` messages per second if set, and wait until they are settled."""
+    messages = [connection.deliver(body) for body in bodies]
+    start = time.monotonic()
+    for index, message in enumerate(messages):
+        if rate:
+            delay = start + index / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        message.received = time.monotonic()
+        consumer(message)
+    deadline = time.monotonic() + timeout
+    for message in messages:
+        message.done.wait(max(deadline - time.monotonic(), 0))
+    return messages
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the value below which ``fraction`` of ``values`` fall."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def summarise(messages: List[InboundMessage]) -> Dict[str, Union[int, float]]:
+    """Return throughput, latency and outcome counts of a run."""
+    settled = [message for message in messages if message.settled_at is not None]
+    latencies = [message.settled_at - message.received for message in settled]  # type: ignore
+    elapsed = max((message.settled_at for message in settled), default=0.0) - messages[0].received  # type: ignore
+    result: Dict[str, Union[int, float]] = {
+        "messages": len(messages),
+        "settled": len(settled),
+        "throughput": round(len(settled) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+    }
+    for outcome in ("acked", "rejected", "requeued"):
+        result[outcome] = sum(1 for message in settled if message.outcome == outcome)
+    return result
+
+
+def measure_memory(run: Callable[[List[str]], List[InboundMessage]], bodies: List[str]) -> Dict[str, Union[int, float]]:
+    """Return the memory traced while handling ``bodies``.
+
+    ``peak_bytes`` is the most memory allocated at one time during the run and
+    ``retained_bytes_per_message`` what is still allocated after it, per message.
+    ``allocated_blocks_per_message`` and ``allocated_bytes_per_message`` add up the blocks and
+    bytes each source file holds more of after the run than before it, so growth in one file
+    is not hidden by memory freed in another.
+    """
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        first = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        run(bodies)
+        after, peak = tracemalloc.get_traced_memory()
+        second = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = second.filter_traces(ignore).compare_to(first.filter_traces(ignore), "filename")
+    count = len(bodies)
+    return {
+        "peak_bytes": peak - before,
+        "retained_bytes_per_message": round((after - before) / count, 1),
+        "allocated_blocks_per_message": round(sum(max(stat.count_diff, 0) for stat in diff) / count, 1),
+        "allocated_bytes_per_message": round(sum(max(stat.size_diff, 0) for stat in diff) / count, 1),
+    }
+
+
+def bench_stage(stage: str, args: argparse.Namespace) -> Dict:
+    """Benchmark one stage."""
+    services = FakeServices(latency=args.latency / 1000, catalogue_size=args.catalogue)
+    services.start()
+    values = {"BROKER_SSL": "False", "BROKER_PUBLISH_CONFIRM": str(args.confirm), **services.environ()}
+    try:
+        with environ(values):
+            connection = FakeConnection()
+            consumer = create(stage, connection)
+            try:
+
+                def run(bodies: List[str]) -> List[InboundMessage]:
+                    return drive(consumer, connection, bodies, args.rate, args.timeout)
+
+                offset = 0
+
+                def bodies(count: int) -> List[str]:
+                    nonlocal offset
+                    generated = [json.dumps(sample(stage, offset + i, args.datasets)) for i in range(count)]
+                    offset += count
+                    return generated
+
+                run(bodies(args.warmup))
+                result = summarise(run(bodies(args.messages)))
+                if args.memory_messages:
+                    result.update(measure_memory(run, bodies(args.memory_messages)))
+                result["http_requests"] = sum(services.state.requests.values())
+            finally:
+                consumer.close()
+    finally:
+        services.stop()
+    return result
+
+
+def compare(results: Dict, baseline_path: Path) -> None:
+    """Print how throughput and latency changed against a saved run."""
+    baseline = json.loads(baseline_path.read_text())
+    print(f"Compared with {baseline_path.name} ({baseline['version']}):")
+    for stage, result in results["stages"].items():
+        before = baseline["stages"].get(stage)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput", "p50_ms", "p99_ms"):
+            if before[key]:
+                changes.append(f"{key} {(result[key] - before[key]) / before[key]:+.1%}")
+        print(f"  {stage}: {', '.join(changes)}")
+
+
+def main(argv: Union[None, List[str]] = None) -> None:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description=__doc__)
+    parser.add_argument("--stage", action="append", choices=sorted(STAGES), help="stage to run, defaults to all")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per stage")
+    parser.add_argument("--warmup", type=int, default=100, help="messages handled before measuring")
+    parser.add_argument("--rate", type=float, default=0, help="messages per second, 0 sends as fast as possible")
+    parser.add_argument("--datasets", type=int, default=20, help="datasets the files are spread over")
+    parser.add_argument("--latency", type=float, default=5, help="Datacite and REMS response time in ms")
+    parser.add_argument("--catalogue", type=int, default=1000, help="resources already in REMS")
+    parser.add_argument("--confirm", action="store_true", help="use publisher confirms")
+    parser.add_argument("--memory-messages", type=int, default=200, help="messages traced for memory, 0 to skip")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for messages to be settled")
+    parser.add_argument("--log-level", default="WARNING", help="log level of the consumers")
+    parser.add_argument("--output", type=Path, help="file to save results to, defaults to benchmarks/results")
+    parser.add_argument("--no-save", action="store_true", help="only print the results")
+    parser.add_argument("--compare", type=Path, help="saved results to compare with")
+    args = parser.parse_args(argv)
+
+    LOG.setLevel(args.log_level.upper())
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    results = {
+        "version": __version__,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: str(value) for key, value in vars(args).items() if key not in ("output", "compare")},
+        "stages": {},
+    }
+    for stage in args.stage or list(STAGES):
+        result = bench_stage(stage, args)
+        results["stages"][stage] = result
+        print(
+            f"{stage:>9}: {result['throughput']:>8} msg/s  p50 {result['p50_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+            f"acked {result['acked']}/{result['messages']}"
+            + (
+                f"  retained {result['retained_bytes_per_message']} B/msg"
+                f"  allocated {result['allocated_blocks_per_message']} blocks"
+                f" {result['allocated_bytes_per_message']} B/msg"
+                if "peak_bytes" in result
+                else ""
+            )
+        )
+    if not args.no_save:
+        output = args.output or RESULTS / f"{__version__}-{datetime.now().strftime('%Y%m%dT%H%M%S')}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved results to {output}.")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Run consumer stages in supervised worker processes, or together in one process."""
+
+import argparse
+import importlib
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from os import environ
+from types import FrameType
+from typing import Callable, Dict, List, Set, Union
+
+from .utils.consumer import Consumer
+from .utils.logger import LOG, flush_logs, setup_logging
+from .utils.shared_connection import SharedConnection
+
+STAGES = {
+    "inbox": "sda_orchestrator.inbox_consume",
+    "verified": "sda_orchestrator.verified_consume",
+    "complete": "sda_orchestrator.complete_consume",
+}
+
+
+def run_stage(stage: str, cpu: Union[None, int] = None, slot: int = 0) -> None:
+    """Run one consumer of ``stage`` in this process, draining it on SIGTERM or SIGHUP.
+
+    SIGTERM and SIGHUP interrupt the worker like Ctrl-C until the consumer starts and handles them itself.
+
+    The worker in ``slot`` serves its metrics on ``METRICS_PORT`` plus ``slot``.
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGHUP, signal.default_int_handler)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    if environ.get("METRICS_PORT"):
+        environ["METRICS_PORT"] = str(int(environ["METRICS_PORT"]) + slot)
+    try:
+        importlib.import_module(STAGES[stage]).main()
+    finally:
+        # the worker ends with os._exit, which skips writing queued log records at exit
+        flush_logs()
+
+
+class Supervisor:
+    """Keep ``workers`` processes running one consumer of a stage each.
+
+    Every worker has its own broker connection. A worker that exits is started again,
+    waiting ``restart_delay`` seconds doubled for every quick successive exit, up to
+    ``max_restart_delay``. SIGTERM and SIGINT are forwarded to the workers, which are
+    given ``stop_timeout`` seconds to close before they are killed. SIGHUP restarts the
+    workers: it is forwarded, they drain and exit, and are started again without delay.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        workers: int,
+        pin_cpus: bool = False,
+        restart_delay: float = 1.0,
+        max_restart_delay: float = 30.0,
+        stop_timeout: float = 30.0,
+        target: Callable[..., None] = run_stage,
+    ) -> None:
+        """Define the stage, the number of workers and how they are restarted and stopped."""
+        self.stage = stage
+        self.workers = workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stop_timeout = stop_timeout
+        self.target = target
+        self.cpus = sorted(os.sched_getaffinity(0)) if pin_cpus and hasattr(os, "sched_getaffinity") else []
+        self.processes: List[Union[None, BaseProcess]] = [None] * workers
+        self.restarts = 0
+        self._started: List[float] = [0.0] * workers
+        self._delays: List[float] = [0.0] * workers
+        self._due: Dict[int, float] = {}
+        # slots whose worker was told to restart, it is started again straight away
+        self._reloading: Set[int] = set()
+        self._stopping = False
+
+    def run(self) -> int:
+        """Start the workers and keep them running until the supervisor is signalled to stop."""
+        previous = {
+            signum: signal.signal(signum, self._signal) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        }
+        try:
+            LOG.info(f"Starting {self.workers} {self.stage} workers.")
+            for slot in range(self.workers):
+                self._spawn(slot)
+            self._supervise()
+            return self._shutdown()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _supervise(self) -> None:
+        while not self._stopping:
+            sentinels = [process.sentinel for process in self.processes if process is not None]
+            timeout = max(min(self._due.values()) - time.monotonic(), 0) if self._due else 1.0
+            wait(sentinels, timeout=timeout)
+            if self._stopping:
+                break
+            self._reap()
+            now = time.monotonic()
+            for slot, due in list(self._due.items()):
+                if due <= now:
+                    del self._due[slot]
+                    self._spawn(slot)
+
+    def stop(self, signum: int = signal.SIGTERM) -> None:
+        """Stop restarting workers and pass ``signum`` on to them."""
+        self._stopping = True
+        self._forward(signum)
+
+    def _signal(self, signum: int, frame: Union[None, FrameType]) -> None:
+        if signum == signal.SIGHUP:
+            LOG.info(f"Received signal {signum}, restarting {self.stage} workers.")
+            self.reload()
+        else:
+            LOG.info(f"Received signal {signum}, stopping {self.stage} workers.")
+            self.stop(signum)
+
+    def reload(self) -> None:
+        """Restart every worker, each drains its consumer on SIGHUP before it exits."""
+        self._reloading.update(slot for slot, process in enumerate(self.processes) if process is not None)
+        self._forward(signal.SIGHUP)
+
+    def _forward(self, signum: int) -> None:
+        for process in self.processes:
+            if process is not None and process.pid is not None and process.is_alive():
+                try:
+                    os.kill(process.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _spawn(self, slot: int) -> None:
+        cpu = self.cpus[slot % len(self.cpus)] if self.cpus else None
+        process = multiprocessing.Process(
+            target=self.target, args=(self.stage, cpu, slot), name=f"{self.stage}-{slot}", daemon=False
+        )
+        process.start()
+        self.processes[slot] = process
+        self._started[slot] = time.monotonic()
+        LOG.debug(f"Started worker {process.name} with pid {process.pid}.")
+
+    def _reap(self) -> None:
+        for slot, process in enumerate(self.processes):
+            if process is None or process.is_alive():
+                continue
+            process.join()
+            self.processes[slot] = None
+            self.restarts += 1
+            if slot in self._reloading:
+                self._reloading.discard(slot)
+                self._delays[slot] = 0.0
+            # a worker that ran for a while gets restarted straight away, a crash loop is slowed down
+            elif time.monotonic() - self._started[slot] > self.max_restart_delay:
+                self._delays[slot] = 0.0
+            else:
+                self._delays[slot] = min(max(self._delays[slot] * 2, self.restart_delay), self.max_restart_delay)
+            LOG.warning(
+                f"Worker {process.name} exited with code {process.exitcode}, "
+                f"restarting in {self._delays[slot]:.1f} seconds."
+            )
+            self._due[slot] = time.monotonic() + self._delays[slot]
+
+    def _shutdown(self) -> int:
+        deadline = time.monotonic() + self.stop_timeout
+        failed = 0
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                LOG.warning(f"Worker {process.name} did not stop in time, killing it.")
+                process.kill()
+                process.join()
+            if process.exitcode:
+                failed += 1
+        LOG.info(f"Stopped {self.stage} workers.")
+        return 1 if failed else 0
+
+
+def rss() -> int:
+    """Return the resident memory of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak rather than current memory where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def create_consumer(stage: str) -> Consumer:
+    """Create the consumer of ``stage`` configured from the environment."""
+    return importlib.import_module(STAGES[stage]).create_consumer()
+
+
+class StageHost:
+    """Run consumers of several stages in this process on one broker connection.
+
+    Each stage consumes on its own channel in its own thread. The stages share the
+    memory of the process, so its resident memory is logged once they are started and
+    is sampled while they run, its peak is logged when they stop, to compare with
+    running one process per stage.
+    """
+
+    def __init__(
+        self, stages: List[str], stop_timeout: float = 30.0, factory: Callable[[str], Consumer] = create_consumer
+    ) -> None:
+        """Define the stages to run and how long they get to stop."""
+        self.stages = stages
+        self.stop_timeout = stop_timeout
+        self.factory = factory
+        self.shared: Union[None, SharedConnection] = None
+        self.consumers: Dict[str, Consumer] = {}
+        self.threads: Dict[str, threading.Thread] = {}
+        self.peak_memory = 0
+        self._stopped = threading.Event()
+
+    def run(self) -> int:
+        """Start every stage and run them until the host is signalled to stop or a stage fails."""
+        previous = {signum: signal.signal(signum, self._signal) for signum in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self._start()
+            failed: List[str] = []
+            while not failed and not self._stopped.wait(timeout=1.0):
+                self.peak_memory = max(self.peak_memory, rss())
+                failed = [stage for stage, thread in self.threads.items() if not thread.is_alive()]
+            if failed:
+                LOG.error(f"Stage {', '.join(failed)} stopped, stopping all stages.")
+            return self._shutdown() or int(bool(failed))
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def stop(self) -> None:
+        """Stop every stage."""
+        self._stopped.set()
+
+    def _signal(self, signum: int, frame: Union[None, FrameType]) -> None:
+        LOG.info(f"Received signal {signum}, stopping {', '.join(self.stages)}.")
+        self.stop()
+
+    def _start(self) -> None:
+        for stage in self.stages:
+            consumer = self.factory(stage)
+            if self.shared is None:
+                self.shared = SharedConnection(consumer.open_connection)
+                self.shared.get()
+            consumer.shared = self.shared
+            consumer.create_connection()
+            self.consumers[stage] = consumer
+        for stage, consumer in self.consumers.items():
+            thread = threading.Thread(target=consumer.start, name=stage, daemon=True)
+            thread.start()
+            self.threads[stage] = thread
+        self.peak_memory = resident = rss()
+        LOG.info(f"Started {', '.join(self.stages)} in one process, resident memory {resident / 2**20:.1f} MiB.")
+
+    def _shutdown(self) -> int:
+        for consumer in self.consumers.values():
+            consumer.stop()
+        deadline = time.monotonic() + self.stop_timeout
+        failed = 0
+        for stage, thread in self.threads.items():
+            thread.join(max(deadline - time.monotonic(), 0))
+            if thread.is_alive():
+                LOG.warning(f"Stage {stage} did not stop in time.")
+                failed += 1
+        if self.shared is not None:
+            self.shared.close()
+        LOG.info(
+            f"Stopped {', '.join(self.stages)}, resident memory {rss() / 2**20:.1f} MiB, "
+            f"at most {self.peak_memory / 2**20:.1f} MiB while running."
+        )
+        return 1 if failed else 0
+
+
+def main(argv: Union[None, List[str]] = None) -> None:
+    """Run the orchestrator command."""
+    parser = argparse.ArgumentParser(prog="sdaorch", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run worker processes for a stage")
+    run.add_argument("--stage", required=True, choices=sorted(STAGES), help="stage to consume messages for")
+    run.add_argument(
+        "--workers",
+        type=int,
+        default=int(environ.get("WORKERS", os.cpu_count() or 1)),
+        help="number of worker processes (WORKERS), defaults to the number of CPUs",
+    )
+    run.add_argument("--pin-cpus", action="store_true", help="pin each worker to one of the available CPUs")
+    single = commands.add_parser("single", help="run several stages in one process on one broker connection")
+    single.add_argument(
+        "--stage",
+        action="append",
+        choices=sorted(STAGES),
+        help="stage to consume messages for, can be repeated, defaults to every stage",
+    )
+    for command in (run, single):
+        command.add_argument(
+            "--stop-timeout",
+            type=float,
+            default=float(environ.get("WORKER_STOP_TIMEOUT", 30)),
+            help="seconds workers get to stop before they are killed (WORKER_STOP_TIMEOUT)",
+        )
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    if args.command == "single":
+        host = StageHost(args.stage or list(STAGES), stop_timeout=args.stop_timeout)
+        parser.exit(host.run())
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    supervisor = Supervisor(args.stage, args.workers, pin_cpus=args.pin_cpus, stop_timeout=args.stop_timeout)
+    parser.exit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
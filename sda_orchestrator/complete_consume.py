@@ -1,39 +1,168 @@
 """Message Broker complete step consumer."""
 
-import json
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from distutils.util import strtobool
 from sda_orchestrator.utils.rems_ops import REMSHandler
 from amqpstorm import Message
-from .utils.consumer import Consumer
-from .utils.logger import LOG
+from typing import Awaitable, Dict, Hashable, List, Tuple, Union
+from .utils.batcher import KeyedBatcher
+from .utils.consumer import Consumer, Delivery
+from .utils.event_loop import LoopThread
+from .utils.cache import TTLCache
+from .utils.dataset_store import DatasetStore
+from .utils.http_client import HTTPClient
+from .utils.singleflight import SingleFlight
+from .utils.logger import LOG, Fields, log_body, setup_logging
 from os import environ
 from .utils.id_ops import generate_dataset_id, DOIHandler
 from jsonschema.exceptions import ValidationError
-from .schemas.validate import ValidateJSON, load_schema
-import asyncio
+from .schemas.validate import get_validator
+from .utils import messages
 
 
 class CompleteConsumer(Consumer):
     """Complete Consumer class."""
 
+    schemas = Consumer.schemas + ("ingestion-completion", "dataset-mapping")
+
+    def __init__(self, **kwargs: Union[None, str, int]) -> None:
+        """Complete Consumer init function.
+
+        Messages are handled on one event loop that lives as long as the consumer,
+        with COMPLETE_CONCURRENCY messages handled at the same time. Publishing, which
+        waits while the window of unconfirmed publishes is full, is done on a thread of
+        its own so the other messages on the loop carry on meanwhile.
+
+        With MAPPING_BATCH_SIZE above 1, accession IDs of a dataset are sent in one mapping
+        message once that many are collected or after MAPPING_BATCH_AGE seconds.
+
+        With DOI_PUBLISH_OVERLAP the DOI is published while the REMS catalogue item is
+        looked up or created, instead of after it.
+        """
+        super().__init__(**kwargs)  # type: ignore
+        self.concurrency = max(int(environ.get("COMPLETE_CONCURRENCY", 1)), 1)
+        self.loop = LoopThread(use_uvloop=bool(strtobool(environ.get("COMPLETE_UVLOOP", "False"))))
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._publishing = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+        self.http = HTTPClient.from_environ()
+        self.store = DatasetStore.from_environ()
+        self.doi_handler = DOIHandler(self.http, self.store)
+        self.rems = REMSHandler(self.http, self.store)
+        self.publish_overlap = bool(strtobool(environ.get("DOI_PUBLISH_OVERLAP", "False")))
+        # all files in a folder belong to one dataset, it is registered once and remembered
+        self.registrations: SingleFlight[str] = SingleFlight(
+            TTLCache(
+                ttl=float(environ.get("DATASET_MEMO_TTL", 3600)),
+                maxsize=int(environ.get("DATASET_MEMO_SIZE", 10000)),
+            )
+        )
+        batch_size = int(environ.get("MAPPING_BATCH_SIZE", 1))
+        self.mappings: Union[None, KeyedBatcher[Tuple[Message, str, Union[None, Delivery]]]] = None
+        if batch_size > 1:
+            self.mappings = KeyedBatcher(self._queue_mappings, batch_size, float(environ.get("MAPPING_BATCH_AGE", 5.0)))
+            if self.prefetch_count and self.prefetch_count < batch_size:
+                LOG.warning(
+                    f"Prefetch count {self.prefetch_count} is lower than the mapping batch size {batch_size}, "
+                    "batches will only be sent when they are old enough."
+                )
+
+    def __call__(self, message: Message) -> None:
+        """Hand the message over to the event loop.
+
+        When ``concurrency`` messages are already in flight this blocks until one of them is done.
+        The message is acked or rejected from the event loop thread once it is handled.
+        """
+        if self.concurrency == 1:
+            super().__call__(message)
+            return
+        self._slots.acquire()
+        delivery = self._track(message)
+        future = self.loop.submit(self._handle_message(message))
+        # failed messages are reported by publishing, so they are settled off the event loop
+        future.add_done_callback(lambda future: self._publishing.submit(self._handled, delivery, future))
+
+    def _handled(self, delivery: Delivery, future: Future) -> None:
+        """Settle a message handled on the event loop, on the publishing thread."""
+        try:
+            error = future.exception()
+        except CancelledError:
+            LOG.error(f"Handling cancelled, requeue (corr-id: {delivery.message.correlation_id}).")
+            self._finish(delivery, requeue=True)
+        else:
+            if error:
+                self._failed(delivery, error)
+            else:
+                self._finish(delivery)
+        finally:
+            self._slots.release()
+
+    @property
+    def registers_doi(self) -> bool:
+        """Check if Datacite and REMS are configured, otherwise dataset IDs are generated locally."""
+        return (
+            "DOI_PREFIX" in environ and "DOI_API" in environ and "DOI_USER" in environ and "DOI_KEY" in environ
+        ) and ("REMS_API" in environ and "REMS_USER" in environ and "REMS_KEY" in environ)
+
+    def start(self) -> None:
+        """Look up the REMS dependencies shared by all datasets, then start consuming."""
+        if self.registers_doi:
+            try:
+                self.loop.run(self.rems.warm())
+            except Exception as error:
+                LOG.error(f"Could not pre-load REMS organization, license, form and workflow: {error}.")
+        super().start()
+
+    def flush(self) -> None:
+        """Send collected mappings."""
+        if self.loop.loop is not None and self.mappings is not None:
+            self.loop.run(self._send_all_mappings())
+
+    def close(self) -> None:
+        """Send collected mappings, close the HTTP client and store, stop the event loop and close the connection."""
+        if self.loop.loop is not None:
+            self.flush()
+            self.loop.run(self.http.aclose())
+        self.loop.stop()
+        self._publishing.shutdown()
+        if self.store:
+            self.store.close()
+        super().close()
+
     def handle_message(self, message: Message) -> None:
         """Handle message."""
+        self.loop.run(self._handle_message(message))
+
+    async def _handle_message(self, message: Message) -> None:
+        """Handle message on the event loop."""
         try:
-            complete_msg = json.loads(message.body)
+            complete_msg = self._decode(message)
 
-            LOG.debug(f"MQ Message body: {message.body} .")
-            LOG.debug(f"Complete Consumer message received: {complete_msg} .")
+            log_body(message.body, message.correlation_id)
             LOG.info(
-                f"Received work (corr-id: {message.correlation_id} filepath: {complete_msg['filepath']},"
-                f"user: {complete_msg['user']}, accessionid: {complete_msg['accession_id']},"
-                f"decryptedChecksums: {complete_msg['decrypted_checksums']})"
+                "Received work %s",
+                Fields(
+                    corr_id=message.correlation_id,
+                    filepath=complete_msg["filepath"],
+                    user=complete_msg["user"],
+                    accession_id=complete_msg["accession_id"],
+                    decrypted_checksums=complete_msg["decrypted_checksums"],
+                ),
             )
 
-            ValidateJSON(load_schema("ingestion-completion")).validate(complete_msg)
+            get_validator("ingestion-completion").validate(complete_msg)
 
             # Send message to mappings queue for dataset to file mapping
             accessionID = complete_msg["accession_id"]
-            datasetID = asyncio.run(self._process_datasetID(complete_msg["user"], complete_msg["filepath"]))
-            self._publish_mappings(message, accessionID, datasetID)
+            datasetID = await self._process_datasetID(complete_msg["user"], complete_msg["filepath"])
+            if self.mappings is not None:
+                # the message is settled once the mapping message it ends up in is confirmed
+                self.mappings.add(datasetID, (message, accessionID, self._hold(message)))
+            else:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._publishing, self._publish_mappings, message, accessionID, datasetID
+                )
 
         except ValidationError:
             LOG.error("Could not validate the ingestion complete message. Not properly formatted.")
@@ -47,26 +176,15 @@ class CompleteConsumer(Consumer):
         """Process and generated dataset ID depending on environment variable set.
 
         If we make use of Datacite and REMS we need to check if env vars are set.
-        First we create a draft DOI then we register in REMS after which we publish
-        the DOI.
+        Files of the same dataset share one registration: concurrent messages wait for
+        the one in flight and later messages reuse its result.
         """
         datasetID: str = ""
         try:
-            if (
-                "DOI_PREFIX" in environ and "DOI_API" in environ and "DOI_USER" in environ and "DOI_KEY" in environ
-            ) and ("REMS_API" in environ and "REMS_USER" in environ and "REMS_KEY" in environ):
-                doi_handler = DOIHandler()
-                rems = REMSHandler()
-                doi_obj = await doi_handler.create_draft_doi(user, filepath)
-                LOG.info(f"Registered dataset {doi_obj}.")
-                if doi_obj:
-                    await rems.register_resource(doi_obj["dataset"])
-                else:
-                    LOG.error("Registering a DOI was not possible.")
-                    raise Exception("Registering a DOI was not possible.")
-
-                datasetID = doi_obj["dataset"]
-                await doi_handler.set_doi_state("publish", doi_obj["suffix"])
+            if self.registers_doi:
+                datasetID = await self.registrations.do(
+                    generate_dataset_id(user, filepath), lambda: self._register_dataset(user, filepath)
+                )
             else:
                 datasetID = generate_dataset_id(user, filepath)
         except Exception as error:
@@ -75,39 +193,81 @@ class CompleteConsumer(Consumer):
         else:
             return datasetID
 
+    async def _register_dataset(self, user: str, filepath: str) -> str:
+        """Register the dataset of a file.
+
+        First we create a draft DOI then we register in REMS after which we publish
+        the DOI, or while the catalogue item is registered if ``publish_overlap`` is set.
+        """
+        doi_obj = await self.doi_handler.create_draft_doi(user, filepath)
+        LOG.info(f"Registered dataset {doi_obj}.")
+        if not doi_obj:
+            LOG.error("Registering a DOI was not possible.")
+            raise Exception("Registering a DOI was not possible.")
+
+        def publish() -> Awaitable[Union[Dict, None]]:
+            return self.doi_handler.set_doi_state("publish", doi_obj["suffix"])  # type: ignore
+
+        if self.publish_overlap:
+            await self.rems.register_resource(doi_obj["dataset"], publish)
+        else:
+            await self.rems.register_resource(doi_obj["dataset"])
+            await publish()
+        return doi_obj["dataset"]
+
     def _publish_mappings(self, message: Message, accessionID: str, datasetID: str) -> None:
         """Publish message with dataset to accession ID mapping."""
-        properties = {
-            "content_type": "application/json",
-            "headers": {},
-            "correlation_id": message.correlation_id,
-            "delivery_mode": 2,
-        }
         try:
-            channel = self.connection.channel()  # type: ignore
             mappings_trigger = {"type": "mapping", "dataset_id": datasetID, "accession_ids": [accessionID]}
 
-            mappings_msg = json.dumps(mappings_trigger)
-            ValidateJSON(load_schema("dataset-mapping")).validate(json.loads(mappings_msg))
+            mappings_msg = messages.build("dataset-mapping", mappings_trigger)
 
-            mapping = Message.create(channel, mappings_msg, properties)
-            mapping.publish(environ.get("MAPPINGS_QUEUE", "mappings"), exchange=environ.get("BROKER_EXCHANGE", "sda"))
-
-            channel.close()
+            self._publish(message, mappings_msg, environ.get("MAPPINGS_QUEUE", "mappings"))
 
             LOG.info(
-                f"Sent the message to mappings queue to set dataset ID {datasetID} for file"
-                f"with accessionID {accessionID}."
+                "Sent the message to mappings queue to set dataset ID %s for file with accessionID %s.",
+                datasetID,
+                accessionID,
             )
 
         except ValidationError:
             LOG.error("Could not validate the ingestion mappings message. Not properly formatted.")
             raise Exception("Could not validate the ingestion mappings message. Not properly formatted.")
 
+    def _queue_mappings(self, datasetID: Hashable, batch: List[Tuple[Message, str, Union[None, Delivery]]]) -> None:
+        """Hand a full or old batch from the event loop over to the publishing thread."""
+        self._publishing.submit(self._flush_mappings, datasetID, batch)
 
-def main() -> None:
-    """Run the Complete consumer."""
-    CONSUMER = CompleteConsumer(
+    def _flush_mappings(self, datasetID: Hashable, batch: List[Tuple[Message, str, Union[None, Delivery]]]) -> None:
+        """Publish one mapping message for a batch of files in a dataset.
+
+        The files' messages are acked once it is confirmed and requeued if it could not be sent.
+        """
+        held = [delivery for _, _, delivery in batch if delivery]
+        accessionIDs = [accessionID for _, accessionID, _ in batch]
+        try:
+            mappings_trigger = {"type": "mapping", "dataset_id": datasetID, "accession_ids": accessionIDs}
+
+            mappings_msg = messages.build("dataset-mapping", mappings_trigger)
+
+            self._publish_held(batch[0][0], held, mappings_msg, environ.get("MAPPINGS_QUEUE", "mappings"))
+
+            LOG.info(f"Sent the message to mappings queue to set dataset ID {datasetID} for {len(batch)} files.")
+
+        except Exception as error:
+            LOG.error(f"Could not send mappings for dataset ID {datasetID}, requeue {len(held)} messages: {error}")
+            for delivery in held:
+                self._confirmed(delivery, False)
+
+    async def _send_all_mappings(self) -> None:
+        """Flush every collected mapping batch."""
+        if self.mappings is not None:
+            self.mappings.flush_all()
+
+
+def create_consumer() -> CompleteConsumer:
+    """Create the Complete consumer configured from the environment."""
+    return CompleteConsumer(
         hostname=str(environ.get("BROKER_HOST")),
         port=int(environ.get("BROKER_PORT", 5670)),
         username=environ.get("BROKER_USER", "sda"),
@@ -115,7 +275,12 @@ def main() -> None:
         queue=environ.get("COMPLETED_QUEUE", "completed"),
         vhost=environ.get("BROKER_VHOST", "sda"),
     )
-    CONSUMER.start()
+
+
+def main() -> None:
+    """Run the Complete consumer."""
+    setup_logging()
+    create_consumer().start()
 
 
 if __name__ == "__main__":
@@ -1,33 +1,130 @@
 """Message Broker inbox step consumer."""
 
-import json
-from typing import Dict
+from distutils.util import strtobool
+from typing import Dict, Union
 from amqpstorm import Message
-from .utils.consumer import Consumer
-from .utils.logger import LOG
+from .utils.cache import TTLCache
+from .utils.consumer import Consumer, Delivery
+from .utils.dedup import Deduplicator, SeenStore, SharedTriggers, upload_key
+from .utils.fair_queue import FairQueue, parse_weights
+from .utils.logger import LOG, Fields, log_body, setup_logging
+from .utils.metrics import BACKLOG, BACKLOG_LONGEST, BACKLOG_USERS, CANCELLED, DUPLICATES
 from os import environ
 from pathlib import Path
 from jsonschema.exceptions import ValidationError
-from .schemas.validate import ValidateJSON, load_schema
+from .schemas.validate import get_validator
+from .utils import messages
 
 
 class InboxConsumer(Consumer):
     """Inbox Consumer class."""
 
+    schemas = Consumer.schemas + ("inbox-upload", "inbox-rename", "inbox-remove", "ingestion-trigger")
+
+    def __init__(self, **kwargs: Union[None, str, int]) -> None:
+        """Inbox Consumer init function.
+
+        With INBOX_DEDUP_TTL set, an upload of the same file by the same user with the same
+        encrypted checksums is forwarded once in that many seconds, repeats are acked and
+        dropped. INBOX_DEDUP_SIZE bounds the uploads remembered in the process.
+
+        The ingestion triggered for a file is remembered for INBOX_TRIGGER_TTL seconds, at most
+        INBOX_TRIGGER_SIZE of them, 0 disables it. If the file is removed in that time the
+        ingestion is cancelled, if it is renamed it is cancelled and triggered for the new path.
+
+        INBOX_DEDUP_STORE names an SQLite file shared by the worker processes, so uploads and
+        triggers are known whichever worker gets the next event for a file. Triggers kept there
+        are only bounded by INBOX_TRIGGER_TTL.
+
+        With INBOX_FAIR set, received messages are buffered per user and handled in weighted
+        round-robin, so one user uploading many files does not hold up the others. Users take
+        one message per turn, or their weight from INBOX_FAIR_WEIGHTS, ``user=weight`` pairs
+        separated by commas. The buffer holds up to BROKER_PREFETCH_COUNT messages, or
+        INBOX_FAIR_PREFETCH if no prefetch count is set.
+        """
+        super().__init__(**kwargs)  # type: ignore
+        path = environ.get("INBOX_DEDUP_STORE")
+        self.store = SeenStore(path) if path else None
+        self.dedup = Deduplicator.from_environ(self.store)
+        trigger_size = int(environ.get("INBOX_TRIGGER_SIZE", 10000))
+        trigger_ttl = float(environ.get("INBOX_TRIGGER_TTL", 86400))
+        self.triggers: Union[None, TTLCache[Dict], SharedTriggers] = None
+        if trigger_size > 0:
+            if self.store is not None:
+                self.triggers = SharedTriggers(self.store, trigger_ttl)
+            else:
+                self.triggers = TTLCache(ttl=trigger_ttl, maxsize=trigger_size)
+        self.fair: Union[None, FairQueue[Delivery]] = None
+        if strtobool(environ.get("INBOX_FAIR", "False")):
+            self.fair = FairQueue(parse_weights(environ.get("INBOX_FAIR_WEIGHTS", "")))
+            if not self.prefetch_count:
+                self.prefetch_count = int(environ.get("INBOX_FAIR_PREFETCH", 1000))
+
+    def close(self) -> None:
+        """Close the shared store and the connection."""
+        if self.store is not None:
+            self.store.close()
+        super().close()
+
+    def __call__(self, message: Message) -> None:
+        """Buffer the message with the other messages of its user in fair mode, otherwise handle it."""
+        if self.fair is None:
+            super().__call__(message)
+            return
+        delivery = self._track(message)
+        try:
+            user = str(self._decode(message)["user"])
+        except Exception:
+            # reported as malformed straight away
+            self._handle(delivery)
+            return
+        backlog = self.fair.put(user, delivery)
+        LOG.debug("Buffered message %s", Fields(queue=self.queue, user=user, backlog=backlog))
+        self._set_backlog(self.fair)
+
+    def dispatch(self) -> bool:
+        """Handle the next buffered message in round-robin across users."""
+        if self.fair is None or not len(self.fair):
+            return False
+        user, delivery, backlog = self.fair.get()
+        LOG.debug("Dispatching message %s", Fields(queue=self.queue, user=user, backlog=backlog))
+        self._set_backlog(self.fair)
+        self._handle(delivery)
+        return True
+
+    def discard(self) -> None:
+        """Drop the buffered messages, the broker redelivers them."""
+        if self.fair is None:
+            return
+        for deliveries in self.fair.clear().values():
+            for delivery in deliveries:
+                self._untrack(delivery)
+        self._set_backlog(self.fair)
+
+    def _set_backlog(self, fair: FairQueue) -> None:
+        # per user figures would give a series per user, they are only logged at debug level
+        BACKLOG.set(len(fair), queue=self.queue)
+        BACKLOG_USERS.set(fair.keys, queue=self.queue)
+        BACKLOG_LONGEST.set(fair.longest, queue=self.queue)
+
     def handle_message(self, message: Message) -> None:
         """Handle message."""
         try:
-            inbox_msg = json.loads(message.body)
+            inbox_msg = self._decode(message)
 
-            LOG.debug(f"MQ Message body: {message.body} .")
-            LOG.debug(f"Inbox Consumer message received: {inbox_msg} .")
+            log_body(message.body, message.correlation_id)
             LOG.info(
-                f"Received work (corr-id: {message.correlation_id} filepath: {inbox_msg['filepath']},"
-                f"user: {inbox_msg['user']} with operation: {inbox_msg['operation']})",
+                "Received work %s",
+                Fields(
+                    corr_id=message.correlation_id,
+                    filepath=inbox_msg["filepath"],
+                    user=inbox_msg["user"],
+                    operation=inbox_msg["operation"],
+                ),
             )
 
             if inbox_msg["operation"] == "upload":
-                ValidateJSON(load_schema("inbox-upload")).validate(inbox_msg)
+                get_validator("inbox-upload").validate(inbox_msg)
                 # we check if this is a path with a suffix or a name
                 test_path = Path(inbox_msg["filepath"])
                 if test_path.name in ["", ".", ".."]:
@@ -36,13 +133,15 @@ class InboxConsumer(Consumer):
 
                 # Create the files message.
                 # we keep the encrypted_checksum but it can also be missing
-                self._publish_ingest(message, inbox_msg)
+                self._forward_upload(message, inbox_msg)
             elif inbox_msg["operation"] == "rename":
-                ValidateJSON(load_schema("inbox-rename")).validate(inbox_msg)
-                pass
+                get_validator("inbox-rename").validate(inbox_msg)
+                trigger = self._cancel_ingest(message, inbox_msg["user"], inbox_msg["oldpath"], "rename")
+                if trigger is not None:
+                    self._forward_upload(message, dict(trigger, filepath=inbox_msg["filepath"]))
             elif inbox_msg["operation"] == "remove":
-                ValidateJSON(load_schema("inbox-remove")).validate(inbox_msg)
-                pass
+                get_validator("inbox-remove").validate(inbox_msg)
+                self._cancel_ingest(message, inbox_msg["user"], inbox_msg["filepath"], "remove")
             else:
                 LOG.error("Un-identified inbox operation.")
                 pass
@@ -55,39 +154,82 @@ class InboxConsumer(Consumer):
             LOG.error(f"Error occurred in inbox consumer: {error}.")
             raise
 
+    def _forward_upload(self, message: Message, upload: Dict) -> None:
+        """Trigger ingestion of an uploaded file, unless it was triggered shortly before."""
+        key = None
+        if self.dedup is not None:
+            key = upload_key(upload)
+            # a redelivered upload may not have been forwarded, it is never dropped
+            if not self.dedup.claim(key) and not message.redelivered:
+                DUPLICATES.inc(queue=self.queue)
+                LOG.info(
+                    "Dropped duplicate upload %s",
+                    Fields(corr_id=message.correlation_id, filepath=upload["filepath"], user=upload["user"]),
+                )
+                return
+
+        try:
+            self._publish_ingest(message, upload)
+        except Exception:
+            if self.dedup is not None and key is not None:
+                self.dedup.release(key)
+            raise
+
     def _publish_ingest(self, message: Message, inbox_msg: Dict) -> None:
         """Publish message with dataset to accession ID mapping."""
-        properties = {
-            "content_type": "application/json",
-            "headers": {},
-            "correlation_id": message.correlation_id,
-            "delivery_mode": 2,
-        }
         try:
-            channel = self.connection.channel()  # type: ignore
-
             ingest_trigger = {"type": "ingest", "user": inbox_msg["user"], "filepath": inbox_msg["filepath"]}
             if "encrypted_checksums" in inbox_msg:
                 ingest_trigger["encrypted_checksums"] = inbox_msg["encrypted_checksums"]
 
-            ingest_msg = json.dumps(ingest_trigger)
-            ValidateJSON(load_schema("ingestion-trigger")).validate(json.loads(ingest_msg))
+            ingest_msg = messages.build("ingestion-trigger", ingest_trigger)
 
-            ingest = Message.create(channel, ingest_msg, properties)
+            self._publish(message, ingest_msg, environ.get("INGEST_QUEUE", "ingest"))
 
-            ingest.publish(environ.get("INGEST_QUEUE", "ingest"), exchange=environ.get("BROKER_EXCHANGE", "sda"))
-            channel.close()
+            if self.triggers is not None:
+                self.triggers.set((inbox_msg["user"], inbox_msg["filepath"]), ingest_trigger)
 
-            LOG.info(f'Sent the message to ingest queue to trigger ingestion for filepath: {inbox_msg["filepath"]}.')
+            LOG.info("Sent the message to ingest queue to trigger ingestion for filepath: %s.", inbox_msg["filepath"])
 
         except ValidationError:
             LOG.error("Could not validate the ingest trigger message. Not properly formatted.")
             raise Exception("Could not validate the ingest trigger message. Not properly formatted.")
 
+    def _cancel_ingest(self, message: Message, user: str, filepath: str, operation: str) -> Union[None, Dict]:
+        """Cancel the ingestion recently triggered for a file that was removed or renamed.
+
+        :return: the ingest trigger cancelled, or None if no ingestion was triggered for the file recently
+        """
+        if self.triggers is None:
+            return None
+        key = (user, filepath)
+        trigger = self.triggers.get(key)
+        if trigger is None:
+            return None
+        try:
+            cancel_msg = messages.build("ingestion-trigger", dict(trigger, type="cancel"))
 
-def main() -> None:
-    """Run the Inbox consumer."""
-    CONSUMER = InboxConsumer(
+            self._publish(message, cancel_msg, environ.get("INGEST_QUEUE", "ingest"))
+
+        except ValidationError:
+            LOG.error("Could not validate the cancel trigger message. Not properly formatted.")
+            raise Exception("Could not validate the cancel trigger message. Not properly formatted.")
+
+        self.triggers.invalidate(key)
+        # the file can be uploaded again
+        if self.dedup is not None:
+            self.dedup.release(upload_key(trigger))
+        CANCELLED.inc(operation=operation)
+        LOG.info(
+            "Cancelled ingestion %s",
+            Fields(corr_id=message.correlation_id, filepath=filepath, user=user, operation=operation),
+        )
+        return trigger
+
+
+def create_consumer() -> InboxConsumer:
+    """Create the Inbox consumer configured from the environment."""
+    return InboxConsumer(
         hostname=str(environ.get("BROKER_HOST")),
         port=int(environ.get("BROKER_PORT", 5670)),
         username=environ.get("BROKER_USER", "sda"),
@@ -95,7 +237,12 @@ def main() -> None:
         queue=environ.get("INBOX_QUEUE", "inbox"),
         vhost=environ.get("BROKER_VHOST", "sda"),
     )
-    CONSUMER.start()
+
+
+def main() -> None:
+    """Run the Inbox consumer."""
+    setup_logging()
+    create_consumer().start()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+"""Compile JSON schemas into Python validation functions.
+
+The message schemas are small and never change while a consumer runs, so each
+one is turned into plain ``isinstance`` checks, membership tests and precompiled
+regular expressions once, instead of walking the schema for every message.
+The generated function only answers whether a message is valid; the reasons are
+left to jsonschema, see ``CompiledValidator`` in ``validate``.
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+# keywords that do not constrain the instance
+ANNOTATIONS = frozenset(
+    {"$id", "$schema", "$comment", "title", "description", "examples", "definitions", "default", "readOnly"}
+)
+
+# Draft 7 types, booleans are not numbers and floats without a fraction are integers
+TYPE_CHECKS = {
+    "object": "isinstance({0}, dict)",
+    "array": "isinstance({0}, list)",
+    "string": "isinstance({0}, str)",
+    "boolean": "isinstance({0}, bool)",
+    "null": "{0} is None",
+    "number": "(isinstance({0}, (int, float)) and not isinstance({0}, bool))",
+    "integer": "(isinstance({0}, int) and not isinstance({0}, bool) or isinstance({0}, float) and {0}.is_integer())",
+}
+
+
+class UnsupportedSchema(Exception):
+    """The schema uses a keyword or reference the compiler does not handle."""
+
+
+def equal(one: object, two: object) -> bool:
+    """Compare JSON values the way jsonschema does for ``const`` and ``enum``, where ``True`` is not ``1``."""
+    if isinstance(one, str) or isinstance(two, str):
+        return one == two
+    if isinstance(one, dict) and isinstance(two, dict):
+        return one.keys() == two.keys() and all(equal(one[key], two[key]) for key in one)
+    if isinstance(one, list) and isinstance(two, list):
+        return len(one) == len(two) and all(equal(i, j) for i, j in zip(one, two))
+    if isinstance(one, bool) != isinstance(two, bool):
+        return False
+    return one == two
+
+
+class SchemaCompiler:
+    """Generate the source of a validation function for one schema.
+
+    Every subschema becomes a function returning whether its part of the
+    instance is valid, ``$ref`` pointing inside the schema calls the function
+    of the target. Defaults are filled in like ``extend_with_default`` does.
+    """
+
+    def __init__(self, schema: Union[Dict, bool]) -> None:
+        """Define the schema to compile."""
+        self.schema = schema
+        self.lines: List[str] = []
+        self.names: Dict[int, str] = {}
+        self.pending: List[Tuple[str, Union[Dict, bool]]] = []
+        self.constants: Dict[str, object] = {}
+
+    def compile(self) -> Tuple[Callable[[object], bool], str]:
+        """Return the validation function and its source."""
+        entry = self._function(self.schema)
+        while self.pending:
+            self._emit(*self.pending.pop())
+        source = "\n".join(self.lines) + "\n"
+        namespace: Dict[str, object] = {"equal": equal, **self.constants}
+        exec(compile(source, "<schema>", "exec"), namespace)  # nosec
+        return namespace[entry], source  # type: ignore
+
+    def _function(self, schema: Union[Dict, bool]) -> str:
+        """Return the name of the function validating ``schema``, generated once per subschema."""
+        name = self.names.get(id(schema))
+        if name is None:
+            name = self.names[id(schema)] = f"_validate_{len(self.names)}"
+            self.pending.append((name, schema))
+        return name
+
+    def _constant(self, value: object) -> str:
+        """Bind ``value`` to a name in the generated module."""
+        name = f"_const_{len(self.constants)}"
+        self.constants[name] = value
+        return name
+
+    def _resolve(self, ref: str) -> Union[Dict, bool]:
+        """Return the subschema a local JSON pointer refers to."""
+        if not ref.startswith("#"):
+            raise UnsupportedSchema(f"Reference {ref} is not local.")
+        target: object = self.schema
+        for part in filter(None, ref[1:].split("/")):
+            part = part.replace("~1", "/").replace("~0", "~")
+            if not isinstance(target, dict) or part not in target:
+                raise UnsupportedSchema(f"Reference {ref} cannot be resolved.")
+            target = target[part]
+        if not isinstance(target, (dict, bool)):
+            raise UnsupportedSchema(f"Reference {ref} is not a schema.")
+        return target
+
+    def _emit(self, name: str, schema: Union[Dict, bool]) -> None:
+        """Append the function validating ``schema``."""
+        body: List[str] = []
+        if isinstance(schema, bool):
+            body.append(f"return {schema}")
+        elif "$ref" in schema:
+            # in Draft 7 the keywords next to a reference are ignored
+            body.append(f"return {self._function(self._resolve(schema['$ref']))}(data)")
+        else:
+            body.extend(self._checks(schema))
+            body.append("return True")
+        self.lines.append(f"def {name}(data):")
+        self.lines.extend(f"    {line}" for line in body)
+        self.lines.append("")
+
+    def _checks(self, schema: Dict) -> List[str]:
+        """Return the statements rejecting instances that do not match ``schema``."""
+        handled = {"type", "enum", "const", "anyOf", "allOf", "oneOf", "not"}
+        handled |= {"required", "properties", "additionalProperties", "minProperties", "maxProperties"}
+        handled |= {"items", "additionalItems", "contains", "minItems", "maxItems"}
+        handled |= {"pattern", "minLength", "maxLength", "minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum"}
+        unsupported = [key for key in schema if key not in handled and key not in ANNOTATIONS]
+        if unsupported:
+            raise UnsupportedSchema(f"Keywords {', '.join(unsupported)} are not supported.")
+
+        lines: List[str] = []
+        types = schema.get("type")
+        if isinstance(types, str):
+            types = [types]
+        if types is not None:
+            lines.append(f"if not ({' or '.join(TYPE_CHECKS[name].format('data') for name in types)}):")
+            lines.append("    return False")
+
+        if "enum" in schema:
+            values = schema["enum"]
+            if all(isinstance(value, str) for value in values):
+                lines.append(f"if not (isinstance(data, str) and data in {self._constant(frozenset(values))}):")
+            else:
+                lines.append(f"if not any(equal(data, value) for value in {self._constant(values)}):")
+            lines.append("    return False")
+        if "const" in schema:
+            lines.append(f"if not equal(data, {self._constant(schema['const'])}):")
+            lines.append("    return False")
+
+        lines.extend(self._typed("object", types, self._object_checks(schema)))
+        lines.extend(self._typed("array", types, self._array_checks(schema)))
+        lines.extend(self._typed("string", types, self._string_checks(schema)))
+        lines.extend(self._typed("number", types, self._number_checks(schema)))
+
+        if "allOf" in schema:
+            lines.append(f"if not ({' and '.join(self._call(sub) for sub in schema['allOf'])}):")
+            lines.append("    return False")
+        if "anyOf" in schema:
+            lines.append(f"if not ({' or '.join(self._call(sub) for sub in schema['anyOf'])}):")
+            lines.append("    return False")
+        if "oneOf" in schema:
+            calls = ", ".join(self._call(sub) for sub in schema["oneOf"])
+            lines.append(f"if [{calls}].count(True) != 1:")
+            lines.append("    return False")
+        if "not" in schema:
+            lines.append(f"if {self._call(schema['not'])}:")
+            lines.append("    return False")
+        return lines
+
+    def _call(self, schema: Union[Dict, bool], value: str = "data") -> str:
+        """Return the expression validating ``value`` against ``schema``."""
+        return f"{self._function(schema)}({value})"
+
+    @staticmethod
+    def _typed(name: str, types: Optional[List[str]], checks: List[str]) -> List[str]:
+        """Guard ``checks`` so they only apply to instances of type ``name``."""
+        if not checks:
+            return []
+        if types is not None and (types == [name] or types == ["integer"] and name == "number"):
+            return checks
+        check = TYPE_CHECKS[name].format("data")
+        return [f"if {check}:"] + [f"    {line}" for line in checks]
+
+    def _object_checks(self, schema: Dict) -> List[str]:
+        """Return the checks of object keywords."""
+        lines: List[str] = []
+        for key in schema.get("required", []):
+            lines.append(f"if {key!r} not in data:")
+            lines.append("    return False")
+        if "minProperties" in schema:
+            lines.append(f"if len(data) < {int(schema['minProperties'])}:")
+            lines.append("    return False")
+        if "maxProperties" in schema:
+            lines.append(f"if len(data) > {int(schema['maxProperties'])}:")
+            lines.append("    return False")
+        properties = schema.get("properties", {})
+        for key, subschema in properties.items():
+            if isinstance(subschema, dict) and "default" in subschema:
+                lines.append(f"data.setdefault({key!r}, {self._constant(subschema['default'])})")
+        for key, subschema in properties.items():
+            if subschema is True or isinstance(subschema, dict) and set(subschema) <= ANNOTATIONS:
+                continue
+            lines.append(f"if {key!r} in data and not {self._call(subschema, f'data[{key!r}]')}:")
+            lines.append("    return False")
+        additional = schema.get("additionalProperties", True)
+        if additional is not True:
+            lines.append("for key in data:")
+            lines.append(f"    if key not in {self._constant(frozenset(properties))}:")
+            if additional is False:
+                lines.append("        return False")
+            else:
+                lines.append(f"        if not {self._call(additional, 'data[key]')}:")
+                lines.append("            return False")
+        return lines
+
+    def _array_checks(self, schema: Dict) -> List[str]:
+        """Return the checks of array keywords."""
+        lines: List[str] = []
+        if "minItems" in schema:
+            lines.append(f"if len(data) < {int(schema['minItems'])}:")
+            lines.append("    return False")
+        if "maxItems" in schema:
+            lines.append(f"if len(data) > {int(schema['maxItems'])}:")
+            lines.append("    return False")
+        items = schema.get("items", True)
+        if isinstance(items, list):
+            for index, subschema in enumerate(items):
+                lines.append(f"if len(data) > {index} and not {self._call(subschema, f'data[{index}]')}:")
+                lines.append("    return False")
+            # additionalItems only applies next to a list of items
+            additional = schema.get("additionalItems", True)
+            if additional is not True:
+                lines.append(f"for item in data[{len(items)}:]:")
+                lines.append(f"    if not {self._call(additional, 'item')}:")
+                lines.append("        return False")
+        elif items is not True:
+            lines.append("for item in data:")
+            lines.append(f"    if not {self._call(items, 'item')}:")
+            lines.append("        return False")
+        if "contains" in schema:
+            lines.append(f"if not any({self._call(schema['contains'], 'item')} for item in data):")
+            lines.append("    return False")
+        return lines
+
+    def _string_checks(self, schema: Dict) -> List[str]:
+        """Return the checks of string keywords."""
+        lines: List[str] = []
+        if "minLength" in schema:
+            lines.append(f"if len(data) < {int(schema['minLength'])}:")
+            lines.append("    return False")
+        if "maxLength" in schema:
+            lines.append(f"if len(data) > {int(schema['maxLength'])}:")
+            lines.append("    return False")
+        if "pattern" in schema:
+            lines.append(f"if not {self._constant(re.compile(schema['pattern']))}.search(data):")
+            lines.append("    return False")
+        return lines
+
+    def _number_checks(self, schema: Dict) -> List[str]:
+        """Return the checks of numeric keywords."""
+        lines: List[str] = []
+        for key, operator in (
+            ("minimum", "<"),
+            ("maximum", ">"),
+            ("exclusiveMinimum", "<="),
+            ("exclusiveMaximum", ">="),
+        ):
+            if key in schema:
+                lines.append(f"if data {operator} {self._constant(schema[key])}:")
+                lines.append("    return False")
+        return lines
+
+
+def compile_schema(schema: Union[Dict, bool]) -> Tuple[Callable[[object], bool], str]:
+    """Return a function telling whether an instance is valid against ``schema``, and its source."""
+    return SchemaCompiler(schema).compile()
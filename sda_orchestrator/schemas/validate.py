@@ -2,16 +2,20 @@
 
 import json
 from jsonschema import Draft7Validator, validators, Validator
+from jsonschema.exceptions import ValidationError
 
-from typing import Dict, Generator
+from os import environ
+from typing import Dict, Generator, Iterable, Iterator, Union
 from pathlib import Path
 from ..utils.logger import LOG
+from .compiler import UnsupportedSchema, compile_schema
+
+SCHEMAS_PATH = Path(__file__).resolve().parent
 
 
 def load_schema(name: str) -> Dict:
     """Load JSON schemas."""
-    module_path = Path(__file__).resolve().parent
-    path = module_path.joinpath(f"{name}.json")
+    path = SCHEMAS_PATH.joinpath(f"{name}.json")
 
     if path.is_file():
         with open(str(path), "r") as fp:
@@ -49,3 +53,96 @@ def extend_with_default(validator_class: Draft7Validator) -> Draft7Validator:
 
 
 ValidateJSON = extend_with_default(Draft7Validator)
+
+
+class CompiledValidator:
+    """Validator running Python code generated from the schema.
+
+    Valid messages, the common case, only go through the generated code. Invalid
+    ones are validated again by ``ValidateJSON``, so errors are reported exactly
+    as before.
+    """
+
+    def __init__(self, schema: Dict) -> None:
+        """Compile the schema, raises ``UnsupportedSchema`` if it cannot be compiled."""
+        self.schema = schema
+        self.check, self.source = compile_schema(schema)
+        self.fallback = ValidateJSON(schema)
+
+    def is_valid(self, instance: object) -> bool:
+        """Return whether the instance is valid, filling in defaults."""
+        return self.check(instance)
+
+    def validate(self, instance: object) -> None:
+        """Raise the ``ValidationError`` jsonschema reports if the instance is not valid."""
+        if not self.check(instance):
+            self.fallback.validate(instance)
+
+    def iter_errors(self, instance: object) -> Iterator[ValidationError]:
+        """Return every validation error of the instance."""
+        return self.fallback.iter_errors(instance)
+
+
+Validators = Union[Draft7Validator, CompiledValidator]
+
+
+class SchemaRegistry:
+    """Process-wide registry of compiled message validators.
+
+    Every schema in the schemas directory is read, checked against the Draft 7
+    meta-schema and compiled into a validator once, so that consumers do not hit
+    the disk or build validators while handling messages. The backend is chosen
+    with ``SCHEMA_VALIDATOR``: ``jsonschema``, the default, uses ``ValidateJSON``
+    instances, ``compiled`` turns schemas into generated Python code, falling back
+    to ``jsonschema`` for schemas it cannot compile.
+    """
+
+    def __init__(self, path: Path = SCHEMAS_PATH, backend: str = "") -> None:
+        """Define where the schemas are loaded from and how they are compiled."""
+        self.path = path
+        self.backend = backend or environ.get("SCHEMA_VALIDATOR", "jsonschema")
+        self._validators: Dict[str, Validators] = {}
+        self._loaded = False
+
+    def load(self) -> None:
+        """Load, check and compile every schema found in the schemas directory."""
+        compiled: Dict[str, Validators] = {}
+        for schema_file in sorted(self.path.glob("*.json")):
+            with open(str(schema_file), "r") as fp:
+                schema = json.load(fp)
+            ValidateJSON.check_schema(schema)
+            compiled[schema_file.stem] = self._compile(schema_file.stem, schema)
+        self._validators = compiled
+        self._loaded = True
+        LOG.debug(f"Compiled {len(compiled)} message schemas with the {self.backend} backend.")
+
+    def _compile(self, name: str, schema: Dict) -> Validators:
+        """Return the validator of a schema for the configured backend."""
+        if self.backend == "compiled":
+            try:
+                return CompiledValidator(schema)
+            except UnsupportedSchema as error:
+                LOG.warning(f"Schema {name} validated by jsonschema: {error}")
+        return ValidateJSON(schema)
+
+    def require(self, names: Iterable[str]) -> None:
+        """Make sure the named schemas are available, loading the registry if needed."""
+        if not self._loaded:
+            self.load()
+        missing = [name for name in names if name not in self._validators]
+        if missing:
+            LOG.error(f"Schema files {', '.join(missing)} not found.")
+            raise FileNotFoundError(f"Schema files {', '.join(missing)} not found.")
+
+    def get(self, name: str) -> Validators:
+        """Return the cached validator for a schema."""
+        self.require([name])
+        return self._validators[name]
+
+
+SCHEMAS = SchemaRegistry()
+
+
+def get_validator(name: str) -> Validators:
+    """Return the process-wide compiled validator for schema ``name``."""
+    return SCHEMAS.get(name)
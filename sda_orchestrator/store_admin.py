@@ -0,0 +1,85 @@
+"""Inspect or rebuild the dataset store used by the complete step consumer."""
+
+import argparse
+import asyncio
+import json
+from os import environ
+from typing import List, Union
+
+from .utils.dataset_store import DatasetStore
+from .utils.http_client import HTTPClient
+from .utils.id_ops import DOIHandler
+from .utils.logger import LOG
+from .utils.rems_ops import REMSHandler
+
+# Datacite reports the state a DOI is in, the store records the event that led to it
+DOI_STATE_EVENTS = {"draft": "draft", "registered": "register", "findable": "publish"}
+
+
+async def rebuild(store: DatasetStore) -> int:
+    """Record every dataset registered in REMS under our DOI prefix, with its DOI state from Datacite."""
+    http = HTTPClient.from_environ()
+    doi_handler = DOIHandler(http)
+    rems = REMSHandler(http)
+    try:
+        await rems.sync_index()
+        count = 0
+        for dataset_id, resource_id in rems.index.resources.items():
+            if not dataset_id.startswith(f"{doi_handler.ns_url}/"):
+                continue
+            doi_suffix = dataset_id.rsplit("/", 1)[-1]
+            attributes = await doi_handler.get_doi(doi_suffix)
+            items = rems.index.items.get(dataset_id)
+            store.update(
+                dataset_id,
+                doi_suffix=attributes["suffix"] if attributes else doi_suffix,
+                full_doi=attributes["doi"] if attributes else f"{doi_handler.doi_prefix}/{doi_suffix}",
+                rems_resource_id=resource_id,
+                rems_catalogue_item_id=items[0][0] if items else None,
+                state=DOI_STATE_EVENTS.get(attributes["state"]) if attributes else None,
+            )
+            count += 1
+    finally:
+        await http.aclose()
+    return count
+
+
+def main(argv: Union[None, List[str]] = None) -> None:
+    """Run the dataset store command."""
+    parser = argparse.ArgumentParser(prog="sdastore", description=__doc__)
+    parser.add_argument("--store", default=environ.get("DATASET_STORE"), help="path of the store (DATASET_STORE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="print every recorded dataset")
+    show = commands.add_parser("show", help="print one dataset")
+    show.add_argument("dataset_id")
+    forget = commands.add_parser("forget", help="delete one dataset, so it is registered again")
+    forget.add_argument("dataset_id")
+    rebuild_cmd = commands.add_parser("rebuild", help="rebuild the store from REMS and Datacite")
+    rebuild_cmd.add_argument("--clear", action="store_true", help="delete every record first")
+    args = parser.parse_args(argv)
+
+    if not args.store:
+        parser.error("no store given, set DATASET_STORE or use --store")
+    store = DatasetStore(args.store)
+    try:
+        if args.command == "list":
+            for record in store.all():
+                print(json.dumps(record))
+        elif args.command == "show":
+            found = store.get(args.dataset_id)
+            if found is None:
+                parser.exit(1, f"Dataset {args.dataset_id} not found.\n")
+            print(json.dumps(found, indent=2))
+        elif args.command == "forget":
+            store.delete(args.dataset_id)
+        elif args.command == "rebuild":
+            if args.clear:
+                store.delete()
+            count = asyncio.run(rebuild(store))
+            LOG.info(f"Rebuilt dataset store with {count} datasets.")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Batched acknowledgement of consumed messages."""
+
+import threading
+from typing import List, Set, Union
+
+from amqpstorm import AMQPError
+from amqpstorm.channel import Channel
+
+from .logger import LOG
+
+
+class BatchAcker:
+    """Acknowledge deliveries on a channel in batches with ``multiple=True``.
+
+    Successful deliveries are collected and acked with a single frame once
+    ``batch_size`` of them are waiting or ``interval`` milliseconds have passed.
+    Rejects are sent straight away.
+
+    An ack with ``multiple=True`` covers every unacked delivery tag up to the one
+    sent, so a batch only ever goes up to the lowest delivery that is still being
+    handled. Deliveries completed after that wait for the next flush.
+    """
+
+    def __init__(self, channel: Channel, batch_size: int = 1, interval: int = 100) -> None:
+        """Define the channel, the batch size and the interval in milliseconds between flushes."""
+        self.channel = channel
+        self.batch_size = max(batch_size, 1)
+        self.interval = interval / 1000
+        self._unsettled: Set[int] = set()
+        self._done: List[int] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._timer: Union[None, threading.Thread] = None
+
+    def received(self, delivery_tag: int) -> None:
+        """Register a delivery that is being handled."""
+        with self._lock:
+            self._unsettled.add(delivery_tag)
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run, name="batch-acker", daemon=True)
+                self._timer.start()
+
+    def ack(self, delivery_tag: int) -> None:
+        """Mark a delivery as done, flushing if the batch is full."""
+        with self._lock:
+            self._unsettled.discard(delivery_tag)
+            self._done.append(delivery_tag)
+            full = len(self._done) >= self.batch_size
+        if full:
+            self.flush()
+
+    def reject(self, delivery_tag: int, requeue: bool = False) -> None:
+        """Reject a delivery straight away."""
+        with self._lock:
+            self._unsettled.discard(delivery_tag)
+            self.channel.basic.reject(delivery_tag=delivery_tag, requeue=requeue)
+
+    def flush(self) -> None:
+        """Ack every done delivery below the lowest one still being handled."""
+        with self._lock:
+            if not self._done:
+                return
+            floor = min(self._unsettled) if self._unsettled else None
+            ready = [tag for tag in self._done if floor is None or tag < floor]
+            if not ready:
+                return
+            self._done = [tag for tag in self._done if floor is not None and tag > floor]
+            try:
+                self.channel.basic.ack(delivery_tag=max(ready), multiple=True)
+            except AMQPError as error:
+                LOG.error(f"Could not ack {len(ready)} messages: {error}")
+                return
+        LOG.debug(f"Acked {len(ready)} messages up to delivery tag {max(ready)}.")
+
+    def close(self) -> None:
+        """Flush what is done and stop the timer."""
+        self._closed.set()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._closed.wait(self.interval):
+            self.flush()
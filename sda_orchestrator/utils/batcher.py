@@ -0,0 +1,56 @@
+"""Collect items per key and hand them over in batches."""
+
+import asyncio
+from typing import Callable, Dict, Generic, Hashable, List, TypeVar
+
+from .logger import LOG
+
+T = TypeVar("T")
+
+
+class KeyedBatcher(Generic[T]):
+    """Collect items per key on an event loop and flush each key's batch when it is full or old.
+
+    A batch is passed to ``flush`` once it holds ``size`` items or ``age`` seconds after its
+    first item was added, whichever comes first. ``add`` and ``flush_all`` have to be called
+    on the event loop the batches are timed on.
+    """
+
+    def __init__(self, flush: Callable[[Hashable, List[T]], None], size: int, age: float) -> None:
+        """Define the flush callback, the batch size and the maximum age of a batch in seconds."""
+        self._flush = flush
+        self.size = max(size, 1)
+        self.age = age
+        self._batches: Dict[Hashable, List[T]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+
+    def add(self, key: Hashable, item: T) -> None:
+        """Add an item to the batch of ``key``, flushing it if it is full."""
+        batch = self._batches.setdefault(key, [])
+        batch.append(item)
+        if len(batch) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.age, self.flush, key)
+        if len(batch) >= self.size:
+            self.flush(key)
+
+    def flush(self, key: Hashable) -> None:
+        """Hand over the batch of ``key``."""
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._batches.pop(key, [])
+        if not batch:
+            return
+        try:
+            self._flush(key, batch)
+        except Exception as error:
+            LOG.error(f"Flushing batch of {len(batch)} items for {key} failed: {error}")
+
+    def flush_all(self) -> None:
+        """Hand over every batch."""
+        for key in list(self._batches):
+            self.flush(key)
+
+    def __len__(self) -> int:
+        """Return the number of items waiting to be flushed."""
+        return sum(len(batch) for batch in self._batches.values())
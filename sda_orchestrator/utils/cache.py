@@ -0,0 +1,69 @@
+"""In-process cache with expiry and bounded size."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Tuple, TypeVar, Union
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """Least recently used cache whose entries expire after ``ttl`` seconds.
+
+    When ``maxsize`` entries are stored the least recently used one is evicted.
+    A ``ttl`` of ``None`` keeps entries until they are evicted or invalidated.
+    The cache is safe to share between threads.
+    """
+
+    def __init__(
+        self,
+        ttl: Union[None, float] = None,
+        maxsize: Union[None, int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Define entry lifetime, cache size and the clock used for expiry."""
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Union[None, V] = None) -> Union[None, V]:
+        """Return the value for ``key``, or ``default`` if it is missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < self.clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V, ttl: Union[None, float] = None) -> None:
+        """Store ``value`` under ``key``, ``ttl`` overrides the cache default."""
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.clock() + ttl if ttl is not None else float("inf")
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Union[None, Hashable] = None) -> None:
+        """Drop ``key``, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Check if ``key`` has a value that has not expired."""
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        """Return the number of stored entries, including expired ones not yet dropped."""
+        return len(self._data)
@@ -0,0 +1,168 @@
+"""Stop calling Datacite or REMS while they are down."""
+
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from os import environ
+from typing import Any, Awaitable, Callable, Coroutine, Type, TypeVar, Union
+
+from httpx import TransportError
+
+from .logger import LOG
+from .metrics import CIRCUIT_STATE
+
+T = TypeVar("T")
+
+STATES = {"closed": 0, "open": 1, "half-open": 2}
+
+
+class ServiceUnavailable(Exception):
+    """A dependency could not be reached or answered with a server error, the call can be retried later."""
+
+
+class CircuitOpen(ServiceUnavailable):
+    """The dependency failed too often recently, it is not called until the circuit closes."""
+
+
+class _Call:
+    """Server errors seen during one guarded call."""
+
+    __slots__ = ("breaker", "server_errors")
+
+    def __init__(self, breaker: "CircuitBreaker") -> None:
+        self.breaker = breaker
+        self.server_errors = 0
+
+
+# the guarded call HTTP responses are made for, read by the response hook of the HTTP client
+CALL: ContextVar[Union[None, _Call]] = ContextVar("circuit_call", default=None)
+
+
+def record_response(status_code: int) -> None:
+    """Count a server error response for the guarded call in progress."""
+    call = CALL.get()
+    if call is not None and status_code >= 500:
+        call.server_errors += 1
+
+
+class CircuitBreaker:
+    """Fail calls to a dependency fast once it is down.
+
+    After ``failure_threshold`` calls in a row fail because the dependency could not be
+    reached or answered with a server error, the circuit opens and calls raise
+    ``CircuitOpen`` straight away. After ``reset_timeout`` seconds one call is let
+    through, the circuit closes again if it succeeds.
+
+    Calls failing for other reasons, rejected payloads or missing records, show the
+    dependency is up and do not count as failures.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        """Define after how many failures the circuit opens and how long it stays open."""
+        self.name = name
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = "closed"
+        self._trial = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(STATES["closed"], dependency=name)
+
+    @classmethod
+    def from_environ(cls: Type["CircuitBreaker"], name: str) -> "CircuitBreaker":
+        """Create a breaker configured from environment variables."""
+        return cls(
+            name,
+            failure_threshold=int(environ.get("CIRCUIT_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(environ.get("CIRCUIT_RESET_TIMEOUT", 30.0)),
+        )
+
+    @property
+    def state(self) -> str:
+        """Return closed, open or half-open, half-open once the circuit is open for ``reset_timeout``."""
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state("half-open")
+            return self._state
+
+    def allow(self) -> None:
+        """Raise ``CircuitOpen`` unless the dependency can be called now."""
+        state = self.state
+        with self._lock:
+            if state == "closed":
+                return
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return
+            retry_in = max(self.opened_at + self.reset_timeout - time.monotonic(), 0)
+        raise CircuitOpen(f"{self.name} is unavailable, not calling it for {retry_in:.0f} seconds.")
+
+    def success(self) -> None:
+        """Record a call that reached the dependency."""
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            if self._state != "closed":
+                LOG.info(f"{self.name} is available again, closing the circuit.")
+                self._set_state("closed")
+
+    def failure(self) -> None:
+        """Record a call that failed because the dependency is down."""
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self._state == "half-open" or self.failures >= self.failure_threshold:
+                if self._state != "open":
+                    LOG.error(f"{self.name} failed {self.failures} times, opening the circuit.")
+                self.opened_at = time.monotonic()
+                self._set_state("open")
+
+    def guard(self, func: Callable[..., Awaitable[T]]) -> Callable[..., Coroutine[Any, Any, T]]:
+        """Decorate a coroutine calling the dependency.
+
+        It raises ``CircuitOpen`` while the circuit is open, and ``ServiceUnavailable``
+        instead of the original error if the dependency could not be reached or
+        answered with a server error.
+        """
+
+        @wraps(func)
+        async def wrapper(*args: object, **kwargs: object) -> T:
+            outer = CALL.get()
+            if outer is not None and outer.breaker is self:
+                # already guarded by an outer call to the same dependency
+                return await func(*args, **kwargs)
+            self.allow()
+            call = _Call(self)
+            token = CALL.set(call)
+            try:
+                result = await func(*args, **kwargs)
+            except TransportError as error:
+                self.failure()
+                raise ServiceUnavailable(f"{self.name} could not be reached: {error}") from error
+            except Exception as error:
+                if call.server_errors:
+                    self.failure()
+                    raise ServiceUnavailable(f"{self.name} answered with a server error: {error}") from error
+                self.success()
+                raise
+            except BaseException:
+                # cancelled, says nothing about the dependency
+                with self._lock:
+                    self._trial = False
+                raise
+            finally:
+                CALL.reset(token)
+            self.success()
+            return result
+
+        return wrapper
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        CIRCUIT_STATE.set(STATES[state], dependency=self.name)
+
+
+DATACITE = CircuitBreaker.from_environ("datacite")
+REMS = CircuitBreaker.from_environ("rems")
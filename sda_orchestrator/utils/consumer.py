@@ -1,22 +1,87 @@
 """Message Broker Consumer class."""
 
 import time
+import threading
+import signal
 from os import environ
-import json
 import ssl
 from pathlib import Path
-from typing import Union
+from types import FrameType
+from typing import Any, Callable, Dict, List, Tuple, Union
 from distutils.util import strtobool
 
-from amqpstorm import Connection, AMQPError, Message
+from amqpstorm import Channel, Connection, AMQPError, Message
+from amqpstorm.base import IDLE_WAIT
 
-from .logger import LOG
+from .logger import LOG, Fields
+from .publisher import Publisher
+from .acker import BatchAcker
+from .shared_connection import SharedConnection
+from .metrics import (
+    BROKER_RECOVERY_SECONDS,
+    HANDLE_SECONDS,
+    MESSAGES,
+    PUBLISH_SECONDS,
+    RECONNECTS,
+    RETRIES,
+    serve_from_environ,
+)
+from .failover import BrokerEndpoints, backoff
+from .tls import ResumingSSLContext
+from .circuit_breaker import ServiceUnavailable
 from jsonschema.exceptions import ValidationError
-from ..schemas.validate import ValidateJSON, load_schema
+from ..schemas.validate import SCHEMAS
+from . import messages
+
+
+class Delivery:
+    """Track an inbound message until it can be acked or rejected.
+
+    A message is settled only once it has been handled and every message
+    published on its behalf has been confirmed by the broker.
+    """
+
+    __slots__ = ("message", "acker", "pending", "confirmed", "handled", "rejected", "requeue", "received", "payload")
+
+    def __init__(self, message: Message, acker: Union[None, BatchAcker] = None) -> None:
+        """Start tracking a message, ``acker`` batches its ack if set."""
+        self.message = message
+        self.acker = acker
+        self.pending = 0
+        self.confirmed = True
+        self.handled = False
+        self.rejected = False
+        self.requeue = False
+        self.received = time.monotonic()
+        self.payload: Union[None, Dict] = None
+
+
+# header counting how often a message was parked on a retry queue
+RETRY_HEADER = "x-retry-attempt"
 
 
 class Consumer:
-    """CEGA message consumer."""
+    """CEGA message consumer.
+
+    Messages failing because Datacite or REMS is unavailable are not sent to the error
+    queue but parked on ``{queue}.retry.{delay}``, a queue without consumers whose
+    messages expire after ``delay`` milliseconds and are then dead-lettered back to ``queue``.
+    The delay is ``RETRY_DELAY`` seconds, doubled on every attempt. Naming the queues by
+    their delay means a changed ``RETRY_DELAY`` declares new queues instead of redeclaring
+    existing ones with another TTL, which the broker refuses. After ``RETRY_MAX_ATTEMPTS``
+    attempts, 0 disables parking, the message is reported to the error queue.
+
+    On SIGTERM, SIGINT or SIGHUP, or when ``stop`` is called, the consumer drains: it stops
+    taking deliveries and gives the messages it already received ``BROKER_DRAIN_TIMEOUT``
+    seconds to be handled, published and settled before it closes. A second signal stops
+    it without waiting.
+
+    Messages are validated with jsonschema, or with validators generated from the
+    schemas if ``SCHEMA_VALIDATOR`` is ``compiled``.
+    """
+
+    # Message schemas this consumer validates against, checked when it is created
+    schemas: Tuple[str, ...] = ("ingestion-user-error",)
 
     def __init__(
         self,
@@ -28,7 +93,10 @@ class Consumer:
         max_retries: Union[None, int] = None,
         vhost: str = "/",
     ) -> None:
-        """Consumer init function."""
+        """Consumer init function.
+
+        ``hostname`` can list several broker nodes, ``host[:port]`` separated by commas.
+        """
         self.hostname = hostname
         self.username = username
         self.password = password
@@ -36,9 +104,19 @@ class Consumer:
         self.queue = queue
         self.vhost = vhost
         self.max_retries = max_retries
-        self.connection = None
+        self.endpoints = BrokerEndpoints(hostname, port)
+        # reconnect delays grow from BROKER_RECONNECT_DELAY to BROKER_RECONNECT_MAX_DELAY seconds
+        self.reconnect_delay = float(environ.get("BROKER_RECONNECT_DELAY", 0.5))
+        self.reconnect_max_delay = float(environ.get("BROKER_RECONNECT_MAX_DELAY", 30))
+        self.connection: Union[None, Connection] = None
+        # set when the connection is shared with consumers of other stages in this process
+        self.shared: Union[None, SharedConnection] = None
+        self.channel = None
+        # set by ``stop``, also cuts reconnect backoff short
+        self._stopped = threading.Event()
         self.ssl = bool(strtobool(environ.get("BROKER_SSL", "True")))
-        context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
+        # resumes TLS sessions, so reconnecting after a broker restart skips the full handshake
+        context = ResumingSSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
         context.check_hostname = False
         cacertfile = Path(environ.get("SSL_CACERT", "/tls/certs/ca.crt"))
         certfile = Path(environ.get("SSL_CLIENTCERT", "/tls/certs/orch.crt"))
@@ -52,71 +130,412 @@ class Consumer:
         if certfile.exists():
             context.load_cert_chain(str(certfile), keyfile=str(keyfile))
         self.ssl_context = {"context": context, "server_hostname": None, "check_hostname": False}
+        self.exchange = environ.get("BROKER_EXCHANGE", "sda")
+        self.publisher = Publisher(
+            confirm=bool(strtobool(environ.get("BROKER_PUBLISH_CONFIRM", "False"))),
+            window=int(environ.get("BROKER_PUBLISH_WINDOW", 64)),
+            stopping=lambda: self.stopping,
+        )
+        # basic.qos, 0 means no limit
+        self.prefetch_count = int(environ.get("BROKER_PREFETCH_COUNT", 0))
+        self.prefetch_size = int(environ.get("BROKER_PREFETCH_SIZE", 0))
+        # ack in batches of BROKER_ACK_BATCH_SIZE messages or every BROKER_ACK_BATCH_INTERVAL ms
+        self.ack_batch_size = int(environ.get("BROKER_ACK_BATCH_SIZE", 1))
+        self.ack_batch_interval = int(environ.get("BROKER_ACK_BATCH_INTERVAL", 100))
+        self._acker: Union[None, BatchAcker] = None
+        self.confirm_timeout = float(environ.get("BROKER_CONFIRM_TIMEOUT", 10))
+        self.retry_delay = float(environ.get("RETRY_DELAY", 30))
+        self.retry_max_attempts = int(environ.get("RETRY_MAX_ATTEMPTS", 5))
+        self._deliveries: Dict[int, Delivery] = {}
+        self._deliveries_lock = threading.Lock()
+        # notified when a delivery is handled or settled
+        self._deliveries_changed = threading.Condition(self._deliveries_lock)
+        self.drain_timeout = float(environ.get("BROKER_DRAIN_TIMEOUT", 20))
+        SCHEMAS.require(self.schemas)
 
     def create_connection(self) -> None:
-        """Create a connection.
+        """Create a connection, or get a new one from the shared connection.
 
         :return:
         """
+        if self.shared is not None:
+            self.connection = self.shared.get(stale=self.connection)
+        else:
+            self.connection = self.open_connection()
+        if self.connection is not None:
+            self.publisher.reset(self.connection)
+
+    def open_connection(self) -> Union[None, Connection]:
+        """Open a connection to one of the broker nodes, retrying up to ``max_retries`` times.
+
+        Every attempt tries the nodes healthiest first, attempts are spread out with
+        a random delay growing exponentially. Gives up as soon as the consumer is stopped.
+
+        :return: the connection, or None if it could not be opened
+        """
         attempts = 0
-        while True:
-            attempts += 1
-            try:
-                self.connection = Connection(
-                    self.hostname,
-                    self.username,
-                    self.password,
-                    port=self.port,
-                    ssl=self.ssl,
-                    ssl_options=self.ssl_context,
-                    virtual_host=self.vhost,
-                )
-                LOG.info("Established connection with AMQP server {0}".format(self.connection))
-                break
-            except AMQPError as error:
-                LOG.error("Something went wrong: {0}".format(error))
+        try:
+            while not self.stopping:
+                attempts += 1
+                for endpoint in self.endpoints.order():
+                    if self.stopping:
+                        return None
+                    try:
+                        connection = Connection(
+                            endpoint.host,
+                            self.username,
+                            self.password,
+                            port=endpoint.port,
+                            ssl=self.ssl,
+                            ssl_options=self.ssl_context,
+                            virtual_host=self.vhost,
+                        )
+                    except AMQPError as error:
+                        self.endpoints.failed(endpoint)
+                        LOG.error(f"Could not connect to {endpoint}: {error}")
+                        continue
+                    self.endpoints.succeeded(endpoint)
+                    LOG.info(f"Established connection with AMQP server {endpoint}")
+                    return connection
                 if self.max_retries and attempts > self.max_retries:
-                    break
-                time.sleep(min(attempts * 2, 30))
-            except KeyboardInterrupt:
-                break
+                    return None
+                # returns early when the consumer is stopped
+                self._stopped.wait(backoff(attempts, self.reconnect_delay, self.reconnect_max_delay))
+        except KeyboardInterrupt:
+            pass
+        return None
 
     def start(self) -> None:
         """Start the Consumer.
 
+        Runs until ``stop`` is called or the process gets SIGTERM or SIGINT, then drains and closes.
+
         :return:
         """
+        serve_from_environ()
+        previous = self._handle_signals()
+        try:
+            self._run()
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.close()
+
+    def _run(self) -> None:
         if not self.connection:
             self.create_connection()
-        while True:
+        lost_at = None
+        while not self.stopping:
             try:
-                channel = self.connection.channel()  # type: ignore
+                self.channel = channel = self.connection.channel()  # type: ignore
+                if self.prefetch_count or self.prefetch_size:
+                    channel.basic.qos(prefetch_count=self.prefetch_count, prefetch_size=self.prefetch_size)
+                self._acker = (
+                    BatchAcker(channel, self.ack_batch_size, self.ack_batch_interval)
+                    if self.ack_batch_size > 1
+                    else None
+                )
                 channel.basic.consume(self, self.queue, no_ack=False)
                 LOG.info("Connected to queue {0}".format(self.queue))
-                channel.start_consuming(to_tuple=False)
+                if lost_at is not None:
+                    recovery = time.monotonic() - lost_at
+                    BROKER_RECOVERY_SECONDS.observe(recovery, queue=self.queue)
+                    LOG.info(f"Consuming from {self.queue} again {recovery:.2f} seconds after losing the broker.")
+                    lost_at = None
+                self._consume(channel)
+                if self.stopping:
+                    self._drain(channel)
                 if not channel.consumer_tags:
+                    self._close_acker()
                     channel.close()
             except AMQPError as error:
+                # acks pending on the lost channel are redelivered by the broker
+                self._close_acker()
+                self.discard()
+                if self.stopping:
+                    break
                 LOG.error("Something went wrong: {0}".format(error))
+                RECONNECTS.inc(queue=self.queue)
+                if lost_at is None:
+                    lost_at = time.monotonic()
                 self.create_connection()
             except KeyboardInterrupt:
-                self.connection.close()  # type: ignore
+                self.stopping = True
+
+    def _consume(self, channel: Channel) -> None:
+        """Handle deliveries until the consumer is stopped, the broker cancels it or the channel closes."""
+        while not self.stopping and channel.consumer_tags and not channel.is_closed:
+            for message in channel.build_inbound_messages(break_on_empty=True):
+                self(message)
+                if self.stopping:
+                    break
+            else:
+                if not self.dispatch():
+                    time.sleep(IDLE_WAIT)
+                    continue
+                # going back to the channel sleeps IDLE_WAIT once it is empty, so buffered
+                # messages are handled until new deliveries are waiting
+                while not self.stopping and not getattr(channel, "_inbound", None) and self.dispatch():
+                    pass
+
+    def _drain(self, channel: Channel) -> None:
+        """Cancel the consumer and settle the messages already delivered, waiting at most ``drain_timeout`` seconds.
+
+        Messages the broker sent before the cancel are handled, then the consumer waits for
+        handlers still running, sends batched publishes and waits for the broker to confirm
+        them. Messages not settled by the deadline are redelivered once the channel closes.
+        """
+        started = time.monotonic()
+        deadline = started + self.drain_timeout
+        LOG.info(f"Draining {self.queue}, waiting up to {self.drain_timeout} seconds for messages in flight.")
+        channel.stop_consuming()
+        for message in channel.build_inbound_messages(break_on_empty=True):
+            if time.monotonic() >= deadline:
                 break
+            self(message)
+        while time.monotonic() < deadline and self.dispatch():
+            pass
+        self._wait_for_deliveries(lambda: all(delivery.handled for delivery in self._deliveries.values()), deadline)
+        self.flush()
+        if self._wait_for_deliveries(lambda: not self._deliveries, deadline):
+            LOG.info(f"Drained {self.queue} in {time.monotonic() - started:.2f} seconds.")
+        else:
+            LOG.warning(
+                f"{len(self._deliveries)} messages from {self.queue} not settled after {self.drain_timeout} seconds, "
+                "the broker redelivers them."
+            )
+
+    def _wait_for_deliveries(self, predicate: Callable[[], bool], deadline: float) -> bool:
+        """Wait until ``predicate`` on the tracked deliveries holds or ``deadline`` passes."""
+        with self._deliveries_changed:
+            return self._deliveries_changed.wait_for(predicate, timeout=max(deadline - time.monotonic(), 0))
+
+    def flush(self) -> None:
+        """Send publishes held back to be batched, called when draining once every handler is done."""
+        pass
+
+    def dispatch(self) -> bool:
+        """Handle one message buffered by ``__call__``, return ``False`` if none is buffered.
+
+        Called whenever every delivery received so far has been passed to ``__call__``,
+        repeatedly until nothing is buffered or new deliveries are waiting.
+        """
+        return False
+
+    def discard(self) -> None:
+        """Drop messages buffered by ``__call__``, called when their channel is lost and the broker redelivers them."""
+        pass
+
+    @property
+    def stopping(self) -> bool:
+        """Check if the consumer is stopped or being stopped."""
+        return self._stopped.is_set()
+
+    @stopping.setter
+    def stopping(self, value: bool) -> None:
+        if value:
+            self._stopped.set()
+        else:
+            self._stopped.clear()
+
+    def stop(self) -> None:
+        """Stop consuming, ``start`` then drains and closes the consumer and returns.
+
+        Can be called from another thread than the one running ``start``, or from a signal handler.
+        """
+        self.stopping = True
+
+    def _handle_signals(self) -> Dict[int, Any]:
+        """Drain on SIGTERM, SIGINT and SIGHUP if running in the main thread, return the handlers replaced."""
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+        signums = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        return {signum: signal.signal(signum, self._signal) for signum in signums}
+
+    def _signal(self, signum: int, frame: Union[None, FrameType]) -> None:
+        if self.stopping:
+            # signalled again while draining, stop without waiting for messages in flight
+            signal.default_int_handler(signum, frame)
+        LOG.info(f"Received signal {signum}, stopping {self.queue} consumer.")
+        self.stop()
+
+    def close(self) -> None:
+        """Wait for publishes to be confirmed, send pending acks and close the publishing channel and the connection."""
+        if not self.publisher.wait_for_confirms(timeout=self.confirm_timeout):
+            LOG.error(f"Closing with {self.publisher.unconfirmed} publishes not confirmed by the broker.")
+        self._close_acker()
+        self.publisher.close()
+        if self.connection and self.shared is None:
+            self.connection.close()
 
     def handle_message(self, message: Message) -> None:
         """Handle message."""
         pass
 
-    def _error_message(self, message: Message, reason: str) -> None:
-        """Send formated error message to error queue."""
-        channel = self.connection.channel()  # type: ignore
-        properties = {
+    def _close_acker(self) -> None:
+        if self._acker:
+            self._acker.close()
+            self._acker = None
+
+    def _properties(self, message: Message) -> Dict:
+        """Properties of a message published in response to ``message``."""
+        return {
             "content_type": "application/json",
             "headers": {},
             "correlation_id": message.correlation_id,
             "delivery_mode": 2,
         }
-        original_message = json.loads(message.body)
+
+    def _decode(self, message: Message) -> Dict:
+        """Return the decoded body of ``message``, decoding it once for the handler and the error path."""
+        with self._deliveries_lock:
+            delivery = self._deliveries.get(id(message))
+        if delivery is not None and delivery.payload is not None:
+            return delivery.payload
+        payload = messages.loads(message.body)
+        if delivery is not None:
+            delivery.payload = payload
+        return payload
+
+    def _publish(
+        self,
+        message: Message,
+        body: Union[str, bytes],
+        routing_key: str,
+        exchange: Union[None, str] = None,
+        properties: Union[None, Dict] = None,
+    ) -> None:
+        """Publish ``body`` on the shared publishing channel on behalf of ``message``.
+
+        If ``message`` is being tracked, it is only settled once the broker has confirmed the publish.
+        """
+        delivery = self._hold(message)
+        held = [delivery] if delivery else []
+        try:
+            self._publish_held(message, held, body, routing_key, exchange, properties)
+        except Exception:
+            if delivery:
+                with self._deliveries_lock:
+                    delivery.pending -= 1
+            raise
+
+    def _hold(self, message: Message) -> Union[None, Delivery]:
+        """Keep a tracked message from being settled until ``_confirmed`` is called for it."""
+        with self._deliveries_lock:
+            delivery = self._deliveries.get(id(message))
+            if delivery:
+                delivery.pending += 1
+        return delivery
+
+    def _publish_held(
+        self,
+        message: Message,
+        held: List[Delivery],
+        body: Union[str, bytes],
+        routing_key: str,
+        exchange: Union[None, str] = None,
+        properties: Union[None, Dict] = None,
+    ) -> None:
+        """Publish ``body`` with the properties of ``message``, releasing the ``held`` deliveries once confirmed.
+
+        ``exchange`` and ``properties`` default to the consumer exchange and the properties of a response.
+        """
+        if self.publisher.connection is None:
+            self.publisher.reset(self.connection)
+
+        started = time.monotonic()
+
+        def on_confirm(acked: bool) -> None:
+            PUBLISH_SECONDS.observe(time.monotonic() - started, routing_key=routing_key)
+            for delivery in held:
+                self._confirmed(delivery, acked)
+
+        self.publisher.publish(
+            body,
+            routing_key,
+            exchange=self.exchange if exchange is None else exchange,
+            properties=self._properties(message) if properties is None else properties,
+            on_confirm=on_confirm,
+        )
+
+    def _track(self, message: Message) -> Delivery:
+        delivery = Delivery(message, self._acker)
+        MESSAGES.inc(queue=self.queue, outcome="received")
+        if delivery.acker:
+            delivery.acker.received(message.delivery_tag)
+        with self._deliveries_lock:
+            self._deliveries[id(message)] = delivery
+        return delivery
+
+    def _untrack(self, delivery: Delivery) -> None:
+        """Stop tracking a message that will not be settled on this channel."""
+        with self._deliveries_lock:
+            self._deliveries.pop(id(delivery.message), None)
+            self._deliveries_changed.notify_all()
+
+    def _finish(self, delivery: Delivery, rejected: bool = False, requeue: bool = False) -> None:
+        """Mark a delivery as handled, settle it if nothing is waiting for a confirm.
+
+        With ``requeue`` the message is given back to the broker to be handled again.
+        """
+        HANDLE_SECONDS.observe(time.monotonic() - delivery.received, queue=self.queue)
+        with self._deliveries_lock:
+            delivery.handled = True
+            delivery.rejected = rejected
+            delivery.requeue = requeue
+            ready = delivery.pending == 0
+            self._deliveries_changed.notify_all()
+        if ready:
+            self._settle(delivery)
+
+    def _confirmed(self, delivery: Delivery, acked: bool) -> None:
+        """Record a broker confirm for a message published on behalf of ``delivery``."""
+        with self._deliveries_lock:
+            delivery.pending -= 1
+            delivery.confirmed = delivery.confirmed and acked
+            ready = delivery.handled and delivery.pending == 0
+        if ready:
+            self._settle(delivery)
+
+    def _settle(self, delivery: Delivery) -> None:
+        """Ack or reject a handled message.
+
+        If the broker did not confirm what we published for it, the message is requeued to be handled again.
+        """
+        with self._deliveries_lock:
+            self._deliveries.pop(id(delivery.message), None)
+            self._deliveries_changed.notify_all()
+        try:
+            if delivery.requeue:
+                self._reject(delivery, requeue=True)
+                outcome = "requeued"
+            elif not delivery.confirmed:
+                LOG.error(f"Published messages not confirmed, requeue (corr-id: {delivery.message.correlation_id}).")
+                self._reject(delivery, requeue=True)
+                outcome = "requeued"
+            elif delivery.rejected:
+                self._reject(delivery, requeue=False)
+                outcome = "rejected"
+            elif delivery.acker:
+                delivery.acker.ack(delivery.message.delivery_tag)
+                outcome = "acked"
+            else:
+                delivery.message.ack()
+                outcome = "acked"
+            MESSAGES.inc(queue=self.queue, outcome=outcome)
+        except AMQPError as error:
+            LOG.error(f"Could not settle message (corr-id: {delivery.message.correlation_id}): {error}")
+
+    @staticmethod
+    def _reject(delivery: Delivery, requeue: bool) -> None:
+        if delivery.acker:
+            delivery.acker.reject(delivery.message.delivery_tag, requeue=requeue)
+        else:
+            delivery.message.reject(requeue=requeue)
+
+    def _error_message(self, message: Message, reason: str) -> None:
+        """Send formated error message to error queue."""
+        original_message = self._decode(message)
 
         error_trigger = {
             "user": original_message["user"],
@@ -130,32 +549,92 @@ class Consumer:
         if "decrypted_checksums" in original_message:
             error_trigger["decrypted_checksums"] = original_message["decrypted_checksums"]
 
-        error_msg = json.dumps(error_trigger)
-        LOG.debug(f"Error Message: {error_msg}")
-        ValidateJSON(load_schema("ingestion-user-error")).validate(json.loads(error_msg))
+        LOG.debug("Error Message: %s", error_trigger)
+        error_msg = messages.build("ingestion-user-error", error_trigger)
 
-        error = Message.create(channel, error_msg, properties)
-        error.publish(environ.get("ERROR_QUEUE", "error"), exchange=environ.get("BROKER_EXCHANGE", "sda"))
-
-        channel.close()
+        self._publish(message, error_msg, environ.get("ERROR_QUEUE", "error"))
 
         LOG.info(
-            f"Published error message (corr-id: {message.correlation_id} filepath: {original_message['filepath']}, ",
-            f"user: {original_message['user']}, with reason: {str(reason)})",
+            "Published error message %s",
+            Fields(
+                corr_id=message.correlation_id,
+                filepath=original_message["filepath"],
+                user=original_message["user"],
+                reason=reason,
+            ),
+        )
+
+    def _retry_later(self, delivery: Delivery, error: ServiceUnavailable) -> bool:
+        """Park a message on the retry queue for the delay of its next attempt, return ``False`` if it is not retried.
+
+        The message is acked once the broker has confirmed the copy on the retry queue.
+        """
+        message = delivery.message
+        headers = dict((message.properties or {}).get("headers") or {})
+        attempt = int(headers.get(RETRY_HEADER, 0)) + 1
+        if attempt > self.retry_max_attempts:
+            LOG.error(f"Giving up after {attempt - 1} retries (corr-id: {message.correlation_id}).")
+            return False
+        delay = self.retry_delay * 2 ** (attempt - 1)
+        retry_queue = f"{self.queue}.retry.{int(delay * 1000)}"
+        properties = self._properties(message)
+        properties["headers"] = {**headers, RETRY_HEADER: attempt}
+        try:
+            self.publisher.declare_queue(
+                retry_queue,
+                {
+                    "x-message-ttl": int(delay * 1000),
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue,
+                },
+            )
+            self._publish(message, message.body, retry_queue, exchange="", properties=properties)
+        except Exception as publish_error:
+            LOG.error(f"Could not park message on {retry_queue}: {publish_error}")
+            return False
+        RETRIES.inc(queue=self.queue, attempt=str(attempt))
+        LOG.warning(
+            "Retrying later %s",
+            Fields(corr_id=message.correlation_id, attempt=attempt, delay=delay, reason=error),
         )
+        self._finish(delivery)
+        return True
+
+    def _failed(self, delivery: Delivery, error: BaseException) -> None:
+        """Report a message that could not be handled to the error queue and reject it.
+
+        Messages that failed because a dependency is unavailable are retried later instead,
+        those that failed because the broker was lost are requeued.
+        """
+        if isinstance(error, AMQPError):
+            LOG.error(f"Lost the broker handling a message, requeue (corr-id: {delivery.message.correlation_id}).")
+            self._finish(delivery, requeue=True)
+            return
+        if isinstance(error, ServiceUnavailable) and self.retry_max_attempts:
+            if self._retry_later(delivery, error):
+                return
+        try:
+            self._error_message(delivery.message, str(error))
+        except ValidationError:
+            LOG.error("Could not validate the error message. Not properly formatted.")
+        except Exception as error:
+            LOG.error(error)
+        finally:
+            self._finish(delivery, rejected=True)
 
     def __call__(self, message: Message) -> None:
         """Process the message body."""
+        self._handle(self._track(message))
+
+    def _handle(self, delivery: Delivery) -> None:
+        """Handle a tracked message and settle it."""
         try:
-            self.handle_message(message)
+            self.handle_message(delivery.message)
+        except AMQPError:
+            # the broker is gone, the message is handled again once it is redelivered
+            self._finish(delivery, requeue=True)
+            raise
         except (ValidationError, Exception) as error:
-            try:
-                self._error_message(message, str(error))
-            except ValidationError:
-                LOG.error("Could not validate the error message. Not properly formatted.")
-            except Exception as error:
-                LOG.error(error)
-            finally:
-                message.reject(requeue=False)
+            self._failed(delivery, error)
         else:
-            message.ack()
+            self._finish(delivery)
@@ -0,0 +1,87 @@
+"""Durable record of registered datasets."""
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from os import environ
+from typing import Dict, List, Type, Union
+
+from .logger import LOG
+
+COLUMNS = ("dataset_id", "doi_suffix", "full_doi", "rems_resource_id", "rems_catalogue_item_id", "state", "updated")
+
+
+class DatasetStore:
+    """SQLite store of the datasets registered at Datacite and REMS.
+
+    For every dataset it records the DOI, the REMS resource and catalogue item ids and
+    the last DOI state set, so that after a restart known datasets need no calls to
+    Datacite or REMS. The database is opened in WAL mode so it can be read with the
+    ``sdastore`` command while consumers write to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open or create the store at ``path``."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS datasets (
+                dataset_id TEXT PRIMARY KEY,
+                doi_suffix TEXT,
+                full_doi TEXT,
+                rems_resource_id INTEGER,
+                rems_catalogue_item_id INTEGER,
+                state TEXT,
+                updated TEXT
+            )""")
+        LOG.info(f"Opened dataset store {path}.")
+
+    @classmethod
+    def from_environ(cls: Type["DatasetStore"]) -> Union[None, "DatasetStore"]:
+        """Open the store configured with ``DATASET_STORE``, if any."""
+        path = environ.get("DATASET_STORE")
+        return cls(path) if path else None
+
+    def get(self, dataset_id: str) -> Union[None, Dict]:
+        """Return the record of a dataset."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM datasets WHERE dataset_id = ?", (dataset_id,)).fetchone()
+        return dict(row) if row else None
+
+    def all(self) -> List[Dict]:
+        """Return every record."""
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM datasets ORDER BY dataset_id").fetchall()
+        return [dict(row) for row in rows]
+
+    def update(self, dataset_id: str, **fields: Union[None, str, int]) -> None:
+        """Create or update the record of a dataset with the given fields."""
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown dataset store fields: {', '.join(sorted(unknown))}")
+        fields["updated"] = datetime.now(timezone.utc).isoformat()
+        names = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        assignments = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO datasets (dataset_id, {names}) VALUES (?, {placeholders}) "  # nosec
+                f"ON CONFLICT(dataset_id) DO UPDATE SET {assignments}",
+                (dataset_id, *fields.values()),
+            )
+
+    def delete(self, dataset_id: Union[None, str] = None) -> None:
+        """Delete the record of a dataset, or every record if no dataset is given."""
+        with self._lock:
+            if dataset_id is None:
+                self._db.execute("DELETE FROM datasets")
+            else:
+                self._db.execute("DELETE FROM datasets WHERE dataset_id = ?", (dataset_id,))
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,163 @@
+"""Drop inbox events repeating one seen shortly before, and remember the ingestions triggered."""
+
+import json
+import sqlite3
+import threading
+import time
+from os import environ
+from typing import Callable, Dict, Tuple, Type, Union
+
+from .cache import TTLCache
+from .logger import LOG
+
+# expired keys are deleted from the shared store after this many writes
+PURGE_EVERY = 1000
+
+
+def upload_key(event: Dict) -> str:
+    """Return the key identifying an upload event: the user, the file path and its encrypted checksums."""
+    checksums = sorted(f"{checksum['type']}:{checksum['value']}" for checksum in event.get("encrypted_checksums", []))
+    return "\0".join([event["user"], event["filepath"], *checksums])
+
+
+class SeenStore:
+    """SQLite record of claimed keys and remembered values, shared by the worker processes on a host.
+
+    Keys expire at a wall clock time, so every process agrees on when they do.
+    The database is opened in WAL mode so processes can write concurrently.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time) -> None:
+        """Open or create the store at ``path``."""
+        self.path = path
+        self.clock = clock
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, expires REAL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS remembered (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        LOG.info(f"Opened shared inbox store {path}.")
+
+    def claim(self, key: str, ttl: float) -> bool:
+        """Record ``key`` for ``ttl`` seconds, return ``False`` if another claim on it has not expired."""
+        now = self.clock()
+        with self._lock:
+            claimed = self._db.execute(
+                "INSERT INTO seen (key, expires) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires = excluded.expires WHERE seen.expires < ?",
+                (key, now + ttl, now),
+            ).rowcount
+            self._written(now)
+        return claimed == 1
+
+    def release(self, key: str) -> None:
+        """Drop the claim on ``key``."""
+        with self._lock:
+            self._db.execute("DELETE FROM seen WHERE key = ?", (key,))
+
+    def remember(self, key: str, value: str, ttl: float) -> None:
+        """Keep ``value`` under ``key`` for ``ttl`` seconds."""
+        now = self.clock()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO remembered VALUES (?, ?, ?)", (key, value, now + ttl))
+            self._written(now)
+
+    def recall(self, key: str) -> Union[None, str]:
+        """Return the value kept under ``key``, or None if there is none or it expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM remembered WHERE key = ? AND expires >= ?", (key, self.clock())
+            ).fetchone()
+        return row[0] if row else None
+
+    def forget(self, key: str) -> None:
+        """Drop the value kept under ``key``."""
+        with self._lock:
+            self._db.execute("DELETE FROM remembered WHERE key = ?", (key,))
+
+    def _written(self, now: float) -> None:
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self._db.execute("DELETE FROM seen WHERE expires < ?", (now,))
+            self._db.execute("DELETE FROM remembered WHERE expires < ?", (now,))
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
+
+
+class Deduplicator:
+    """Claim event keys for ``ttl`` seconds, so an event repeated within that time can be dropped.
+
+    Keys are kept in an in-process LRU cache of ``maxsize`` entries. With a ``store`` they
+    are claimed there as well, so a repeat is caught whichever worker process gets it.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000, store: Union[None, SeenStore] = None) -> None:
+        """Define how long keys are remembered, how many are cached in the process and the shared store."""
+        self.ttl = ttl
+        self.store = store
+        self._seen: TTLCache[bool] = TTLCache(ttl=ttl, maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls: Type["Deduplicator"], store: Union[None, SeenStore] = None) -> Union[None, "Deduplicator"]:
+        """Create the deduplicator configured with ``INBOX_DEDUP_TTL``, ``None`` if it is 0 or not set."""
+        ttl = float(environ.get("INBOX_DEDUP_TTL", 0))
+        if ttl <= 0:
+            return None
+        return cls(ttl, int(environ.get("INBOX_DEDUP_SIZE", 10000)), store)
+
+    def claim(self, key: str) -> bool:
+        """Record ``key``, return ``False`` if it was claimed less than ``ttl`` seconds ago."""
+        with self._lock:
+            if key in self._seen:
+                return False
+            self._seen.set(key, True)
+        if self.store is not None and not self.store.claim(key, self.ttl):
+            return False
+        return True
+
+    def release(self, key: str) -> None:
+        """Forget ``key``, for an event that could not be handled and should not suppress its repeats."""
+        self._seen.invalidate(key)
+        if self.store is not None:
+            self.store.release(key)
+
+    def close(self) -> None:
+        """Close the shared store."""
+        if self.store is not None:
+            self.store.close()
+
+
+class SharedTriggers:
+    """Ingest triggers by user and file path, kept in a shared store for ``ttl`` seconds.
+
+    Looked up like a ``TTLCache``, so an ingestion triggered by one worker process can be
+    cancelled by another.
+    """
+
+    def __init__(self, store: SeenStore, ttl: float) -> None:
+        """Define the store and how long triggers are kept."""
+        self.store = store
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(key: Tuple[str, str]) -> str:
+        return "trigger\0" + "\0".join(key)
+
+    def get(self, key: Tuple[str, str]) -> Union[None, Dict]:
+        """Return the trigger for ``(user, filepath)``, or None."""
+        value = self.store.recall(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: Tuple[str, str], trigger: Dict) -> None:
+        """Keep the trigger for ``(user, filepath)``."""
+        self.store.remember(self._key(key), json.dumps(trigger), self.ttl)
+
+    def invalidate(self, key: Tuple[str, str]) -> None:
+        """Drop the trigger for ``(user, filepath)``."""
+        self.store.forget(self._key(key))
@@ -0,0 +1,61 @@
+"""Persistent asyncio event loop running in a background thread."""
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, TypeVar, Union
+
+from .logger import LOG
+
+try:
+    import uvloop
+except ImportError:  # pragma: no cover
+    uvloop = None  # type: ignore
+
+T = TypeVar("T")
+
+
+class LoopThread:
+    """Run one event loop for the lifetime of a consumer.
+
+    Coroutines are submitted from the consumer thread and run on the loop thread,
+    so clients and caches bound to the loop can be shared between messages.
+    """
+
+    def __init__(self, use_uvloop: bool = False) -> None:
+        """Define which event loop implementation to use."""
+        if use_uvloop and uvloop is None:
+            LOG.warning("uvloop is not installed, falling back to the asyncio event loop.")
+        self.use_uvloop = use_uvloop and uvloop is not None
+        self.loop: Union[None, asyncio.AbstractEventLoop] = None
+        self._thread: Union[None, threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the loop thread if it is not running and return the loop."""
+        with self._lock:
+            if self.loop is None:
+                self.loop = uvloop.new_event_loop() if self.use_uvloop else asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self.loop.run_forever, name="event-loop", daemon=True)
+                self._thread.start()
+                LOG.debug(f"Started event loop {self.loop}.")
+            return self.loop
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> "Future[T]":
+        """Schedule a coroutine on the loop and return a future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.start())
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run a coroutine on the loop and wait for its result."""
+        return self.submit(coro).result()
+
+    def stop(self) -> None:
+        """Stop the loop and wait for its thread to finish."""
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            self.loop, self._thread = None, None
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,69 @@
+"""Choose between broker nodes and pace reconnects."""
+
+import random
+import time
+from typing import List
+
+
+class Endpoint:
+    """A broker node and how connecting to it went recently."""
+
+    __slots__ = ("host", "port", "failures", "failed_at")
+
+    def __init__(self, host: str, port: int) -> None:
+        """Define the address of the node."""
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.failed_at = 0.0
+
+    def __repr__(self) -> str:
+        """Return host and port."""
+        return f"{self.host}:{self.port}"
+
+
+class BrokerEndpoints:
+    """Broker nodes from a comma separated ``host[:port]`` list, healthiest first.
+
+    Nodes are tried in order of consecutive connection failures, the node that
+    failed longest ago first among equals, so a node that is restarting is tried
+    last until the others fail as well.
+    """
+
+    def __init__(self, hosts: str, default_port: int) -> None:
+        """Parse the node list, ports default to ``default_port``."""
+        self.endpoints: List[Endpoint] = []
+        for entry in hosts.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            host, _, port = entry.rpartition(":") if entry.count(":") == 1 else (entry, "", "")
+            self.endpoints.append(Endpoint(host, int(port)) if port else Endpoint(entry, default_port))
+
+    def __len__(self) -> int:
+        """Return the number of nodes."""
+        return len(self.endpoints)
+
+    def order(self) -> List[Endpoint]:
+        """Return the nodes in the order to try them."""
+        return sorted(self.endpoints, key=lambda endpoint: (endpoint.failures, endpoint.failed_at))
+
+    @staticmethod
+    def failed(endpoint: Endpoint) -> None:
+        """Record a failed connection to ``endpoint``."""
+        endpoint.failures += 1
+        endpoint.failed_at = time.monotonic()
+
+    @staticmethod
+    def succeeded(endpoint: Endpoint) -> None:
+        """Record a connection to ``endpoint``."""
+        endpoint.failures = 0
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Return a random delay before reconnect ``attempt``, up to ``base * 2**(attempt - 1)`` and at most ``cap``.
+
+    Spreading delays over the whole range keeps consumers that lost the broker at
+    the same time from reconnecting at the same time.
+    """
+    return random.uniform(0, min(cap, base * 2 ** max(attempt - 1, 0)))  # nosec
@@ -0,0 +1,108 @@
+"""Queue handing out items in weighted round-robin across keys."""
+
+from collections import deque
+from typing import Deque, Dict, Generic, Hashable, Tuple, TypeVar, Union
+
+T = TypeVar("T")
+
+
+def parse_weights(value: str) -> Dict[str, int]:
+    """Parse weights given as a comma separated ``key=weight`` list."""
+    weights = {}
+    for entry in value.split(","):
+        key, _, weight = entry.strip().rpartition("=")
+        if key:
+            weights[key] = max(int(weight), 1)
+    return weights
+
+
+class FairQueue(Generic[T]):
+    """FIFO queues per key, served in weighted round-robin.
+
+    The keys with items take turns, each taking up to its weight in items per turn,
+    ``default_weight`` for keys without a weight. A key that gets items while others
+    are waiting joins at the end of the round, so it waits at most one round however
+    many items the others have.
+    """
+
+    def __init__(self, weights: Union[None, Dict[str, int]] = None, default_weight: int = 1) -> None:
+        """Define the weight of keys."""
+        self.weights = weights or {}
+        self.default_weight = max(default_weight, 1)
+        self._queues: Dict[Hashable, Deque[T]] = {}
+        # keys with items, the first one has its turn
+        self._ring: Deque[Hashable] = deque()
+        self._taken = 0
+        self._size = 0
+        # number of keys by how many items they have, to follow the longest queue
+        self._lengths: Dict[int, int] = {}
+        self._longest = 0
+
+    def put(self, key: Hashable, item: T) -> int:
+        """Add ``item`` to the queue of ``key``, return how many items ``key`` has."""
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ring.append(key)
+        queue.append(item)
+        self._size += 1
+        self._resized(len(queue) - 1, len(queue))
+        return len(queue)
+
+    def get(self) -> Tuple[Hashable, T, int]:
+        """Take the next item, return its key, the item and how many items its key has left.
+
+        Raises ``IndexError`` if the queue is empty.
+        """
+        key = self._ring[0]
+        queue = self._queues[key]
+        item = queue.popleft()
+        self._size -= 1
+        self._taken += 1
+        self._resized(len(queue) + 1, len(queue))
+        if not queue:
+            del self._queues[key]
+            self._ring.popleft()
+            self._taken = 0
+        elif self._taken >= self.weights.get(str(key), self.default_weight):
+            self._ring.rotate(-1)
+            self._taken = 0
+        return key, item, len(queue)
+
+    def clear(self) -> Dict[Hashable, Deque[T]]:
+        """Remove every item, return the queues of every key."""
+        queues = self._queues
+        self._queues = {}
+        self._ring.clear()
+        self._taken = 0
+        self._size = 0
+        self._lengths.clear()
+        self._longest = 0
+        return queues
+
+    @property
+    def keys(self) -> int:
+        """Return the number of keys with items."""
+        return len(self._queues)
+
+    @property
+    def longest(self) -> int:
+        """Return the most items one key has."""
+        return self._longest
+
+    def _resized(self, before: int, after: int) -> None:
+        if before:
+            self._lengths[before] -= 1
+            if not self._lengths[before]:
+                del self._lengths[before]
+        if after:
+            self._lengths[after] = self._lengths.get(after, 0) + 1
+        if after > self._longest:
+            self._longest = after
+        elif before == self._longest and before not in self._lengths:
+            # the key was the only one this long and now has one item less
+            self._longest = after
+
+    def __len__(self) -> int:
+        """Return the number of items."""
+        return self._size
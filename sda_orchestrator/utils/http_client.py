@@ -0,0 +1,122 @@
+"""Shared HTTP client for the Datacite and REMS APIs."""
+
+import asyncio
+import time
+from functools import partial
+from os import environ
+from distutils.util import strtobool
+from typing import Dict, Type, Union
+
+from httpx import AsyncClient, AsyncHTTPTransport, Limits, Request, Response, Timeout
+
+from .logger import LOG
+from .metrics import ENDPOINT, HTTP_CONNECTIONS, HTTP_REQUESTS, HTTP_SECONDS, HTTP_TLS_HANDSHAKES
+from .circuit_breaker import record_response
+
+
+class HTTPClient:
+    """Pooled ``AsyncClient`` shared by the DOI and REMS handlers.
+
+    Connections are kept alive between requests, so registering a dataset does not
+    pay a TCP and TLS handshake for every call. The client is created on first use
+    on the running event loop and has to be closed with ``aclose`` on shutdown.
+
+    Every request is traced to count how many new connections were opened, the
+    difference with the number of requests is the number of reused connections.
+    The counts are exported as metrics by host, and summed up in ``stats``.
+    Request latency is recorded per handler endpoint and response status code, server
+    errors are reported to the circuit breaker of the call in progress.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        retries: int = 3,
+        timeout: Timeout = Timeout(30.0, connect=60.0),
+    ) -> None:
+        """Define pool limits, protocol and retries of the client."""
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                LOG.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1.")
+                http2 = False
+        self.limits = Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.retries = retries
+        self.timeout = timeout
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self._client: Union[None, AsyncClient] = None
+        self._loop: Union[None, asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_environ(cls: Type["HTTPClient"]) -> "HTTPClient":
+        """Create a client configured from environment variables."""
+        return cls(
+            max_connections=int(environ.get("HTTP_MAX_CONNECTIONS", 20)),
+            max_keepalive_connections=int(environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10)),
+            keepalive_expiry=float(environ.get("HTTP_KEEPALIVE_EXPIRY", 30.0)),
+            http2=bool(strtobool(environ.get("HTTP2", "False"))),
+        )
+
+    @property
+    def client(self) -> AsyncClient:
+        """Return the client for the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # an AsyncClient can only be used on the loop it was created on
+            self._client = AsyncClient(
+                transport=AsyncHTTPTransport(retries=self.retries, limits=self.limits, http2=self.http2),
+                timeout=self.timeout,
+                event_hooks={"request": [self._on_request], "response": [self._on_response]},
+            )
+            self._loop = loop
+        return self._client
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """Return request and connection counters."""
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "tls_handshakes": self.tls_handshakes,
+            "reused": max(self.requests - self.connections, 0),
+        }
+
+    async def aclose(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            LOG.info(f"Closed HTTP client, connection stats: {self.stats}.")
+        self._client = None
+        self._loop = None
+
+    async def _on_request(self, request: Request) -> None:
+        self.requests += 1
+        HTTP_REQUESTS.inc(host=request.url.host)
+        request.extensions["trace"] = partial(self._trace, request.url.host)
+        request.extensions["sda_timing"] = (ENDPOINT.get(), time.monotonic())
+
+    async def _on_response(self, response: Response) -> None:
+        timing = response.request.extensions.get("sda_timing")
+        if timing:
+            endpoint, started = timing
+            HTTP_SECONDS.observe(time.monotonic() - started, endpoint=endpoint, status=str(response.status_code))
+        record_response(response.status_code)
+
+    async def _trace(self, host: str, event_name: str, info: Dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.connections += 1
+            HTTP_CONNECTIONS.inc(host=host)
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+            HTTP_TLS_HANDSHAKES.inc(host=host)
@@ -1,19 +1,21 @@
 """Fetching IDs for files and datasets."""
 
 from pathlib import Path
-from typing import Dict, Union
+from typing import Awaitable, Callable, Dict, Union
 from uuid import uuid4
 from os import environ
 from datetime import date
 import shortuuid
 
 from .logger import LOG
+from .http_client import HTTPClient
+from .dataset_store import DatasetStore
+from .metrics import endpoint
+from .circuit_breaker import DATACITE, ServiceUnavailable
+from .rate_limiter import AdaptiveRateLimiter
 from ..config import CONFIG_INFO
 
-from httpx import Headers, AsyncClient, Response, DecodingError, AsyncHTTPTransport, Timeout
-
-_transport = AsyncHTTPTransport(retries=3)
-_timeout = Timeout(30.0, connect=60.0)
+from httpx import Headers, Response, DecodingError
 
 
 def generate_dataset_id(user: str, inbox_path: str, ns: Union[str, None] = None) -> str:
@@ -68,10 +70,25 @@ class DOIHandler:
 
     The ``set_doi_state`` is dependent on generating a doi_suffix as draft.
     We do this if errors ocurr in registering the resource in REMS
+
+    If a ``DatasetStore`` is given, DOIs and states recorded there are not requested again.
+
+    Calls go through the ``DATACITE`` circuit breaker, they fail fast while Datacite is down.
+    Requests are paced by a rate limiter shared by all handlers in the process, adapting to
+    429 responses, rate limited requests are sent again up to ``DATACITE_RATE_RETRIES`` times.
     """
 
-    def __init__(self) -> None:
-        """Define DOI credentials and config."""
+    limiter = AdaptiveRateLimiter.from_environ("datacite")
+    rate_limit_retries = int(environ.get("DATACITE_RATE_RETRIES", 3))
+
+    def __init__(self, http: Union[HTTPClient, None] = None, store: Union[DatasetStore, None] = None) -> None:
+        """Define DOI credentials and config.
+
+        :param http: shared HTTP client, one is created if not given.
+        :param store: durable record of registered datasets.
+        """
+        self.http = http if http else HTTPClient.from_environ()
+        self.store = store
         self.doi_prefix = environ.get("DOI_PREFIX", "")
         self.doi_api = environ.get("DOI_API", "")
         self.doi_user = environ.get("DOI_USER", "")
@@ -82,17 +99,29 @@ class DOIHandler:
         """Create an auto-generated draft DOI.
 
         We are using just the prefix for the DOI so that it will be autogenerated.
+        A DOI in the dataset store is returned without calling Datacite, also while its circuit is open.
         """
         dataset = generate_dataset_id(user, inbox_path, self.ns_url)
         suffix = shortuuid.uuid(name=dataset)[:10]
         doi_suffix = f"{suffix[:4]}-{suffix[4:]}"
 
+        record = self.store.get(f"{self.ns_url}/{doi_suffix.lower()}") if self.store else None
+        if record and record["full_doi"]:
+            LOG.info(f"DOI {record['full_doi']} found in dataset store.")
+            return {"suffix": record["doi_suffix"], "fullDOI": record["full_doi"], "dataset": record["dataset_id"]}
+        return await self._create_draft_doi(doi_suffix)
+
+    @DATACITE.guard
+    @endpoint("create_draft_doi")
+    async def _create_draft_doi(self, doi_suffix: str) -> Union[Dict, None]:
+        """Request a draft DOI from Datacite."""
         headers = Headers({"Content-Type": "application/json"})
         draft_doi_payload = {"data": {"type": "dois", "attributes": {"doi": f"{self.doi_prefix}/{doi_suffix}"}}}
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.post(
+        response = await self._send(
+            lambda: self.http.client.post(
                 self.doi_api, auth=(self.doi_user, self.doi_key), json=draft_doi_payload, headers=headers
             )
+        )
         doi_data = None
         if response.status_code == 201:
             draft_resp = response.json()
@@ -105,19 +134,34 @@ class DOIHandler:
                 "fullDOI": _doi,
                 "dataset": f"{self.ns_url}/{_suffix.lower()}",
             }
+            self._remember(doi_data, state="draft")
         else:
             LOG.debug(f"DOI draft created and response was: {response}")
             LOG.error(f"DOI API create draft request failed with code: {response.status_code}")
             doi_data = self._check_errors(response, doi_suffix)
+            if doi_data:
+                self._remember(doi_data)
 
         return doi_data
 
     async def set_doi_state(self, state: str, doi_suffix: str) -> Union[Dict, None]:
         """Set DOI and associated metadata.
 
+        A DOI the dataset store records with ``state`` is not sent to Datacite, also while its circuit is open.
+
         :param state: can be publish, register or hide, or even draft if preferred .
         :param doi: DOI to do operations on.
         """
+        record = self.store.get(f"{self.ns_url}/{doi_suffix.lower()}") if self.store else None
+        if record and record["state"] == state:
+            LOG.info(f"DOI {record['full_doi']} already has state: {state}.")
+            return {"suffix": record["doi_suffix"], "fullDOI": record["full_doi"], "dataset": record["dataset_id"]}
+        return await self._set_doi_state(state, doi_suffix)
+
+    @DATACITE.guard
+    @endpoint("set_doi_state")
+    async def _set_doi_state(self, state: str, doi_suffix: str) -> Union[Dict, None]:
+        """Send the DOI with its metadata and ``state`` to Datacite."""
         publish_data_payload = {
             "data": {
                 "id": f"{self.doi_prefix}/{doi_suffix}",
@@ -145,13 +189,14 @@ class DOIHandler:
             }
         }
         headers = Headers({"Content-Type": "application/json"})
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.put(
+        response = await self._send(
+            lambda: self.http.client.put(
                 f"{self.doi_api}/{self.doi_prefix}/{doi_suffix}",
                 auth=(self.doi_user, self.doi_key),
                 json=publish_data_payload,
                 headers=headers,
             )
+        )
         doi_data = None
         if response.status_code == 200:
             publish_resp = response.json()
@@ -164,12 +209,46 @@ class DOIHandler:
                 "fullDOI": _doi,
                 "dataset": f"{self.ns_url}/{_suffix.lower()}",
             }
+            self._remember(doi_data, state=state)
         else:
             LOG.error(f"DOI API request failed with code: {response.status_code}")
             doi_data = self._check_errors(response, doi_suffix)
 
         return doi_data
 
+    @DATACITE.guard
+    @endpoint("get_doi")
+    async def get_doi(self, doi_suffix: str) -> Union[Dict, None]:
+        """Return the attributes of a DOI, ``None`` if it does not exist."""
+        response = await self._send(
+            lambda: self.http.client.get(
+                f"{self.doi_api}/{self.doi_prefix}/{doi_suffix}", auth=(self.doi_user, self.doi_key)
+            )
+        )
+        if response.status_code == 200:
+            return response.json()["data"]["attributes"]
+        LOG.error(f"DOI API get request failed with code: {response.status_code}")
+        return None
+
+    async def _send(self, request: Callable[[], Awaitable[Response]]) -> Response:
+        """Send a request once the rate limiter allows it, again if it is rate limited."""
+        for _ in range(self.rate_limit_retries + 1):
+            sent = await self.limiter.acquire()
+            response = await request()
+            self.limiter.update(response.status_code, response.headers.get("Retry-After"), sent)
+            if response.status_code != 429:
+                return response
+        raise ServiceUnavailable(f"Datacite still rate limited after {self.rate_limit_retries} retries.")
+
+    def _remember(self, doi_data: Dict, state: Union[None, str] = None) -> None:
+        """Record a DOI in the dataset store, keeping the known state if ``state`` is not given."""
+        if not self.store:
+            return
+        fields = {"doi_suffix": doi_data["suffix"], "full_doi": doi_data["fullDOI"]}
+        if state:
+            fields["state"] = state
+        self.store.update(doi_data["dataset"], **fields)
+
     def _check_errors(self, response: Response, doi_suffix: str) -> Union[Dict, None]:
         try:
             errors_resp = response.json()["errors"]
@@ -1,7 +1,14 @@
 """Logging formatting."""
 
+import atexit
 import logging
+import os
+import random
+from distutils.util import strtobool
+from logging.handlers import QueueHandler, QueueListener
 from os import environ
+from queue import SimpleQueue
+from typing import Dict, List, Union
 
 # Keeping it simple with the logging formatting
 
@@ -13,3 +20,88 @@ LOG = logging.getLogger("sda_orchestrator")
 # By default the logging level would be INFO
 log_level = environ.get("LOG_LEVEL", "INFO").upper()
 LOG.setLevel(log_level)
+
+# share of message bodies logged at debug level, from 0 (none) to 1 (all)
+BODY_SAMPLE_RATE = float(environ.get("LOG_BODY_SAMPLE_RATE", 1.0))
+
+
+class Fields:
+    """Key-value pairs of a log record, only formatted if the record is emitted.
+
+    Pass it as an argument, ``LOG.info("Received work %s", Fields(user=user))``,
+    so nothing is formatted for records of a disabled level.
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, **fields: object) -> None:
+        """Keep the fields as they are."""
+        self.fields = fields
+
+    def __str__(self) -> str:
+        """Format the fields as ``key=value`` pairs."""
+        return " ".join(f"{key}={value}" for key, value in self.fields.items())
+
+
+def log_body(body: Union[str, bytes, Dict], correlation_id: str) -> None:
+    """Log a message body at debug level, for a ``LOG_BODY_SAMPLE_RATE`` share of messages."""
+    if LOG.isEnabledFor(logging.DEBUG) and (BODY_SAMPLE_RATE >= 1 or random.random() < BODY_SAMPLE_RATE):  # nosec
+        LOG.debug("MQ Message body (corr-id: %s): %s", correlation_id, body)
+
+
+# Records are written by a background thread, so a slow stdout never stalls consuming messages
+_listener: Union[None, QueueListener] = None
+_handlers: List[logging.Handler] = []
+_hooks_registered = False
+
+
+def _start_listener() -> None:
+    """Hand records from the queue handler on the root logger to the original handlers."""
+    global _listener
+    root = logging.getLogger()
+    queue_handler = next((handler for handler in root.handlers if isinstance(handler, QueueHandler)), None)
+    if queue_handler is None:
+        handlers = list(root.handlers)
+        queue_handler = QueueHandler(SimpleQueue())
+        root.handlers = [queue_handler]
+    else:
+        # after a fork the listener thread is gone, start a new one on a fresh queue
+        handlers = list(_listener.handlers) if _listener else list(_handlers)
+        queue_handler.queue = SimpleQueue()
+    _handlers[:] = handlers
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_listener() -> None:
+    """Start a listener in a forked child if the parent had one running."""
+    if _listener is not None:
+        _start_listener()
+
+
+def setup_logging() -> None:
+    """Write log records from a background thread, unless ``LOG_QUEUE`` is false.
+
+    Called by the entry points, importing this module leaves the root logger as it is.
+    Calling it again while the listener runs does nothing.
+    """
+    global _hooks_registered
+    if not strtobool(environ.get("LOG_QUEUE", "True")) or _listener is not None:
+        return
+    _start_listener()
+    if not _hooks_registered:
+        atexit.register(flush_logs)
+        os.register_at_fork(after_in_child=_restart_listener)
+        _hooks_registered = True
+
+
+def flush_logs() -> None:
+    """Write the queued records, stop the listener and give the root logger its handlers back.
+
+    Runs at exit, processes that end with ``os._exit`` have to call it themselves.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        logging.getLogger().handlers = list(_handlers)
@@ -0,0 +1,34 @@
+"""Decode inbound and build outbound message bodies."""
+
+import json
+from typing import Dict, Union
+
+from ..schemas.validate import get_validator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+
+def loads(body: Union[str, bytes]) -> Dict:
+    """Decode a JSON message body."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(payload: Dict) -> bytes:
+    """Encode a message body as compact UTF-8 JSON, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def build(schema: str, payload: Dict) -> bytes:
+    """Validate ``payload`` against ``schema`` and encode it, ready to be published.
+
+    Defaults the schema sets during validation end up in the encoded body.
+    """
+    get_validator(schema).validate(payload)
+    return dumps(payload)
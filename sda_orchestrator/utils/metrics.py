@@ -0,0 +1,327 @@
+"""Metrics in the Prometheus text format, served over HTTP."""
+
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import environ
+from typing import Awaitable, Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar, Union
+
+from .logger import LOG
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """A named metric with a value per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        """Define the name, help text and label names of the metric."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames)}, got {', '.join(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield the sample name suffix, formatted labels and value of every sample."""
+        return iter(())
+
+    def render(self) -> List[str]:
+        """Return the lines of the metric in the text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """Value that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        """Define the name, help text and label names of the counter."""
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Add ``amount`` to the counter with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the value of the counter with the given labels."""
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield the value for every combination of labels."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    """Value that goes up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the gauge with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Count of observations in cumulative buckets, with their sum."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        """Define the name, help text, label names and bucket upper bounds of the histogram."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: count per bucket, with the last for values above every bound, and the sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation with the given labels."""
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        """Return the number of observations with the given labels."""
+        values = self._values.get(self._key(labels))
+        return sum(values[0]) if values else 0
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Yield the buckets, sum and count for every combination of labels."""
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", _format_labels(names, key + (_format_value(bound),)), cumulative
+            cumulative += counts[-1]
+            yield "_bucket", _format_labels(names, key + ("+Inf",)), cumulative
+            yield "_sum", _format_labels(self.labelnames, key), total
+            yield "_count", _format_labels(self.labelnames, key), cumulative
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        """Start with no metrics."""
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add a metric."""
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in the text format."""
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MESSAGES = Counter(
+    "sda_orchestrator_messages_total",
+    "Messages received and settled, by queue and outcome (received, acked, rejected, requeued).",
+    ("queue", "outcome"),
+)
+HANDLE_SECONDS = Histogram(
+    "sda_orchestrator_handle_seconds", "Time from receiving a message until it is handled.", ("queue",)
+)
+PUBLISH_SECONDS = Histogram(
+    "sda_orchestrator_publish_seconds",
+    "Time to publish a message, until it is confirmed if publisher confirms are enabled.",
+    ("routing_key",),
+)
+RECONNECTS = Counter("sda_orchestrator_reconnects_total", "Reconnects to the broker.", ("queue",))
+HTTP_SECONDS = Histogram(
+    "sda_orchestrator_http_request_seconds",
+    "Datacite and REMS request latency, by endpoint and response status code.",
+    ("endpoint", "status"),
+)
+HTTP_REQUESTS = Counter("sda_orchestrator_http_requests_total", "Datacite and REMS requests, by host.", ("host",))
+HTTP_CONNECTIONS = Counter(
+    "sda_orchestrator_http_connections_total",
+    "TCP connections opened to Datacite and REMS, by host. Requests less connections were sent on reused ones.",
+    ("host",),
+)
+HTTP_TLS_HANDSHAKES = Counter(
+    "sda_orchestrator_http_tls_handshakes_total", "TLS handshakes with Datacite and REMS, by host.", ("host",)
+)
+CIRCUIT_STATE = Gauge(
+    "sda_orchestrator_circuit_state",
+    "Circuit breaker state by dependency: 0 closed, 1 open, 2 half-open.",
+    ("dependency",),
+)
+RETRIES = Counter(
+    "sda_orchestrator_retries_total",
+    "Messages parked on a delayed retry queue while a dependency is unavailable, by queue and attempt.",
+    ("queue", "attempt"),
+)
+RATE_LIMIT = Gauge(
+    "sda_orchestrator_rate_limit", "Requests per second allowed by the client-side rate limiter.", ("dependency",)
+)
+RATE_LIMIT_WAITING = Gauge(
+    "sda_orchestrator_rate_limit_waiting", "Requests waiting for the client-side rate limiter.", ("dependency",)
+)
+BROKER_RECOVERY_SECONDS = Histogram(
+    "sda_orchestrator_broker_recovery_seconds",
+    "Time from losing the broker connection until consuming again.",
+    ("queue",),
+)
+TLS_HANDSHAKES = Counter(
+    "sda_orchestrator_tls_handshakes_total", "TLS handshakes with the broker, by session resumed or not.", ("resumed",)
+)
+DUPLICATES = Counter(
+    "sda_orchestrator_duplicates_total",
+    "Inbox upload events dropped as repeats of one forwarded shortly before, by queue.",
+    ("queue",),
+)
+CANCELLED = Counter(
+    "sda_orchestrator_cancelled_total",
+    "Ingestions cancelled because the file was removed or renamed, by inbox operation.",
+    ("operation",),
+)
+BACKLOG = Gauge("sda_orchestrator_fair_backlog", "Messages buffered for fair scheduling, by queue.", ("queue",))
+BACKLOG_USERS = Gauge(
+    "sda_orchestrator_fair_backlog_users", "Users with messages buffered for fair scheduling, by queue.", ("queue",)
+)
+BACKLOG_LONGEST = Gauge(
+    "sda_orchestrator_fair_backlog_longest",
+    "Most messages buffered for fair scheduling for one user, by queue.",
+    ("queue",),
+)
+for _metric in (
+    MESSAGES,
+    HANDLE_SECONDS,
+    PUBLISH_SECONDS,
+    RECONNECTS,
+    HTTP_SECONDS,
+    HTTP_REQUESTS,
+    HTTP_CONNECTIONS,
+    HTTP_TLS_HANDSHAKES,
+    CIRCUIT_STATE,
+    RETRIES,
+    RATE_LIMIT,
+    RATE_LIMIT_WAITING,
+    BROKER_RECOVERY_SECONDS,
+    TLS_HANDSHAKES,
+    DUPLICATES,
+    CANCELLED,
+    BACKLOG,
+    BACKLOG_USERS,
+    BACKLOG_LONGEST,
+):
+    REGISTRY.register(_metric)
+
+# the handler method a request is made for, read when the request is timed
+ENDPOINT: ContextVar[str] = ContextVar("endpoint", default="other")
+
+
+def endpoint(name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """Label HTTP requests made while the decorated coroutine runs with endpoint ``name``."""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @wraps(func)
+        async def wrapper(*args: object, **kwargs: object) -> T:
+            token = ENDPOINT.set(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                ENDPOINT.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+_server: Union[None, ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def serve(port: int, host: str = "") -> Union[None, ThreadingHTTPServer]:
+    """Serve the metrics on ``port`` from a background thread, once per process."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as error:
+                LOG.error(f"Could not serve metrics on port {port}: {error}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+            LOG.info(f"Serving metrics on port {_server.server_address[1]}.")
+        return _server
+
+
+def serve_from_environ() -> Union[None, ThreadingHTTPServer]:
+    """Serve the metrics on ``METRICS_PORT``, if it is set."""
+    port = environ.get("METRICS_PORT")
+    return serve(int(port)) if port else None
@@ -0,0 +1,205 @@
+"""Long-lived publishing channel with pipelined publisher confirms."""
+
+import threading
+from typing import Callable, Dict, List, Set, Tuple, Union
+
+from amqpstorm import AMQPChannelError, AMQPError, Connection, Message
+from amqpstorm.channel import Channel
+from pamqp import specification
+
+from .logger import LOG
+
+ConfirmCallback = Callable[[bool], None]
+
+
+class Publisher:
+    """Publish messages over a single channel kept open between messages.
+
+    Opening a channel per outgoing message costs a round trip to the broker, so
+    the channel is opened on first use and reused until the connection is replaced
+    with ``reset``.
+
+    With ``confirm`` enabled the channel is put in confirm mode, but publishing
+    does not wait for the broker: each publish gets a sequence number and an
+    optional callback that is run once the broker acks (``True``) or nacks
+    (``False``) it. At most ``window`` publishes are left unconfirmed, further
+    publishes block until the broker catches up. They give up if the channel
+    closes meanwhile, or if ``stopping`` returns ``True`` and no confirm came
+    for a second: the channel is dropped, its unconfirmed publishes are failed
+    and ``AMQPChannelError`` is raised.
+
+    Confirms are read by the amqpstorm IO thread, callbacks are run from it.
+    """
+
+    def __init__(self, confirm: bool = False, window: int = 1, stopping: Callable[[], bool] = lambda: False) -> None:
+        """Define confirm mode, the number of unconfirmed publishes allowed and when to stop waiting for confirms."""
+        self.confirm = confirm
+        self.window = max(window, 1)
+        self.stopping = stopping
+        self.connection: Union[None, Connection] = None
+        self._channel: Union[None, Channel] = None
+        self._seq = 0
+        self._unconfirmed: Dict[int, Union[None, ConfirmCallback]] = {}
+        self._declared: Set[str] = set()
+        self._cond = threading.Condition(threading.RLock())
+
+    @property
+    def unconfirmed(self) -> int:
+        """Return the number of publishes waiting for a broker confirm."""
+        with self._cond:
+            return len(self._unconfirmed)
+
+    def reset(self, connection: Union[None, Connection]) -> None:
+        """Drop the current channel and publish on ``connection`` from now on.
+
+        Publishes still waiting for a confirm on the old channel are reported as failed.
+        """
+        with self._cond:
+            self.connection = connection
+            failed = self._detach()
+        self._fail(failed)
+
+    def channel(self) -> Channel:
+        """Return the publishing channel, opening it if needed."""
+        with self._cond:
+            channel, failed = self._ensure_channel()
+        self._fail(failed)
+        return channel
+
+    def publish(
+        self,
+        body: Union[str, bytes],
+        routing_key: str,
+        exchange: str = "",
+        properties: Union[None, Dict] = None,
+        on_confirm: Union[None, ConfirmCallback] = None,
+    ) -> None:
+        """Publish a message, ``on_confirm`` is called once the broker has confirmed it.
+
+        Without confirm mode the callback is called straight away.
+
+        :raises AMQPChannelError: if the channel closed, or the consumer stopped, while waiting for confirms
+        """
+        with self._cond:
+            channel, failed = self._ensure_channel()
+            stuck = False
+            if self.confirm:
+                while len(self._unconfirmed) >= self.window and channel is self._channel:
+                    # no confirms come on a closed channel, and only reset() replaces it
+                    if not channel.is_open:  # type: ignore
+                        stuck = True
+                        break
+                    if not self._cond.wait(timeout=1) and self.stopping():
+                        stuck = True
+                        break
+                if stuck:
+                    failed.extend(self._detach())
+                elif channel is not self._channel:
+                    # channel was lost while waiting, start over on a new one
+                    channel, lost = self._ensure_channel()
+                    failed.extend(lost)
+            if not stuck:
+                Message.create(channel, body, properties).publish(routing_key, exchange=exchange)
+                if self.confirm:
+                    self._seq += 1
+                    self._unconfirmed[self._seq] = on_confirm
+        self._fail(failed)
+        if stuck:
+            raise AMQPChannelError("Publishing channel closed or stopped while waiting for confirms")
+        if not self.confirm and on_confirm:
+            on_confirm(True)
+
+    def declare_queue(self, queue: str, arguments: Dict) -> None:
+        """Declare a durable queue once per channel, before publishing to it."""
+        channel = self.channel()
+        with self._cond:
+            if queue in self._declared and channel is self._channel:
+                return
+        # not holding the lock, confirms read by the IO thread while waiting for the reply need it
+        channel.queue.declare(queue, durable=True, arguments=arguments)
+        with self._cond:
+            if channel is self._channel:
+                self._declared.add(queue)
+
+    def wait_for_confirms(self, timeout: Union[None, float] = None) -> bool:
+        """Block until every publish so far is confirmed, return ``False`` on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._unconfirmed, timeout=timeout)
+
+    def close(self) -> None:
+        """Close the publishing channel."""
+        with self._cond:
+            channel = self._channel
+            failed = self._detach()
+        self._fail(failed)
+        if channel is not None and channel.is_open:
+            try:
+                channel.close()
+            except AMQPError as error:
+                LOG.error(f"Could not close publishing channel: {error}")
+
+    def _ensure_channel(self) -> Tuple[Channel, List[Union[None, ConfirmCallback]]]:
+        failed: List[Union[None, ConfirmCallback]] = []
+        if self._channel is None or not self._channel.is_open:
+            failed = self._detach()
+            self._channel = self._open_channel()
+        return self._channel, failed
+
+    def _open_channel(self) -> Channel:
+        channel = self.connection.channel()  # type: ignore
+        if self.confirm:
+            # amqpstorm only supports confirms by waiting for each publish,
+            # so confirm mode is enabled here and Basic.Ack/Nack are picked up before they reach the channel
+            rpc_on_frame = channel.rpc.on_frame
+
+            def on_frame(frame_in: specification.Frame) -> bool:
+                if frame_in.name in ("Basic.Ack", "Basic.Nack"):
+                    self._on_confirm(channel, frame_in)
+                    return True
+                return rpc_on_frame(frame_in)
+
+            channel.rpc.on_frame = on_frame
+            channel.rpc_request(specification.Confirm.Select())
+            self._seq = 0
+        LOG.debug(f"Opened publishing channel {int(channel)}, confirm mode: {self.confirm}.")
+        return channel
+
+    def _detach(self) -> List[Union[None, ConfirmCallback]]:
+        """Forget the current channel and return the callbacks of its unconfirmed publishes."""
+        self._channel = None
+        self._declared.clear()
+        failed = list(self._unconfirmed.values())
+        self._unconfirmed.clear()
+        self._cond.notify_all()
+        if failed:
+            LOG.error(f"Publishing channel lost with {len(failed)} unconfirmed messages.")
+        return failed
+
+    def _fail(self, callbacks: List[Union[None, ConfirmCallback]]) -> None:
+        for callback in callbacks:
+            self._run_callback(callback, False)
+
+    def _on_confirm(self, channel: Channel, frame_in: specification.Frame) -> None:
+        acked = frame_in.name == "Basic.Ack"
+        with self._cond:
+            if channel is not self._channel:
+                return
+            if frame_in.multiple:
+                tags = [tag for tag in self._unconfirmed if tag <= frame_in.delivery_tag]
+            else:
+                tags = [frame_in.delivery_tag] if frame_in.delivery_tag in self._unconfirmed else []
+            callbacks = [self._unconfirmed.pop(tag) for tag in tags]
+            self._cond.notify_all()
+        if not acked:
+            LOG.error(f"Broker rejected {len(tags)} published messages.")
+        for callback in callbacks:
+            self._run_callback(callback, acked)
+
+    @staticmethod
+    def _run_callback(callback: Union[None, ConfirmCallback], acked: bool) -> None:
+        if callback is None:
+            return
+        try:
+            callback(acked)
+        except Exception as error:
+            LOG.error(f"Publish confirm callback failed: {error}")
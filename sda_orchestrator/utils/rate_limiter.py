@@ -0,0 +1,123 @@
+"""Client-side rate limiting adapting to the rate limits of an API."""
+
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from os import environ
+from typing import Type, Union
+
+from .logger import LOG
+from .metrics import RATE_LIMIT, RATE_LIMIT_WAITING
+
+
+def retry_after_seconds(value: Union[None, str]) -> float:
+    """Return the delay of a ``Retry-After`` header, given in seconds or as an HTTP date."""
+    if not value:
+        return 0.0
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class AdaptiveRateLimiter:
+    """Token bucket with a rate adjusted from the responses of the API.
+
+    Every request takes a token, tokens are added at ``rate`` per second up to
+    ``burst``. Callers wait for their token in the order they asked for it.
+
+    The rate is adjusted additive increase, multiplicative decrease: each response
+    that is not rate limited adds ``increase / rate``, about ``increase`` per second, up
+    to ``max_rate``. A 429 response multiplies it by ``decrease``, down to ``min_rate``,
+    once for all requests sent before the decrease, and no request is sent until its
+    ``Retry-After`` has passed.
+
+    State is guarded by a lock, so one limiter can be shared by event loops in several threads.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = 10.0,
+        min_rate: float = 0.5,
+        max_rate: float = 50.0,
+        burst: float = 5.0,
+        increase: float = 0.5,
+        decrease: float = 0.5,
+    ) -> None:
+        """Define the initial rate in requests per second, its bounds, the bucket size and how the rate adapts."""
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = max(burst, 1.0)
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self.waiting = 0
+        self._lock = threading.Lock()
+        RATE_LIMIT.set(self.rate, dependency=name)
+        RATE_LIMIT_WAITING.set(0, dependency=name)
+
+    @classmethod
+    def from_environ(cls: Type["AdaptiveRateLimiter"], name: str) -> "AdaptiveRateLimiter":
+        """Create a limiter configured from ``{NAME}_RATE`` environment variables."""
+        prefix = name.upper()
+        return cls(
+            name,
+            rate=float(environ.get(f"{prefix}_RATE", 10.0)),
+            min_rate=float(environ.get(f"{prefix}_MIN_RATE", 0.5)),
+            max_rate=float(environ.get(f"{prefix}_MAX_RATE", 50.0)),
+            burst=float(environ.get(f"{prefix}_RATE_BURST", 5.0)),
+        )
+
+    async def acquire(self) -> float:
+        """Wait for a token, return when the request may be sent, to pass to ``update``."""
+        wait = self._reserve()
+        if wait > 0:
+            self._waiting(1)
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._waiting(-1)
+        return time.monotonic()
+
+    def update(self, status_code: int, retry_after: Union[None, str] = None, sent: float = 0.0) -> None:
+        """Adjust the rate from the response to a request sent at ``sent``."""
+        with self._lock:
+            if status_code == 429:
+                delay = retry_after_seconds(retry_after)
+                now = time.monotonic()
+                self.blocked_until = max(self.blocked_until, now + delay)
+                if sent >= self.decreased_at:
+                    self.rate = max(self.rate * self.decrease, self.min_rate)
+                    self.tokens = min(self.tokens, 0.0)
+                    self.decreased_at = now
+                    LOG.warning(f"{self.name} rate limited, lowering the request rate to {self.rate:.2f}/s.")
+            elif status_code < 500:
+                self.rate = min(self.rate + self.increase / self.rate, self.max_rate)
+            RATE_LIMIT.set(self.rate, dependency=self.name)
+
+    def _reserve(self) -> float:
+        """Take a token, return how long to wait until it is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+            self.updated = now
+            # tokens below zero are reserved by callers already waiting
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def _waiting(self, change: int) -> None:
+        with self._lock:
+            self.waiting += change
+            RATE_LIMIT_WAITING.set(self.waiting, dependency=self.name)
@@ -0,0 +1,100 @@
+"""Local index of REMS resources and catalogue items."""
+
+import asyncio
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+# a catalogue item is identified by its id, form id and workflow id
+CatalogueItem = Tuple[int, int, int]
+
+
+class ResourceIndex:
+    """Map the ``resid`` (dataset DOI) of our REMS resources to their ids and catalogue items.
+
+    Listing every resource in REMS to find one DOI gets slower as datasets are added,
+    so the listing is fetched once into this index. From then on it is kept up to date
+    with what we create and with DOIs missing from it that are looked up one by one.
+    With a ``max_age`` the listing is fetched again when the last one is older, adding
+    the resources created outside this process, without dropping what is indexed.
+
+    A failed sync is retried after ``retry_delay`` seconds, doubled after every failure
+    up to ``max_retry_delay``.
+    """
+
+    def __init__(
+        self,
+        max_age: float = 0,
+        retry_delay: float = 30,
+        max_retry_delay: float = 900,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Define how long a listing is used, 0 for as long as the process runs, and how failed syncs are retried."""
+        self.max_age = max_age
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.clock = clock
+        self.resources: Dict[str, int] = {}
+        self.items: Dict[str, List[CatalogueItem]] = {}
+        self.synced_at: Union[None, float] = None
+        self.failures = 0
+        self.retry_at = 0.0
+        self.sync_task: Union[None, asyncio.Future] = None
+
+    @property
+    def built(self) -> bool:
+        """Check if the index was loaded from REMS at least once."""
+        return self.synced_at is not None
+
+    @property
+    def stale(self) -> bool:
+        """Check if the index was never loaded or its listing is older than ``max_age``."""
+        if self.synced_at is None:
+            return True
+        return self.max_age > 0 and self.clock() - self.synced_at > self.max_age
+
+    @property
+    def due(self) -> bool:
+        """Check if the index should be synced now, it is stale and not waiting to retry a failed sync."""
+        return self.stale and self.clock() >= self.retry_at
+
+    def merge(self, resources: Dict[str, int], items: Dict[str, List[CatalogueItem]]) -> None:
+        """Add the resources and catalogue items of a listing from REMS that are not indexed yet."""
+        for resid, resource_id in resources.items():
+            self.resources.setdefault(resid, resource_id)
+        for resid, resid_items in items.items():
+            for item in resid_items:
+                self.add_item(resid, *item)
+        self.synced_at = self.clock()
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def failed(self) -> None:
+        """Record a failed sync, put off the next one."""
+        self.failures += 1
+        self.retry_at = self.clock() + min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+
+    def forget(self, resid: str) -> None:
+        """Drop the resource and catalogue items of ``resid``, they are looked up again on next use."""
+        self.resources.pop(resid, None)
+        self.items.pop(resid, None)
+
+    def resource(self, resid: str) -> Union[None, int]:
+        """Return the id of the resource registered for ``resid``."""
+        return self.resources.get(resid)
+
+    def add_resource(self, resid: str, resource_id: int) -> None:
+        """Record a resource."""
+        self.resources[resid] = resource_id
+
+    def item(self, resid: str, form_id: int, workflow_id: int) -> Union[None, int]:
+        """Return the id of the catalogue item for ``resid`` with the given form and workflow."""
+        for item_id, item_form, item_workflow in self.items.get(resid, []):
+            if item_form == form_id and item_workflow == workflow_id:
+                return item_id
+        return None
+
+    def add_item(self, resid: str, item_id: int, form_id: int, workflow_id: int) -> None:
+        """Record a catalogue item."""
+        items = self.items.setdefault(resid, [])
+        if (item_id, form_id, workflow_id) not in items:
+            items.append((item_id, form_id, workflow_id))
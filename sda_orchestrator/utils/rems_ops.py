@@ -1,14 +1,20 @@
 """Handle registration of DOI in REMS."""
 
+import asyncio
+import weakref
 from os import environ
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Union
 from .logger import LOG
+from .cache import TTLCache
+from .rems_index import CatalogueItem, ResourceIndex
+from .http_client import HTTPClient
+from .dataset_store import DatasetStore
+from .metrics import endpoint
+from .circuit_breaker import CALL, REMS
 
 from ..config import CONFIG_INFO
 
-from httpx import Headers, AsyncClient, AsyncHTTPTransport, Timeout
-
-_transport = AsyncHTTPTransport(retries=3)
-_timeout = Timeout(30.0, connect=60.0)
+from httpx import Headers
 
 
 class REMSHandler:
@@ -22,13 +28,39 @@ class REMSHandler:
 
     The default config should be changed depending per installation, current config is NeIC
     specific.
+
+    The organization, license, form and workflow are the same for every dataset, their ids
+    are cached for ``REMS_CACHE_TTL`` seconds and shared by all handlers in the process.
+    Resources and catalogue items are looked up in a ``ResourceIndex`` loaded from REMS once,
+    and again every ``REMS_INDEX_MAX_AGE`` seconds if set. A failed load is retried after
+    ``REMS_INDEX_RETRY_DELAY`` seconds, doubled after every failure.
+
+    If a ``DatasetStore`` is given, resource and catalogue item ids recorded there are used first.
+
+    Steps of a registration that do not depend on each other run concurrently: the
+    organization, form and workflow lookups run alongside the license and then the
+    resource lookup, only creating objects waits for the organization to exist.
+
+    Registrations go through the ``REMS`` circuit breaker, they fail fast while REMS is down.
     """
 
-    def __init__(self) -> None:
+    lookups: TTLCache[int] = TTLCache(ttl=float(environ.get("REMS_CACHE_TTL", 3600)))
+    index = ResourceIndex(
+        max_age=float(environ.get("REMS_INDEX_MAX_AGE", 0)),
+        retry_delay=float(environ.get("REMS_INDEX_RETRY_DELAY", 30)),
+    )
+    _lookup_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str, str], asyncio.Lock]]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    def __init__(self, http: Union[HTTPClient, None] = None, store: Union[DatasetStore, None] = None) -> None:
         """Define DOI credentials and config.
 
-        :param state: can be publish, register, hide or draft.
+        :param http: shared HTTP client, one is created if not given.
+        :param store: durable record of registered datasets.
         """
+        self.http = http if http else HTTPClient.from_environ()
+        self.store = store
         self.rems_api = environ.get("REMS_API", "")
         self.rems_user = environ.get("REMS_USER", "")
         self.rems_key = environ.get("REMS_KEY", "")
@@ -42,9 +74,12 @@ class REMSHandler:
             }
         )
 
-    async def register_resource(self, doi: str) -> None:
+    async def register_resource(self, doi: str, publish: Union[None, Callable[[], Awaitable[Any]]] = None) -> None:
         """Register a resource and its dependencies for making it usable, in REMS.
 
+        A dataset the dataset store records with a resource and a catalogue item is not
+        looked up in REMS, also while its circuit is open. ``publish`` is still run.
+
         To make a resource accessible by a user one needs:
 
         - Every object in REMS needs to belong to an organisation, so have (at least) one.
@@ -64,22 +99,99 @@ class REMSHandler:
         - Every dataset is findable by a catalog item.
             - A catalog item bundles all of the above together and is an object of interest to the applicants.
             - A catalog item has 1-n mapping: every workflow, form and resource can belong to n catalog items.
+
+        :param doi: DOI of the dataset.
+        :param publish: publishes the DOI, run alongside the catalogue item step once the resource exists.
+          Publishing and registering are both repeatable, so a retry completes either if one fails.
         """
+        record = self.store.get(doi) if self.store else None
+        if record and record["rems_resource_id"] is not None and record["rems_catalogue_item_id"] is not None:
+            LOG.info(f"Resource and catalogue item for DOI {doi} found in dataset store.")
+            if publish is not None:
+                await publish()
+            return
+        await self._register_resource(doi, publish)
+
+    @REMS.guard
+    async def _register_resource(self, doi: str, publish: Union[None, Callable[[], Awaitable[Any]]] = None) -> None:
+        """Register the resource, its dependencies and catalogue item in REMS."""
         try:
-            await self._organization()
-            license_id = await self._license()
-            form_id = await self._form()
-            workflow_id = await self._workflow()
-
-            resource_id = await self._resource(doi, license_id)
-            await self._catalogue_item(form_id, resource_id, workflow_id, doi)
+            _, form_id, workflow_id, resource_id = await self._gather(
+                self._cached("organization", self._organization),
+                self._cached("form", self._form),
+                self._cached("workflow", self._workflow),
+                self._licensed_resource(doi),
+            )
+            if publish is None:
+                await self._catalogue_item(form_id, resource_id, workflow_id, doi)
+            else:
+                await self._gather(self._catalogue_item(form_id, resource_id, workflow_id, doi), publish())
         except Exception:
+            # a cached id might point to something removed from REMS, look them up again next time
+            self.invalidate()
+            self.index.forget(doi)
             raise
 
+    @REMS.guard
+    async def warm(self) -> None:
+        """Look up the organization, license, form, workflow and load the resource index ahead of registrations."""
+        await self._gather(
+            self._cached("organization", self._organization),
+            self._cached("license", self._license),
+            self._cached("form", self._form),
+            self._cached("workflow", self._workflow),
+            self._ensure_index(),
+        )
+
+    async def _licensed_resource(self, doi: str) -> int:
+        """Return the resource id for ``doi``, once the license it is created with is known."""
+        return await self._resource(doi, await self._cached("license", self._license))
+
+    @staticmethod
+    async def _gather(*steps: Awaitable[Any]) -> List[Any]:
+        """Run ``steps`` concurrently and return their results, cancelling the others if one fails."""
+        tasks = [asyncio.ensure_future(step) for step in steps]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def invalidate(self) -> None:
+        """Drop the cached organization, license, form and workflow ids."""
+        self.lookups.invalidate()
+
+    async def _cached(self, name: str, lookup: Callable[[], Awaitable[Union[None, int]]]) -> int:
+        """Return the cached id for ``name``, running ``lookup`` once if it is not cached."""
+        key = (self.rems_api, self.config["organization"]["id"], name)
+        value = self.lookups.get(key)
+        if value is not None:
+            return value
+        async with self._lock(name):
+            value = self.lookups.get(key)
+            if value is None:
+                # the organization lookup has no id to return, only that it exists
+                value = await lookup() or 0
+                self.lookups.set(key, value)
+        return value
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        """Return the lock for ``name`` on the running event loop."""
+        key = (self.rems_api, self.config["organization"]["id"], name)
+        locks = self._lookup_locks.setdefault(asyncio.get_running_loop(), {})
+        return locks.setdefault(key, asyncio.Lock())
+
     async def _process_create(self, resource: str, payload: dict, resp_key: str = "id") -> int:
-        """Process creation of a REMS resource endpoint in a similar fashion so that we can retrieve its id."""
-        async with AsyncClient() as client:
-            response = await client.post(f"{self.rems_api}/api/{resource}/create", json=payload, headers=self.headers)
+        """Process creation of a REMS resource endpoint in a similar fashion so that we can retrieve its id.
+
+        Everything belongs to the organization, so creating waits until it is known to exist.
+        """
+        if resource != "organizations":
+            await self._cached("organization", self._organization)
+        response = await self.http.client.post(
+            f"{self.rems_api}/api/{resource}/create", json=payload, headers=self.headers
+        )
         if response.status_code == 200:
             _resp = response.json()
             if isinstance(_resp["success"], bool) and _resp["success"]:
@@ -95,6 +207,7 @@ class REMSHandler:
 
         return _id
 
+    @endpoint("_organization")
     async def _organization(self) -> None:
         """Create organization if it does not exist.
 
@@ -112,8 +225,7 @@ class REMSHandler:
             "organization/owners": [{"userid": self.rems_user}],
         }
 
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(f"{self.rems_api}/api/organizations/{org['id']}", headers=self.headers)
+        response = await self.http.client.get(f"{self.rems_api}/api/organizations/{org['id']}", headers=self.headers)
         if response.status_code == 200:
             org_resp = response.json()
             if org_resp["organization/id"] == org["id"]:
@@ -125,6 +237,7 @@ class REMSHandler:
         if not org_exists:
             await self._process_create("organizations", org_payload, "organization/id")
 
+    @endpoint("_license")
     async def _license(self) -> int:
         """Get or create license if one does not exist.
 
@@ -139,11 +252,10 @@ class REMSHandler:
             "localizations": self.config["license"]["localizations"],
         }
 
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(
-                f"{self.rems_api}/api/licenses",
-                headers=self.headers,
-            )
+        response = await self.http.client.get(
+            f"{self.rems_api}/api/licenses",
+            headers=self.headers,
+        )
         if response.status_code == 200:
             license_resp = response.json()
             for lnc in license_resp:
@@ -164,6 +276,7 @@ class REMSHandler:
 
         return license_id
 
+    @endpoint("_workflow")
     async def _workflow(self) -> int:
         """Create base workflow if one does not exist."""
         workflow_exists = False
@@ -175,11 +288,10 @@ class REMSHandler:
             "handlers": [self.rems_user],
         }
 
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(
-                f"{self.rems_api}/api/workflows",
-                headers=self.headers,
-            )
+        response = await self.http.client.get(
+            f"{self.rems_api}/api/workflows",
+            headers=self.headers,
+        )
         if response.status_code == 200:
             workflow_resp = response.json()
             for wkf in workflow_resp:
@@ -198,6 +310,7 @@ class REMSHandler:
 
         return workflow_id
 
+    @endpoint("_form")
     async def _form(self) -> int:
         """Create a basic form if one does not exist used in the application of a resource."""
         form_exists = False
@@ -208,11 +321,10 @@ class REMSHandler:
             "form/fields": self.config["form"]["fields"],
         }
 
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(
-                f"{self.rems_api}/api/forms",
-                headers=self.headers,
-            )
+        response = await self.http.client.get(
+            f"{self.rems_api}/api/forms",
+            headers=self.headers,
+        )
         if response.status_code == 200:
             from_resp = response.json()
             for form in from_resp:
@@ -230,6 +342,7 @@ class REMSHandler:
 
         return form_id
 
+    @endpoint("_catalogue_item")
     async def _catalogue_item(self, form_id: int, resource_id: int, workflow_id: int, doi: str) -> None:
         """Create catalogue item to associate a resource to it."""
         item_exists = False
@@ -247,13 +360,25 @@ class REMSHandler:
             "enabled": True,
             "archived": False,
         }
+        record = self.store.get(doi) if self.store else None
+        if record and record["rems_catalogue_item_id"] is not None:
+            LOG.info(f"Catalogue Item for resource with DOI {doi} found in dataset store.")
+            return
+
+        await self._ensure_index()
+        item_id = self.index.item(doi, form_id, workflow_id)
+        if item_id is not None:
+            LOG.info(f"Catalogue Item for resource with DOI {doi} exists with id {item_id}.")
+            self._remember(doi, rems_catalogue_item_id=item_id)
+            return
+
+        # not in the index, it might have been created since the last sync
         params = {"resource": doi}
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(
-                f"{self.rems_api}/api/catalogue-items",
-                headers=self.headers,
-                params=params,
-            )
+        response = await self.http.client.get(
+            f"{self.rems_api}/api/catalogue-items",
+            headers=self.headers,
+            params=params,
+        )
         if response.status_code == 200:
             item_resp = response.json()
             # if there are no catalogue items for the resource either it does not exist
@@ -268,33 +393,53 @@ class REMSHandler:
                         and item["formid"] == form_id
                     ):
                         item_exists = True
+                        self.index.add_item(doi, item["id"], form_id, workflow_id)
+                        self._remember(doi, rems_catalogue_item_id=item["id"])
                         LOG.info(f"Catalogue Item for resource with DOI {doi} exists with id {item['id']}.")
         else:
             LOG.error(f"Retrieving catalogue items failed with HTTP status: {response.status_code}")
         if not item_exists:
-            await self._process_create("catalogue-items", item_payload)
+            item_id = await self._process_create("catalogue-items", item_payload)
+            self.index.add_item(doi, item_id, form_id, workflow_id)
+            self._remember(doi, rems_catalogue_item_id=item_id)
 
+    @endpoint("_resource")
     async def _resource(self, doi: str, license_id: int) -> int:
         """Create a resource and point it to DataCite DOI."""
         resource_exists = False
-        resource_id = 0
         resource_payload = {
             "resid": doi,
             "organization": {"organization/id": self.config["organization"]["id"]},
             "licenses": [license_id],
         }
 
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.get(
-                f"{self.rems_api}/api/resources",
-                headers=self.headers,
-            )
+        record = self.store.get(doi) if self.store else None
+        if record and record["rems_resource_id"] is not None:
+            LOG.info(f"Resource for DOI {doi} found in dataset store with id {record['rems_resource_id']}.")
+            return record["rems_resource_id"]
+
+        await self._ensure_index()
+        resource_id = self.index.resource(doi)
+        if resource_id is not None:
+            LOG.info(f"Resource for DOI {doi} exists with id {resource_id}.")
+            self._remember(doi, rems_resource_id=resource_id)
+            return resource_id
+
+        # not in the index, it might have been created since the last sync
+        resource_id = 0
+        response = await self.http.client.get(
+            f"{self.rems_api}/api/resources",
+            headers=self.headers,
+            params={"resid": doi},
+        )
         if response.status_code == 200:
             resource_resp = response.json()
             for res in resource_resp:
                 if res["organization"]["organization/id"] == self.config["organization"]["id"] and res["resid"] == doi:
                     resource_exists = True
                     resource_id = res["id"]
+                    self.index.add_resource(doi, resource_id)
+                    self._remember(doi, rems_resource_id=resource_id)
                     LOG.info(f"Resource for DOI {doi} exists with id {resource_id}.")
         else:
             LOG.error(
@@ -303,19 +448,83 @@ class REMSHandler:
 
         if not resource_exists:
             resource_id = await self._process_create("resources", resource_payload)
+            self.index.add_resource(doi, resource_id)
+            self._remember(doi, rems_resource_id=resource_id)
 
         return resource_id
 
+    def _remember(self, doi: str, **fields: int) -> None:
+        """Record REMS ids of a dataset in the dataset store."""
+        if self.store:
+            self.store.update(doi, **fields)
+
+    @REMS.guard
+    @endpoint("sync_index")
+    async def sync_index(self) -> None:
+        """Add our organization's resources and catalogue items listed in REMS to the index.
+
+        Raises if REMS does not answer with both listings.
+        """
+        async with self._lock("index"):
+            if not self.index.due:
+                return
+            org_id = self.config["organization"]["id"]
+            resources_resp = await self.http.client.get(f"{self.rems_api}/api/resources", headers=self.headers)
+            items_resp = await self.http.client.get(f"{self.rems_api}/api/catalogue-items", headers=self.headers)
+            if resources_resp.status_code != 200 or items_resp.status_code != 200:
+                raise Exception(
+                    f"Syncing REMS index failed with HTTP status: {resources_resp.status_code} for resources "
+                    f"and {items_resp.status_code} for catalogue items."
+                )
+            resources = {
+                res["resid"]: res["id"]
+                for res in resources_resp.json()
+                if res["organization"]["organization/id"] == org_id
+            }
+            listed_items = items_resp.json()
+            items: Dict[str, List[CatalogueItem]] = {}
+            for item in listed_items:
+                if item["organization"]["organization/id"] == org_id:
+                    items.setdefault(item["resid"], []).append((item["id"], item["formid"], item["wfid"]))
+            self.index.merge(resources, items)
+            LOG.info(f"Synced REMS index with {len(resources)} resources and {len(listed_items)} catalogue items.")
+
+    async def _ensure_index(self) -> None:
+        """Build the index on first use and refresh it in the background once it is older than ``max_age``.
+
+        Until a sync succeeds, resources and catalogue items are looked up in REMS one DOI at a time.
+        """
+        if not self.index.due:
+            return
+        if not self.index.built:
+            await self._sync_index_apart()
+        elif self.index.sync_task is None or self.index.sync_task.done():
+            self.index.sync_task = asyncio.ensure_future(self._sync_index_apart())
+
+    async def _sync_index_apart(self) -> None:
+        """Sync the index as a call of its own to the circuit breaker, putting the next sync off if it fails."""
+        # not part of the registration it is made for, a failed sync fails only itself
+        token = CALL.set(None)
+        try:
+            await self.sync_index()
+        except Exception as error:
+            self.index.failed()
+            LOG.error(
+                f"Could not sync REMS index, retrying in {self.index.retry_at - self.index.clock():.0f}s: {error}"
+            )
+        finally:
+            CALL.reset(token)
+
+    @endpoint("_enable_resource")
     async def _enable_resource(self, resource_id: int) -> None:
         """Enable a resource in REMS so that it can be used.
 
         This might not be required, but good to keep arround if a use case presents.
         """
         resource_payload = {"id": resource_id, "enabled": True}
-        async with AsyncClient(transport=_transport, timeout=_timeout) as client:
-            response = await client.put(
-                f"{self.rems_api}/api/resources/enabled", json=resource_payload, headers=self.headers
-            )
+        response = await self.http.client.put(
+            f"{self.rems_api}/api/resources/enabled", json=resource_payload, headers=self.headers
+        )
         if response.status_code == 200:
             _resp = response.json()
             if isinstance(_resp["success"], bool) and _resp["success"]:
@@ -0,0 +1,45 @@
+"""Broker connection shared by several consumers in one process."""
+
+import threading
+from typing import Callable, Union
+
+from amqpstorm import Connection
+
+
+class SharedConnection:
+    """Hold one broker connection for consumers that each consume on their own channel.
+
+    When a consumer loses the connection it asks for a new one, passing the connection
+    that failed. Only the first consumer to do so reconnects, the others get the
+    connection it opened.
+    """
+
+    def __init__(self, connect: Callable[[], Union[None, Connection]]) -> None:
+        """Define how the connection is opened."""
+        self._connect = connect
+        self._lock = threading.Lock()
+        self.connection: Union[None, Connection] = None
+        self.reconnects = 0
+
+    def get(self, stale: Union[None, Connection] = None) -> Union[None, Connection]:
+        """Return the open connection, opening a new one if there is none or it is ``stale``."""
+        with self._lock:
+            current = self.connection
+            if current is not None and current is not stale and current.is_open:
+                return current
+            if current is not None:
+                self.reconnects += 1
+                if not current.is_closed:
+                    try:
+                        current.close()
+                    except Exception:  # nosec
+                        pass
+            self.connection = self._connect()
+            return self.connection
+
+    def close(self) -> None:
+        """Close the connection."""
+        with self._lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,44 @@
+"""Coalesce concurrent and repeated work for the same key."""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+from .cache import TTLCache
+
+T = TypeVar("T")
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one call per key at a time and remember its result.
+
+    Callers asking for a key that is being worked on wait for that call instead of
+    starting their own. Successful results are kept in ``memo`` and returned
+    straight away until they expire or are evicted. Failures are not remembered.
+    """
+
+    def __init__(self, memo: TTLCache[T]) -> None:
+        """Define the cache holding results."""
+        self.memo = memo
+        self._inflight: Dict[Hashable, "asyncio.Future[T]"] = {}
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """Return the result for ``key``, running ``call`` only if no result is known or in flight."""
+        value = self.memo.get(key)
+        if value is not None:
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        # a cancelled caller must not cancel the call other callers are waiting on
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable) -> None:
+        """Drop the remembered result for ``key``."""
+        self.memo.invalidate(key)
+
+    def _done(self, key: Hashable, task: "asyncio.Future[T]") -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.memo.set(key, task.result())
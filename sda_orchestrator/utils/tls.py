@@ -0,0 +1,57 @@
+"""TLS context resuming sessions when reconnecting to the broker."""
+
+import ssl
+import threading
+from typing import Dict, Tuple, Union
+
+from .metrics import TLS_HANDSHAKES
+
+Address = Union[Tuple[str, int], Tuple[str, int, int, int], str]
+
+
+class ResumingSSLSocket(ssl.SSLSocket):
+    """Client socket offering the session of the last connection to the same address."""
+
+    context: "ResumingSSLContext"
+
+    def connect(self, addr: Address) -> None:  # type: ignore
+        """Connect, resuming the session last established with ``addr`` if there is one."""
+        session = self.context.session_for(addr)
+        if session is not None:
+            self.session = session
+        super().connect(addr)
+        self.context.remember(addr, self)
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """``SSLContext`` whose client connections resume earlier TLS sessions.
+
+    Sessions are kept per broker address, reconnecting after a broker restart or
+    a network failure then skips the full handshake when the broker still knows
+    the session. Sessions are only offered to the address they were made with.
+    """
+
+    sslsocket_class = ResumingSSLSocket
+
+    def __new__(cls, protocol: int = ssl.PROTOCOL_TLS_CLIENT) -> "ResumingSSLContext":
+        """Create the context, ``SSLContext`` takes the protocol in ``__new__``."""
+        context = super().__new__(cls, protocol)
+        context._sessions = {}
+        context._sessions_lock = threading.Lock()
+        return context
+
+    _sessions: Dict[str, ssl.SSLSession]
+    _sessions_lock: threading.Lock
+
+    def session_for(self, addr: Address) -> Union[None, ssl.SSLSession]:
+        """Return the session to resume with ``addr``."""
+        with self._sessions_lock:
+            return self._sessions.get(str(addr))
+
+    def remember(self, addr: Address, sock: ssl.SSLSocket) -> None:
+        """Keep the session of a connected socket and count the handshake."""
+        TLS_HANDSHAKES.inc(resumed=str(bool(sock.session_reused)).lower())
+        session = sock.session
+        if session is not None:
+            with self._sessions_lock:
+                self._sessions[str(addr)] = session
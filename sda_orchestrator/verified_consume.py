@@ -1,33 +1,38 @@
 """Message Broker verify step consumer."""
 
-import json
 from typing import Dict
 from amqpstorm import Message
 from .utils.consumer import Consumer
-from .utils.logger import LOG
+from .utils.logger import LOG, Fields, log_body, setup_logging
 from os import environ
 from .utils.id_ops import generate_accession_id
 from jsonschema.exceptions import ValidationError
-from .schemas.validate import ValidateJSON, load_schema
+from .schemas.validate import get_validator
+from .utils import messages
 
 
 class VerifyConsumer(Consumer):
     """Verify Consumer class."""
 
+    schemas = Consumer.schemas + ("ingestion-accession-request", "ingestion-accession")
+
     def handle_message(self, message: Message) -> None:
         """Handle message."""
         try:
-            verify_msg = json.loads(message.body)
+            verify_msg = self._decode(message)
 
-            LOG.debug(f"MQ Message body: {message.body} .")
-            LOG.debug(f"Verify Consumer message received: {verify_msg} .")
+            log_body(message.body, message.correlation_id)
             LOG.info(
-                f"Received work (corr-id: {message.correlation_id} filepath: {verify_msg['filepath']},"
-                f"user: {verify_msg['user']},"
-                f"decryptedChecksums: {verify_msg['decrypted_checksums']})"
+                "Received work %s",
+                Fields(
+                    corr_id=message.correlation_id,
+                    filepath=verify_msg["filepath"],
+                    user=verify_msg["user"],
+                    decrypted_checksums=verify_msg["decrypted_checksums"],
+                ),
             )
 
-            ValidateJSON(load_schema("ingestion-accession-request")).validate(verify_msg)
+            get_validator("ingestion-accession-request").validate(verify_msg)
 
             accessionID = generate_accession_id()
             self._publish_accessionID(message, accessionID, verify_msg)
@@ -41,16 +46,8 @@ class VerifyConsumer(Consumer):
 
     def _publish_accessionID(self, message: Message, accessionID: str, verify_msg: Dict) -> None:
         """Publish message with dataset to accession ID mapping."""
-        properties = {
-            "content_type": "application/json",
-            "headers": {},
-            "correlation_id": message.correlation_id,
-            "delivery_mode": 2,
-        }
         try:
             # Create the message.
-            channel = self.connection.channel()  # type: ignore
-
             accession_trigger = {
                 "type": "accession",
                 "user": verify_msg["user"],
@@ -59,20 +56,16 @@ class VerifyConsumer(Consumer):
                 "accession_id": accessionID,
             }
 
-            accession_msg = json.dumps(accession_trigger)
-            ValidateJSON(load_schema("ingestion-accession")).validate(json.loads(accession_msg))
+            accession_msg = messages.build("ingestion-accession", accession_trigger)
 
-            accession = Message.create(channel, accession_msg, properties)
             checksum_data = list(filter(lambda x: x["type"] == "sha256", verify_msg["decrypted_checksums"]))
             decrypted_checksum = checksum_data[0]["value"]
-            accession.publish(
-                environ.get("ACCESSIONIDS_QUEUE", "accessionIDs"), exchange=environ.get("BROKER_EXCHANGE", "sda")
-            )
+            self._publish(message, accession_msg, environ.get("ACCESSIONIDS_QUEUE", "accessionIDs"))
 
-            channel.close()
             LOG.info(
-                f"Sent the message to accessionIDs queue to set accession ID for file {verify_msg['filepath']}"
-                f"with checksum {decrypted_checksum}."
+                "Sent the message to accessionIDs queue to set accession ID for file %s with checksum %s.",
+                verify_msg["filepath"],
+                decrypted_checksum,
             )
 
         except ValidationError:
@@ -80,9 +73,9 @@ class VerifyConsumer(Consumer):
             raise Exception("Could not validate the ingestion accession message. Not properly formatted.")
 
 
-def main() -> None:
-    """Run the Verify consumer."""
-    CONSUMER = VerifyConsumer(
+def create_consumer() -> VerifyConsumer:
+    """Create the Verified consumer configured from the environment."""
+    return VerifyConsumer(
         hostname=str(environ.get("BROKER_HOST")),
         port=int(environ.get("BROKER_PORT", 5670)),
         username=environ.get("BROKER_USER", "sda"),
@@ -90,7 +83,12 @@ def main() -> None:
         queue=environ.get("VERIFIED_QUEUE", "verified"),
         vhost=environ.get("BROKER_VHOST", "sda"),
     )
-    CONSUMER.start()
+
+
+def main() -> None:
+    """Run the Verify consumer."""
+    setup_logging()
+    create_consumer().start()
 
 
 if __name__ == "__main__":
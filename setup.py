@@ -29,6 +29,8 @@ setup(
             "sdainbox=sda_orchestrator.inbox_consume:main",
             "sdaverified=sda_orchestrator.verified_consume:main",
             "sdacomplete=sda_orchestrator.complete_consume:main",
+            "sdastore=sda_orchestrator.store_admin:main",
+            "sdaorch=sda_orchestrator.cli:main",
         ]
     },
     platforms="any",
@@ -45,8 +47,11 @@ setup(
         "License :: OSI Approved :: Apache Software License",
         "Programming Language :: Python :: 3.11",
     ],
-    install_requires=["amqpstorm", "jsonschema", "httpx", "shortuuid"],
+    install_requires=["amqpstorm", "pamqp", "jsonschema", "httpx", "shortuuid"],
     extras_require={
         "test": ["coverage", "coveralls", "pytest", "pytest-cov", "tox"],
+        "uvloop": ["uvloop"],
+        "http2": ["httpx[http2]"],
+        "orjson": ["orjson"],
     },
 )
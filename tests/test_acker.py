@@ -0,0 +1,51 @@
+"""Test batched acknowledgements."""
+
+import unittest
+from unittest.mock import MagicMock, call
+from sda_orchestrator.utils.acker import BatchAcker
+
+
+class BatchAckerTest(unittest.TestCase):
+    """Test for acking with multiple=True."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.channel = MagicMock()
+        self.acker = BatchAcker(self.channel, batch_size=3, interval=60000)
+
+    def tearDown(self):
+        """Stop the flush timer."""
+        self.acker.close()
+
+    def test_ack_when_batch_full(self):
+        """Test a full batch is acked with one frame."""
+        for tag in (1, 2, 3):
+            self.acker.received(tag)
+        self.acker.ack(1)
+        self.acker.ack(2)
+        self.channel.basic.ack.assert_not_called()
+        self.acker.ack(3)
+        self.channel.basic.ack.assert_called_once_with(delivery_tag=3, multiple=True)
+
+    def test_ack_stops_below_in_flight(self):
+        """Test a batch does not cover a delivery still being handled."""
+        for tag in (1, 2, 3, 4):
+            self.acker.received(tag)
+        self.acker.ack(1)
+        self.acker.ack(3)
+        self.acker.ack(4)
+        self.channel.basic.ack.assert_called_once_with(delivery_tag=1, multiple=True)
+        self.acker.ack(2)
+        self.acker.flush()
+        self.assertEqual(self.channel.basic.ack.call_args, call(delivery_tag=4, multiple=True))
+
+    def test_reject_in_batch(self):
+        """Test rejected deliveries are sent right away and do not block the batch."""
+        for tag in (1, 2, 3):
+            self.acker.received(tag)
+        self.acker.ack(1)
+        self.acker.reject(2)
+        self.channel.basic.reject.assert_called_once_with(delivery_tag=2, requeue=False)
+        self.acker.ack(3)
+        self.acker.flush()
+        self.channel.basic.ack.assert_called_once_with(delivery_tag=3, multiple=True)
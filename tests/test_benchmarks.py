@@ -0,0 +1,37 @@
+"""Test the benchmark runner against its stand-ins."""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from benchmarks.run import main
+
+
+class BenchmarksTest(unittest.TestCase):
+    """Smoke test for the benchmarks."""
+
+    def test_every_stage_acks(self):
+        """Test every stage handles and acks the generated messages."""
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "results.json"
+            main(
+                [
+                    "--messages",
+                    "20",
+                    "--warmup",
+                    "5",
+                    "--memory-messages",
+                    "5",
+                    "--latency",
+                    "0",
+                    "--output",
+                    str(output),
+                ]
+            )
+            results = json.loads(output.read_text())
+        self.assertEqual(set(results["stages"]), {"inbox", "verified", "complete"})
+        for result in results["stages"].values():
+            self.assertEqual(result["acked"], 20)
+            self.assertGreaterEqual(result["allocated_bytes_per_message"], 0)
+            self.assertGreaterEqual(result["allocated_blocks_per_message"], 0)
+        self.assertGreater(results["stages"]["complete"]["http_requests"], 0)
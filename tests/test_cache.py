@@ -0,0 +1,39 @@
+"""Test TTL cache."""
+
+import unittest
+from sda_orchestrator.utils.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+    """Test for expiry and eviction."""
+
+    def setUp(self):
+        """Set up a cache with a controllable clock."""
+        self.now = 0.0
+        self.cache = TTLCache(ttl=10, maxsize=2, clock=lambda: self.now)
+
+    def test_expiry(self):
+        """Test entries expire after the ttl."""
+        self.cache.set("a", 1)
+        self.now = 5
+        self.assertEqual(self.cache.get("a"), 1)
+        self.now = 11
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted."""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+
+    def test_invalidate(self):
+        """Test single and full invalidation."""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.invalidate("a")
+        self.assertNotIn("a", self.cache)
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
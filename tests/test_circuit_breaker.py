@@ -0,0 +1,90 @@
+"""Test the circuit breaker in front of Datacite and REMS."""
+
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from httpx import ConnectError
+
+from sda_orchestrator.utils.circuit_breaker import CircuitBreaker, CircuitOpen, ServiceUnavailable, record_response
+from sda_orchestrator.utils.metrics import CIRCUIT_STATE
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Test opening, failing fast and closing the circuit."""
+
+    def setUp(self):
+        """Set up a breaker opening after two failures."""
+        self.breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+        self.calls = 0
+
+    def _call(self, error=None, status=200):
+        """Call a guarded coroutine that gets ``status`` and raises ``error``."""
+
+        @self.breaker.guard
+        async def call():
+            self.calls += 1
+            record_response(status)
+            if error:
+                raise error
+
+        return asyncio.run(call())
+
+    def test_opens_after_failures(self):
+        """Test calls fail fast once the dependency failed often enough."""
+        for _ in range(2):
+            with self.assertRaises(ServiceUnavailable):
+                self._call(ConnectError("refused"))
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(CIRCUIT_STATE.value(dependency="test"), 1)
+        with self.assertRaises(CircuitOpen):
+            self._call()
+        self.assertEqual(self.calls, 2)
+
+    def test_server_errors_count(self):
+        """Test an error raised after a server error response counts as a failure."""
+        with self.assertRaises(ServiceUnavailable):
+            self._call(Exception("creating failed"), status=503)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_other_errors_ignored(self):
+        """Test errors of a dependency that answered do not open the circuit."""
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                self._call(ValueError("rejected"), status=422)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_trial(self):
+        """Test one call is let through after the reset timeout and closes the circuit if it succeeds."""
+        for _ in range(2):
+            with self.assertRaises(ServiceUnavailable):
+                self._call(ConnectError("refused"))
+        with patch("sda_orchestrator.utils.circuit_breaker.time.monotonic", return_value=self.breaker.opened_at + 31):
+            self.assertEqual(self.breaker.state, "half-open")
+            self.breaker.allow()
+            with self.assertRaises(CircuitOpen):
+                self.breaker.allow()
+            self.breaker.success()
+        self.assertEqual(self.breaker.state, "closed")
+        self._call()
+        self.assertEqual(self.calls, 3)
+
+    def test_nested_dependencies(self):
+        """Test server errors are counted for the dependency that answered with them."""
+        other = CircuitBreaker("other", failure_threshold=1)
+
+        @other.guard
+        async def inner():
+            record_response(500)
+            raise Exception("failed")
+
+        @self.breaker.guard
+        async def outer():
+            try:
+                await inner()
+            except ServiceUnavailable:
+                pass
+
+        asyncio.run(outer())
+        self.assertEqual(other.state, "open")
+        self.assertEqual(self.breaker.failures, 0)
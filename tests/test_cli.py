@@ -0,0 +1,129 @@
+"""Test the worker process supervisor."""
+
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from sda_orchestrator.cli import StageHost, Supervisor, main
+
+
+def exiting_worker(stage, cpu, slot):
+    """Exit straight away, like a worker that lost its connection."""
+    os._exit(3)
+
+
+def waiting_worker(stage, cpu, slot):
+    """Wait until told to stop."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+    while True:
+        time.sleep(0.1)
+
+
+def draining_worker(stage, cpu, slot):
+    """Wait until told to stop or restart, then exit like a drained consumer."""
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: os._exit(0))
+    while True:
+        time.sleep(0.1)
+
+
+def stop_later(supervisor, delay):
+    """Stop the supervisor from another thread after ``delay`` seconds."""
+    threading.Timer(delay, supervisor.stop).start()
+
+
+class SupervisorTest(unittest.TestCase):
+    """Test for the worker supervisor."""
+
+    def test_workers_restarted(self):
+        """Test exited workers are started again with a growing delay."""
+        supervisor = Supervisor("inbox", 2, restart_delay=0.05, max_restart_delay=0.2, target=exiting_worker)
+        stop_later(supervisor, 0.5)
+        self.assertEqual(supervisor.run(), 0)
+        self.assertGreaterEqual(supervisor.restarts, 4)
+        self.assertEqual(max(supervisor._delays), 0.2)
+
+    def test_stop_forwards_signal(self):
+        """Test stopping the supervisor stops every worker."""
+        supervisor = Supervisor("inbox", 3, stop_timeout=5, target=waiting_worker)
+        stop_later(supervisor, 0.3)
+        start = time.monotonic()
+        self.assertEqual(supervisor.run(), 0)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(supervisor.restarts, 0)
+        for process in supervisor.processes:
+            self.assertEqual(process.exitcode, 0)
+
+    def test_sighup_restarts_workers(self):
+        """Test SIGHUP lets the workers exit cleanly and starts them again without backoff."""
+        supervisor = Supervisor("inbox", 2, restart_delay=5, stop_timeout=5, target=draining_worker)
+        threading.Timer(0.3, os.kill, (os.getpid(), signal.SIGHUP)).start()
+        stop_later(supervisor, 1.0)
+        self.assertEqual(supervisor.run(), 0)
+        self.assertEqual(supervisor.restarts, 2)
+        self.assertEqual(supervisor._delays, [0.0, 0.0])
+        for process in supervisor.processes:
+            self.assertEqual(process.exitcode, 0)
+
+    @patch("sda_orchestrator.cli.setup_logging")
+    def test_workers_argument(self, setup_logging):
+        """Test at least one worker is required."""
+        with self.assertRaises(SystemExit):
+            main(["run", "--stage", "inbox", "--workers", "0"])
+
+
+class FakeConsumer:
+    """Consumer that consumes until it is stopped."""
+
+    def __init__(self, stage):
+        """Record the stage."""
+        self.stage = stage
+        self.shared = None
+        self.connection = None
+        self.stopped = threading.Event()
+        self.open_connection = MagicMock(return_value=MagicMock(is_open=True, is_closed=False))
+
+    def create_connection(self):
+        """Take the shared connection."""
+        self.connection = self.shared.get(stale=self.connection)
+
+    def start(self):
+        """Consume until stopped."""
+        self.stopped.wait()
+
+    def stop(self):
+        """Stop consuming."""
+        self.stopped.set()
+
+
+class StageHostTest(unittest.TestCase):
+    """Test for running stages in one process."""
+
+    def test_stages_share_connection(self):
+        """Test every stage runs in its own thread on one connection."""
+        host = StageHost(["inbox", "verified", "complete"], factory=FakeConsumer)
+        threading.Timer(1.2, host.stop).start()
+        with patch("sda_orchestrator.cli.rss", side_effect=[100, 300] + [200] * 5):
+            self.assertEqual(host.run(), 0)
+        consumers = list(host.consumers.values())
+        self.assertEqual(len({id(consumer.connection) for consumer in consumers}), 1)
+        self.assertEqual(sum(consumer.open_connection.call_count for consumer in consumers), 1)
+        self.assertTrue(all(consumer.stopped.is_set() for consumer in consumers))
+        self.assertEqual(host.peak_memory, 300)
+        self.assertIsNone(host.shared.connection)
+
+    def test_failed_stage_stops_host(self):
+        """Test the host stops every stage when one of them stops."""
+        host = StageHost(["inbox", "verified"], factory=FakeConsumer)
+        original = FakeConsumer.start
+
+        def start(consumer):
+            if consumer.stage == "inbox":
+                return
+            original(consumer)
+
+        with patch.object(FakeConsumer, "start", start):
+            self.assertEqual(host.run(), 1)
+        self.assertTrue(host.consumers["verified"].stopped.is_set())
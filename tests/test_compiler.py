@@ -0,0 +1,161 @@
+"""Test generated validators behave like ValidateJSON."""
+
+import copy
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from jsonschema.exceptions import ValidationError
+
+from sda_orchestrator.schemas.compiler import UnsupportedSchema, compile_schema
+from sda_orchestrator.schemas.validate import (
+    SCHEMAS_PATH,
+    CompiledValidator,
+    SchemaRegistry,
+    ValidateJSON,
+    load_schema,
+)
+
+SHA256 = {"type": "sha256", "value": "82e4e60e7beb3db2e06a00a079788f7d71f75b61a4b75f28c4c942703dabb6d6"}
+MD5 = {"type": "md5", "value": "7ac236b1a8dce2dac89e7cf45d2b48bd"}
+
+MESSAGES = {
+    "dataset-mapping": {"type": "mapping", "dataset_id": "urn:neic:001", "accession_ids": ["EGAF001", "EGAF002"]},
+    "inbox-remove": {"user": "user", "filepath": "user/file.c4gh", "operation": "remove"},
+    "inbox-rename": {"user": "user", "filepath": "user/new.c4gh", "oldpath": "user/old.c4gh", "operation": "rename"},
+    "inbox-upload": {
+        "user": "user",
+        "filepath": "user/file.c4gh",
+        "operation": "upload",
+        "filesize": 100,
+        "file_last_modified": 1600000000,
+        "encrypted_checksums": [SHA256, MD5],
+    },
+    "ingestion-accession-request": {"user": "user", "filepath": "user/file.c4gh", "decrypted_checksums": [SHA256, MD5]},
+    "ingestion-accession": {
+        "type": "accession",
+        "user": "user",
+        "filepath": "user/file.c4gh",
+        "accession_id": "EGAF001",
+        "decrypted_checksums": [SHA256, MD5],
+    },
+    "ingestion-completion": {
+        "user": "user",
+        "filepath": "user/file.c4gh",
+        "accession_id": "EGAF001",
+        "decrypted_checksums": [SHA256, MD5],
+    },
+    "ingestion-trigger": {
+        "type": "ingest",
+        "user": "user",
+        "filepath": "user/file.c4gh",
+        "encrypted_checksums": [SHA256, MD5],
+    },
+    "ingestion-user-error": {
+        "user": "user",
+        "filepath": "user/file.c4gh",
+        "reason": "Could not decrypt",
+        "encrypted_checksums": [SHA256],
+        "decrypted_checksums": [SHA256, MD5],
+    },
+}
+
+REPLACEMENTS = [None, True, 0, 1.5, "", "with space", "EGAF001", [], ["EGAF001"], [1], {}, [SHA256], [MD5], [{}]]
+
+
+def variants(message):
+    """Return the message and copies with a field removed, replaced or added, and checksums changed."""
+    yield message
+    for key in message:
+        removed = {name: value for name, value in message.items() if name != key}
+        yield removed
+        for replacement in REPLACEMENTS:
+            yield {**message, key: copy.deepcopy(replacement)}
+        if isinstance(message[key], list) and message[key] and isinstance(message[key][0], dict):
+            for index, checksum in enumerate(message[key]):
+                for field, value in (("type", "sha1"), ("value", "00"), ("value", 5), ("extra", "x")):
+                    changed = copy.deepcopy(message)
+                    changed[key][index][field] = value
+                    yield changed
+    yield {**message, "extra": "field"}
+    yield [message]
+    yield "message"
+
+
+class CompilerParityTest(unittest.TestCase):
+    """Test the generated code accepts and rejects what jsonschema does, with the same errors."""
+
+    def test_all_schemas_compile(self):
+        """Test every message schema compiles without falling back to jsonschema."""
+        for schema_file in sorted(SCHEMAS_PATH.glob("*.json")):
+            with self.subTest(schema=schema_file.stem):
+                self.assertIsInstance(SchemaRegistry(backend="compiled").get(schema_file.stem), CompiledValidator)
+
+    def test_jsonschema_default(self):
+        """Test generated validators are only used when asked for."""
+        with patch.dict("os.environ", clear=True):
+            self.assertNotIsInstance(SchemaRegistry().get("inbox-upload"), CompiledValidator)
+        with patch.dict("os.environ", {"SCHEMA_VALIDATOR": "compiled"}):
+            self.assertIsInstance(SchemaRegistry().get("inbox-upload"), CompiledValidator)
+
+    def test_parity(self):
+        """Test validity and reported errors match ValidateJSON for valid and mutated messages."""
+        self.assertEqual(set(MESSAGES), {path.stem for path in SCHEMAS_PATH.glob("*.json")})
+        for name, message in MESSAGES.items():
+            schema = load_schema(name)
+            compiled = CompiledValidator(schema)
+            reference = ValidateJSON(schema)
+            for instance in variants(message):
+                with self.subTest(schema=name, instance=json.dumps(instance)):
+                    self.assertEqual(compiled.is_valid(copy.deepcopy(instance)), reference.is_valid(instance))
+                    self.assertEqual(self._error(compiled, instance), self._error(reference, instance))
+
+    def test_defaults_filled(self):
+        """Test defaults are set like extend_with_default does, also inside arrays."""
+        schema = {
+            "type": "object",
+            "properties": {
+                "type": {"type": "string", "default": "ingest"},
+                "files": {"type": "array", "items": {"properties": {"size": {"default": 0}}}},
+            },
+        }
+        instance = {"files": [{}, {"size": 5}]}
+        expected = copy.deepcopy(instance)
+        ValidateJSON(schema).validate(expected)
+        CompiledValidator(schema).validate(instance)
+        self.assertEqual(instance, expected)
+        self.assertEqual(instance, {"type": "ingest", "files": [{"size": 0}, {"size": 5}]})
+
+    def test_keywords(self):
+        """Test keywords the message schemas do not use yet."""
+        schema = {
+            "oneOf": [{"type": "integer", "minimum": 1, "exclusiveMaximum": 10}, {"enum": [True, None, "x"]}],
+            "not": {"const": 5},
+        }
+        check, _ = compile_schema(schema)
+        reference = ValidateJSON(schema)
+        for instance in (0, 1, 1.0, 5, 9, 10, True, None, "x", "y", [1]):
+            with self.subTest(instance=instance):
+                self.assertEqual(check(instance), reference.is_valid(instance))
+
+    def test_unsupported_falls_back(self):
+        """Test a schema with keywords the compiler does not know is validated by jsonschema."""
+        with self.assertRaises(UnsupportedSchema):
+            compile_schema({"type": "object", "dependencies": {"a": ["b"]}})
+        with TemporaryDirectory() as tmp:
+            Path(tmp, "dependent.json").write_text('{"type": "object", "dependencies": {"a": ["b"]}}')
+            validator = SchemaRegistry(Path(tmp), backend="compiled").get("dependent")
+        self.assertNotIsInstance(validator, CompiledValidator)
+        with self.assertRaises(ValidationError):
+            validator.validate({"a": 1})
+
+    @staticmethod
+    def _error(validator, instance):
+        """Return what the raised ValidationError reports, or None."""
+        try:
+            validator.validate(copy.deepcopy(instance))
+        except ValidationError as error:
+            return error.message, list(error.path), list(error.schema_path), error.validator
+        return None
@@ -0,0 +1,156 @@
+"""Test complete step consumer."""
+
+import asyncio
+import json
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+from sda_orchestrator.complete_consume import CompleteConsumer
+
+COMPLETE_MSG = {
+    "user": "user",
+    "filepath": "user/dir/file.c4gh",
+    "accession_id": "urn:uuid:5fb82fa1-dcf9-431f-a5fc-fb72e2d2ee14",
+    "decrypted_checksums": [
+        {"type": "sha256", "value": "82e4e60e7beb3db2e06a00a079788f7d71f75b61a4b75f28c4c942703dabb6d6"},
+        {"type": "md5", "value": "7ac236b1a8dce2dac89e7cf45d2b48bd"},
+    ],
+}
+
+
+def fake_message(body):
+    """Build an inbound message that records when it is settled."""
+    message = MagicMock()
+    message.body = json.dumps(body)
+    message.settled = threading.Event()
+    message.ack.side_effect = lambda: message.settled.set()
+    message.reject.side_effect = lambda requeue: message.settled.set()
+    return message
+
+
+class CompleteConsumerTest(unittest.TestCase):
+    """Test for the complete consumer event loop."""
+
+    @patch.dict("os.environ", {"COMPLETE_CONCURRENCY": "4"})
+    def test_concurrent_messages(self):
+        """Test messages are handled concurrently on one event loop and acked."""
+        consumer = CompleteConsumer(password="")  # nosec
+        consumer._publish = MagicMock()
+        started = []
+
+        async def process(user, filepath):
+            started.append(asyncio.get_running_loop())
+            await asyncio.sleep(0.05)
+            return "urn:neic:user-dir"
+
+        consumer._process_datasetID = process
+        messages = [fake_message(COMPLETE_MSG) for _ in range(4)]
+        for message in messages:
+            consumer(message)
+        for message in messages:
+            self.assertTrue(message.settled.wait(timeout=1))
+            message.ack.assert_called_once()
+        self.assertEqual(len(set(started)), 1)
+        consumer.loop.stop()
+
+    @patch.dict("os.environ", {"COMPLETE_CONCURRENCY": "2"})
+    def test_publish_off_loop(self):
+        """Test a publish waiting for the confirm window does not hold up the other messages on the loop."""
+        consumer = CompleteConsumer(password="")  # nosec
+        window = threading.Event()
+        consumer._publish = MagicMock(side_effect=lambda *args: window.wait(timeout=5))
+        processed = threading.Event()
+
+        async def process(user, filepath):
+            if filepath.endswith("second.c4gh"):
+                processed.set()
+            return "urn:neic:user-dir"
+
+        consumer._process_datasetID = process
+        first = fake_message(COMPLETE_MSG)
+        second = fake_message(dict(COMPLETE_MSG, filepath="user/dir/second.c4gh"))
+        consumer(first)
+        consumer(second)
+        self.assertTrue(processed.wait(timeout=1))
+        self.assertFalse(first.settled.is_set())
+        window.set()
+        for message in (first, second):
+            self.assertTrue(message.settled.wait(timeout=1))
+            message.ack.assert_called_once()
+        consumer.close()
+
+    @patch.dict("os.environ", {"COMPLETE_CONCURRENCY": "2"})
+    def test_concurrent_error(self):
+        """Test a failing message is reported and rejected."""
+        consumer = CompleteConsumer(password="")  # nosec
+        consumer._publish = MagicMock()
+        message = fake_message({"user": "user", "filepath": "user/file.c4gh"})
+        consumer(message)
+        self.assertTrue(message.settled.wait(timeout=1))
+        message.reject.assert_called_once_with(requeue=False)
+        consumer._publish.assert_called_once()
+        consumer.loop.stop()
+
+    @patch.dict(
+        "os.environ",
+        {
+            "DOI_PREFIX": "10.0",
+            "DOI_API": "https://doi.test/dois",
+            "DOI_USER": "user",
+            "DOI_KEY": "key",
+            "REMS_API": "https://rems.test",
+            "REMS_USER": "owner",
+            "REMS_KEY": "key",
+        },
+    )
+    def test_dataset_registered_once(self):
+        """Test files of one dataset share a single registration."""
+        consumer = CompleteConsumer(password="")  # nosec
+        registrations = []
+
+        async def register(user, filepath):
+            registrations.append(filepath)
+            await asyncio.sleep(0.01)
+            return "https://doi.org/10.0/aaaa-bbbbbb"
+
+        consumer._register_dataset = register
+
+        async def process():
+            first = await asyncio.gather(
+                *(consumer._process_datasetID("user", f"user/dir/file{i}.c4gh") for i in range(5))
+            )
+            later = await consumer._process_datasetID("user", "user/dir/file5.c4gh")
+            return set(first + [later])
+
+        self.assertEqual(asyncio.run(process()), {"https://doi.org/10.0/aaaa-bbbbbb"})
+        self.assertEqual(registrations, ["user/dir/file0.c4gh"])
+
+    @patch.dict("os.environ", {"COMPLETE_CONCURRENCY": "4", "MAPPING_BATCH_SIZE": "3", "MAPPING_BATCH_AGE": "10"})
+    def test_mappings_batched(self):
+        """Test files of a dataset are mapped in one message and acked once it is confirmed."""
+        consumer = CompleteConsumer(password="")  # nosec
+        consumer.publisher = MagicMock()
+
+        async def process(user, filepath):
+            return "urn:neic:user-dir"
+
+        consumer._process_datasetID = process
+        messages = [fake_message(dict(COMPLETE_MSG, accession_id=f"EGAF0000000000{i}")) for i in range(3)]
+        for message in messages:
+            consumer(message)
+        for _ in range(100):
+            if consumer.publisher.publish.called:
+                break
+            threading.Event().wait(0.01)
+        consumer.publisher.publish.assert_called_once()
+        body, routing_key = consumer.publisher.publish.call_args.args
+        self.assertEqual(routing_key, "mappings")
+        self.assertEqual(json.loads(body)["accession_ids"], [f"EGAF0000000000{i}" for i in range(3)])
+        for message in messages:
+            self.assertFalse(message.settled.is_set())
+
+        consumer.publisher.publish.call_args.kwargs["on_confirm"](True)
+        for message in messages:
+            self.assertTrue(message.settled.wait(timeout=1))
+            message.ack.assert_called_once()
+        consumer.loop.stop()
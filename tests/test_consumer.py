@@ -1,8 +1,45 @@
 """Test Consumer class."""
 
+import json
+import os
+import signal
+import threading
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+
+from amqpstorm import AMQPConnectionError
+
 from sda_orchestrator.utils.consumer import Consumer
+from sda_orchestrator.utils import messages
+from sda_orchestrator.utils.circuit_breaker import CircuitOpen
+from sda_orchestrator.utils.metrics import HANDLE_SECONDS, MESSAGES, RETRIES
+
+
+class DrainChannel:
+    """Channel with deliveries buffered before the consumer is cancelled."""
+
+    def __init__(self, inbound, after_cancel=()):
+        """Buffer ``inbound``, ``after_cancel`` arrives while the consumer is cancelled."""
+        self.inbound = list(inbound)
+        self.after_cancel = list(after_cancel)
+        self.consumer_tags = ["tag"]
+        self.is_closed = False
+        self.basic = MagicMock()
+
+    def build_inbound_messages(self, break_on_empty=True):
+        """Yield the buffered deliveries."""
+        while self.inbound:
+            yield self.inbound.pop(0)
+
+    def stop_consuming(self):
+        """Cancel the consumer."""
+        self.inbound.extend(self.after_cancel)
+        self.consumer_tags = []
+
+    def close(self):
+        """Close the channel."""
+        self.is_closed = True
 
 
 class ConsumerTest(unittest.TestCase):
@@ -17,3 +54,149 @@ class ConsumerTest(unittest.TestCase):
         """Test if amqp connection was called."""
         self._mq.create_connection()
         mock.assert_called()
+
+    def test_message_metrics(self):
+        """Test received and acked messages are counted."""
+        received = MESSAGES.value(queue="base.queue", outcome="received")
+        acked = MESSAGES.value(queue="base.queue", outcome="acked")
+        handled = HANDLE_SECONDS.count(queue="base.queue")
+        self._mq(MagicMock())
+        self.assertEqual(MESSAGES.value(queue="base.queue", outcome="received"), received + 1)
+        self.assertEqual(MESSAGES.value(queue="base.queue", outcome="acked"), acked + 1)
+        self.assertEqual(HANDLE_SECONDS.count(queue="base.queue"), handled + 1)
+
+    def test_error_path_reuses_payload(self):
+        """Test the error message is built from the body decoded by the handler."""
+        message = MagicMock()
+        message.body = json.dumps({"user": "user", "filepath": "user/file.c4gh"})
+
+        def handle(message):
+            self._mq._decode(message)
+            raise Exception("failed")
+
+        self._mq.handle_message = handle
+        self._mq._publish = MagicMock()
+        with patch("sda_orchestrator.utils.messages.loads", wraps=messages.loads) as loads:
+            self._mq(message)
+        loads.assert_called_once()
+        body = json.loads(self._mq._publish.call_args.args[1])
+        self.assertEqual(body, {"user": "user", "filepath": "user/file.c4gh", "reason": "failed"})
+        message.reject.assert_called_once_with(requeue=False)
+
+    def _unavailable(self, headers):
+        """Handle a message failing because a dependency is down, with the publisher confirming straight away."""
+        message = MagicMock()
+        message.body = json.dumps({"user": "user", "filepath": "user/file.c4gh"})
+        message.properties = {"headers": headers, "correlation_id": "1"}
+        self._mq.handle_message = MagicMock(side_effect=CircuitOpen("rems is unavailable"))
+        self._mq.publisher = MagicMock()
+        self._mq.publisher.publish.side_effect = lambda *args, on_confirm, **kwargs: on_confirm(True)
+        self._mq(message)
+        return message
+
+    def test_unavailable_parked(self):
+        """Test a message failing on an unavailable dependency is parked on a delayed retry queue and acked."""
+        retries = RETRIES.value(queue="base.queue", attempt="2")
+        message = self._unavailable({"x-retry-attempt": 1})
+        self._mq.publisher.declare_queue.assert_called_once_with(
+            "base.queue.retry.60000",
+            {"x-message-ttl": 60000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "base.queue"},
+        )
+        args, kwargs = self._mq.publisher.publish.call_args
+        self.assertEqual(args, (message.body, "base.queue.retry.60000"))
+        self.assertEqual(kwargs["exchange"], "")
+        self.assertEqual(kwargs["properties"]["headers"], {"x-retry-attempt": 2})
+        message.ack.assert_called_once()
+        message.reject.assert_not_called()
+        self.assertEqual(RETRIES.value(queue="base.queue", attempt="2"), retries + 1)
+
+    def test_retry_delay_changed(self):
+        """Test a changed retry delay parks messages on a queue of its own instead of redeclaring the old one."""
+        self._mq.retry_delay = 45
+        self._unavailable({"x-retry-attempt": 1})
+        self._mq.publisher.declare_queue.assert_called_once_with(
+            "base.queue.retry.90000",
+            {"x-message-ttl": 90000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "base.queue"},
+        )
+        self.assertEqual(self._mq.publisher.publish.call_args.args[1], "base.queue.retry.90000")
+
+    def test_unavailable_gives_up(self):
+        """Test a message is reported to the error queue after the last attempt."""
+        message = self._unavailable({"x-retry-attempt": 5})
+        self._mq.publisher.declare_queue.assert_not_called()
+        self.assertEqual(self._mq.publisher.publish.call_args.args[1], "error")
+        message.reject.assert_called_once_with(requeue=False)
+
+
+class DrainTest(unittest.TestCase):
+    """Test stopping gracefully."""
+
+    def setUp(self):
+        """Set up a consumer whose confirms arrive from another thread."""
+        self._mq = Consumer(password="")  # nosec
+        self._mq.connection = MagicMock()
+        self._mq.publisher = MagicMock()
+        self._mq.publisher.publish.side_effect = lambda *args, on_confirm, **kwargs: threading.Timer(
+            0.05, on_confirm, (True,)
+        ).start()
+        self.messages = [MagicMock(), MagicMock(), MagicMock()]
+
+    def _start(self, signalled):
+        """Consume until ``signalled`` is handled, with the last message arriving while the consumer is cancelled."""
+        channel = DrainChannel(self.messages[:2], self.messages[2:])
+        self._mq.connection.channel.return_value = channel
+
+        def handle(message):
+            self._mq._publish(message, "{}", "next")
+            if message is signalled:
+                self._mq._signal(signal.SIGTERM, None)
+
+        self._mq.handle_message = handle
+        self._mq.start()
+        return channel
+
+    def test_drain(self):
+        """Test messages in flight and buffered are handled and settled before the consumer closes."""
+        channel = self._start(self.messages[0])
+        self.assertEqual(channel.consumer_tags, [])
+        self.assertTrue(channel.is_closed)
+        for message in self.messages:
+            message.ack.assert_called_once()
+        self._mq.connection.close.assert_called_once()
+
+    def test_drain_timeout(self):
+        """Test the consumer closes after the drain timeout when publishes are not confirmed."""
+        self._mq.drain_timeout = 0.01
+        self._mq.publisher.publish.side_effect = None
+        with self.assertLogs("sda_orchestrator", level="WARNING") as logs:
+            self._start(self.messages[0])
+        self.assertIn("3 messages from base.queue not settled", logs.output[-1])
+        for message in self.messages:
+            message.ack.assert_not_called()
+
+    def test_second_signal(self):
+        """Test a second signal stops without draining."""
+        self._mq._signal(signal.SIGTERM, None)
+        with self.assertRaises(KeyboardInterrupt):
+            self._mq._signal(signal.SIGTERM, None)
+
+
+class StopWhileConnectingTest(unittest.TestCase):
+    """Test stopping while the broker cannot be reached."""
+
+    @patch("sda_orchestrator.utils.consumer.Connection", side_effect=AMQPConnectionError("down"))
+    def test_sigterm_during_backoff(self, connection):
+        """Test SIGTERM cuts the reconnect backoff short and the consumer stops without a connection."""
+        with patch.dict("os.environ", {"BROKER_RECONNECT_DELAY": "60", "BROKER_RECONNECT_MAX_DELAY": "60"}):
+            consumer = Consumer(hostname="mq1,mq2", password="")  # nosec
+        previous = signal.getsignal(signal.SIGTERM)
+        timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+        timer.start()
+        started = time.monotonic()
+        with patch("sda_orchestrator.utils.failover.random.uniform", side_effect=lambda low, high: high):
+            consumer.start()
+        timer.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIsNone(consumer.connection)
+        self.assertEqual(connection.call_count, 2)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous)
@@ -14,22 +14,28 @@ class ConsumersCalled(unittest.TestCase):
         """Set up test fixtures."""
         pass
 
+    @patch("sda_orchestrator.complete_consume.setup_logging")
     @patch("sda_orchestrator.complete_consume.CompleteConsumer")
-    def test_start_complete_consumer(self, mock):
+    def test_start_complete_consumer(self, mock, setup_logging):
         """Test if start a consumer was called."""
         complete_main()
         self.assertTrue(mock.called)
+        setup_logging.assert_called_once()
 
     @patch("amqpstorm.Connection")
+    @patch("sda_orchestrator.inbox_consume.setup_logging")
     @patch("sda_orchestrator.inbox_consume.InboxConsumer")
-    def test_start_inbox_consumer(self, mock, amqp_mock):
+    def test_start_inbox_consumer(self, mock, setup_logging, amqp_mock):
         """Test if start a consumer was called."""
         inbox_main()
         self.assertTrue(mock.called)
+        setup_logging.assert_called_once()
 
     @patch("amqpstorm.Connection")
+    @patch("sda_orchestrator.verified_consume.setup_logging")
     @patch("sda_orchestrator.verified_consume.VerifyConsumer")
-    def test_start_verified_consumer(self, mock, amqp_mock):
+    def test_start_verified_consumer(self, mock, setup_logging, amqp_mock):
         """Test if start a consumer was called."""
         verified_main()
         self.assertTrue(mock.called)
+        setup_logging.assert_called_once()
@@ -0,0 +1,72 @@
+"""Test dataset store."""
+
+import asyncio
+import io
+import json
+import shortuuid
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import AsyncMock, MagicMock
+from sda_orchestrator.utils.circuit_breaker import DATACITE
+from sda_orchestrator.utils.dataset_store import DatasetStore
+from sda_orchestrator.utils.id_ops import DOIHandler, generate_dataset_id
+from sda_orchestrator.store_admin import main as store_main
+
+
+class DatasetStoreTest(unittest.TestCase):
+    """Test for the durable dataset record."""
+
+    def setUp(self):
+        """Open a store in a temporary directory."""
+        self.tmp = TemporaryDirectory()
+        self.path = str(Path(self.tmp.name, "datasets.db"))
+        self.store = DatasetStore(self.path)
+
+    def tearDown(self):
+        """Remove the store."""
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_update_keeps_fields(self):
+        """Test updating some fields keeps the others."""
+        self.store.update("https://doi.org/10.0/aaaa-bbbbbb", doi_suffix="aaaa-bbbbbb", state="draft")
+        self.store.update("https://doi.org/10.0/aaaa-bbbbbb", rems_resource_id=7)
+        record = self.store.get("https://doi.org/10.0/aaaa-bbbbbb")
+        self.assertEqual(
+            (record["doi_suffix"], record["state"], record["rems_resource_id"]), ("aaaa-bbbbbb", "draft", 7)
+        )
+        with self.assertRaises(ValueError):
+            self.store.update("https://doi.org/10.0/aaaa-bbbbbb", unknown=1)
+
+    def test_known_doi_not_requested(self):
+        """Test a DOI in the store is not drafted or published again, also while the Datacite circuit is open."""
+        handler = DOIHandler(http=MagicMock(), store=self.store)
+        handler.http.client.post = AsyncMock()
+        handler.http.client.put = AsyncMock()
+        dataset = generate_dataset_id("user", "user/dir/file.c4gh", handler.ns_url)
+        suffix = shortuuid.uuid(name=dataset)[:10]
+        doi_suffix = f"{suffix[:4]}-{suffix[4:]}"
+        dataset_id = f"{handler.ns_url}/{doi_suffix.lower()}"
+        self.store.update(dataset_id, doi_suffix=doi_suffix, full_doi=f"10.0/{doi_suffix}", state="publish")
+        for _ in range(DATACITE.failure_threshold):
+            DATACITE.failure()
+        self.addCleanup(DATACITE.success)
+
+        async def register():
+            doi = await handler.create_draft_doi("user", "user/dir/file.c4gh")
+            await handler.set_doi_state("publish", doi["suffix"])
+            return doi
+
+        self.assertEqual(asyncio.run(register())["dataset"], dataset_id)
+        handler.http.client.post.assert_not_awaited()
+        handler.http.client.put.assert_not_awaited()
+
+    def test_list_command(self):
+        """Test the store command prints recorded datasets."""
+        self.store.update("https://doi.org/10.0/aaaa-bbbbbb", doi_suffix="aaaa-bbbbbb")
+        out = io.StringIO()
+        with redirect_stdout(out):
+            store_main(["--store", self.path, "list"])
+        self.assertEqual(json.loads(out.getvalue())["doi_suffix"], "aaaa-bbbbbb")
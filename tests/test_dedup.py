@@ -0,0 +1,131 @@
+"""Test dropping repeated inbox events."""
+
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+from sda_orchestrator.inbox_consume import InboxConsumer
+from sda_orchestrator.utils.dedup import Deduplicator, SeenStore, upload_key
+from sda_orchestrator.utils.metrics import DUPLICATES
+
+UPLOAD = {
+    "user": "user",
+    "filepath": "user/file.c4gh",
+    "operation": "upload",
+    "encrypted_checksums": [
+        {"type": "sha256", "value": "82e4e60e7beb3db2e06a00a079788f7d71f75b61a4b75f28c4c942703dabb6d6"},
+        {"type": "md5", "value": "7ac236b1a8dce2dac89e7cf45d2b48bd"},
+    ],
+}
+
+
+class DeduplicatorTest(unittest.TestCase):
+    """Test claiming event keys."""
+
+    def setUp(self):
+        """Open a shared store in a temporary directory."""
+        self.tmp = TemporaryDirectory()
+        self.now = 1000.0
+        self.path = str(Path(self.tmp.name, "seen.db"))
+        self.stores = []
+
+    def tearDown(self):
+        """Remove the store."""
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def _deduplicator(self):
+        """Create a deduplicator as a worker process would, on the shared store."""
+        store = SeenStore(self.path, clock=lambda: self.now)
+        self.stores.append(store)
+        return Deduplicator(10, store=store)
+
+    def test_key(self):
+        """Test the key does not depend on the order of the checksums and tells uploads apart."""
+        reordered = dict(UPLOAD, encrypted_checksums=UPLOAD["encrypted_checksums"][::-1])
+        self.assertEqual(upload_key(UPLOAD), upload_key(reordered))
+        self.assertNotEqual(upload_key(UPLOAD), upload_key(dict(UPLOAD, encrypted_checksums=[])))
+        self.assertNotEqual(upload_key(UPLOAD), upload_key(dict(UPLOAD, filepath="user/other.c4gh")))
+
+    def test_claim(self):
+        """Test a key is claimed once until it is released."""
+        dedup = Deduplicator(10)
+        self.assertTrue(dedup.claim("a"))
+        self.assertFalse(dedup.claim("a"))
+        self.assertTrue(dedup.claim("b"))
+        dedup.release("a")
+        self.assertTrue(dedup.claim("a"))
+
+    def test_shared_store(self):
+        """Test a key claimed in one process is a duplicate in another until it expires."""
+        first, second = self._deduplicator(), self._deduplicator()
+        self.assertTrue(first.claim("a"))
+        self.assertFalse(second.claim("a"))
+        second.release("a")
+        self.assertTrue(second.claim("a"))
+        self.now += 11
+        self.assertTrue(self.stores[0].claim("a", 10))
+        self.assertFalse(self.stores[1].claim("a", 10))
+
+    def test_remembered(self):
+        """Test a value kept by one process is read by another until it is dropped or expires."""
+        first, second = SeenStore(self.path, clock=lambda: self.now), SeenStore(self.path, clock=lambda: self.now)
+        self.stores.extend([first, second])
+        first.remember("a", "value", 10)
+        first.remember("b", "value", 10)
+        self.assertEqual(second.recall("a"), "value")
+        second.forget("a")
+        self.assertIsNone(first.recall("a"))
+        self.now += 11
+        self.assertIsNone(second.recall("b"))
+
+
+class InboxDedupTest(unittest.TestCase):
+    """Test the inbox consumer forwards an upload once."""
+
+    def setUp(self):
+        """Set up an inbox consumer with deduplication and publishes that succeed."""
+        with patch.dict("os.environ", {"INBOX_DEDUP_TTL": "60"}):
+            self.consumer = InboxConsumer(password="")  # nosec
+        self.consumer._publish = MagicMock()
+
+    def _message(self, redelivered=False):
+        """Build an upload message."""
+        message = MagicMock(redelivered=redelivered)
+        message.body = json.dumps(UPLOAD)
+        return message
+
+    def test_duplicate_dropped(self):
+        """Test a repeated upload is acked without being forwarded."""
+        duplicates = DUPLICATES.value(queue="base.queue")
+        messages = [self._message(), self._message()]
+        for message in messages:
+            self.consumer(message)
+        self.consumer._publish.assert_called_once()
+        for message in messages:
+            message.ack.assert_called_once()
+        self.assertEqual(DUPLICATES.value(queue="base.queue"), duplicates + 1)
+
+    def test_redelivered_forwarded(self):
+        """Test a redelivered upload is forwarded again."""
+        self.consumer(self._message())
+        self.consumer(self._message(redelivered=True))
+        self.assertEqual(self.consumer._publish.call_count, 2)
+
+    def test_failed_publish_released(self):
+        """Test an upload that could not be forwarded does not suppress the next one."""
+        self.consumer._publish.side_effect = [Exception("broker gone"), None, None]
+        self.consumer(self._message())
+        self.consumer(self._message())
+        self.assertEqual(self.consumer._publish.call_count, 3)
+
+    def test_upload_after_remove(self):
+        """Test a file uploaded again after it was removed is forwarded."""
+        remove = self._message()
+        remove.body = json.dumps(dict(UPLOAD, operation="remove"))
+        for message in (self._message(), remove, self._message()):
+            self.consumer(message)
+        self.assertEqual(self.consumer._publish.call_count, 3)
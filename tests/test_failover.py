@@ -0,0 +1,118 @@
+"""Test broker failover, reconnect backoff and TLS session resumption."""
+
+import shutil
+import socket
+import ssl
+import subprocess  # nosec
+import threading
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+from amqpstorm import AMQPConnectionError
+
+from sda_orchestrator.utils.consumer import Consumer
+from sda_orchestrator.utils.failover import BrokerEndpoints, backoff
+from sda_orchestrator.utils.metrics import TLS_HANDSHAKES
+from sda_orchestrator.utils.tls import ResumingSSLContext
+
+
+class BrokerEndpointsTest(unittest.TestCase):
+    """Test choosing broker nodes."""
+
+    def test_parse(self):
+        """Test hosts with and without ports."""
+        endpoints = BrokerEndpoints("mq1:5671, mq2,::1", 5670)
+        self.assertEqual([repr(endpoint) for endpoint in endpoints.order()], ["mq1:5671", "mq2:5670", "::1:5670"])
+
+    def test_failed_nodes_last(self):
+        """Test nodes that failed are tried after the others, the one that failed longest ago first."""
+        endpoints = BrokerEndpoints("mq1,mq2,mq3", 5671)
+        mq1, mq2, mq3 = endpoints.endpoints
+        endpoints.failed(mq1)
+        endpoints.failed(mq2)
+        self.assertEqual(endpoints.order(), [mq3, mq1, mq2])
+        endpoints.succeeded(mq1)
+        self.assertEqual(endpoints.order(), [mq3, mq1, mq2])
+        endpoints.failed(mq3)
+        self.assertEqual(endpoints.order(), [mq1, mq2, mq3])
+
+    def test_backoff(self):
+        """Test delays stay within the exponential bound and the cap."""
+        for attempt, bound in ((1, 0.5), (3, 2.0), (10, 30.0)):
+            delays = [backoff(attempt, 0.5, 30) for _ in range(100)]
+            self.assertTrue(all(0 <= delay <= bound for delay in delays))
+
+    @patch("sda_orchestrator.utils.consumer.Connection")
+    def test_failover(self, connection):
+        """Test the next node is tried straight away when one is down."""
+        connection.side_effect = lambda host, *args, **kwargs: (
+            MagicMock(host=host) if host == "mq2" else (_ for _ in ()).throw(AMQPConnectionError("down"))
+        )
+        consumer = Consumer(hostname="mq1,mq2", password="")  # nosec
+        consumer._stopped = sleep = MagicMock(is_set=MagicMock(return_value=False))
+        self.assertEqual(consumer.open_connection().host, "mq2")
+        sleep.wait.assert_not_called()
+        consumer.open_connection()
+        self.assertEqual([call.args[0] for call in connection.call_args_list], ["mq1", "mq2", "mq2"])
+
+    @patch("sda_orchestrator.utils.consumer.Connection", side_effect=AMQPConnectionError("down"))
+    def test_gives_up(self, connection):
+        """Test every node is tried on every attempt, with backoff between attempts."""
+        consumer = Consumer(hostname="mq1,mq2", password="", max_retries=2)  # nosec
+        consumer._stopped = sleep = MagicMock(is_set=MagicMock(return_value=False))
+        self.assertIsNone(consumer.open_connection())
+        self.assertEqual(connection.call_count, 6)
+        self.assertEqual(sleep.wait.call_count, 2)
+
+
+@unittest.skipUnless(shutil.which("openssl"), "openssl is needed to create a certificate")
+class ResumingSSLContextTest(unittest.TestCase):
+    """Test TLS sessions are resumed with a local TLS server."""
+
+    def setUp(self):
+        """Start a TLS 1.2 server with a self-signed certificate."""
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cert, key = Path(tmp.name, "cert.pem"), Path(tmp.name, "key.pem")
+        subprocess.run(  # nosec
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost"]
+            + ["-keyout", str(key), "-out", str(cert)],
+            check=True,
+            capture_output=True,
+        )
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.maximum_version = ssl.TLSVersion.TLSv1_2
+        server_context.load_cert_chain(str(cert), str(key))
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(self.server.close)
+
+        def serve():
+            while True:
+                try:
+                    conn, _ = self.server.accept()
+                except OSError:
+                    return
+                with server_context.wrap_socket(conn, server_side=True) as tls:
+                    tls.recv(1)
+
+        threading.Thread(target=serve, daemon=True).start()
+
+    def _connect(self, context):
+        """Connect like amqpstorm does and return whether the session was resumed."""
+        sock = context.wrap_socket(socket.socket(), do_handshake_on_connect=True, server_hostname=None)
+        with sock:
+            sock.connect(self.server.getsockname())
+            resumed = sock.session_reused
+            sock.sendall(b"x")
+        return resumed
+
+    def test_session_resumed(self):
+        """Test the second connection to the same address resumes the session."""
+        context = ResumingSSLContext(protocol=ssl.PROTOCOL_TLSv1_2)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        resumed = TLS_HANDSHAKES.value(resumed="true")
+        self.assertEqual([self._connect(context) for _ in range(3)], [False, True, True])
+        self.assertEqual(TLS_HANDSHAKES.value(resumed="true"), resumed + 2)
@@ -0,0 +1,59 @@
+"""Test weighted round-robin queue."""
+
+import unittest
+from sda_orchestrator.utils.fair_queue import FairQueue, parse_weights
+
+
+class FairQueueTest(unittest.TestCase):
+    """Test for the order items are taken in."""
+
+    def drain(self, queue):
+        """Take every item."""
+        items = []
+        while len(queue):
+            items.append(queue.get()[1])
+        return items
+
+    def test_round_robin(self):
+        """Test keys take turns and a key joining waits at most one round."""
+        queue = FairQueue()
+        for item in ("a1", "a2", "a3", "b1"):
+            queue.put(item[0], item)
+        self.assertEqual(queue.get(), ("a", "a1", 2))
+        queue.put("c", "c1")
+        self.assertEqual(self.drain(queue), ["b1", "a2", "c1", "a3"])
+
+    def test_weights(self):
+        """Test a key takes its weight in items per turn."""
+        queue = FairQueue({"a": 2})
+        for item in ("a1", "a2", "a3", "b1", "b2"):
+            queue.put(item[0], item)
+        self.assertEqual(self.drain(queue), ["a1", "a2", "b1", "a3", "b2"])
+
+    def test_longest(self):
+        """Test the most items of one key is followed as items are added and taken."""
+        queue = FairQueue()
+        for item in ("a1", "a2", "b1", "b2", "b3", "c1"):
+            queue.put(item[0], item)
+        self.assertEqual((queue.keys, queue.longest), (3, 3))
+        longest = []
+        while len(queue):
+            queue.get()
+            longest.append(queue.longest)
+        self.assertEqual(longest, [3, 2, 2, 2, 1, 0])
+        self.assertEqual(queue.keys, 0)
+
+    def test_clear(self):
+        """Test clearing returns the queued items per key."""
+        queue = FairQueue()
+        queue.put("a", 1)
+        queue.put("a", 2)
+        self.assertEqual({key: list(items) for key, items in queue.clear().items()}, {"a": [1, 2]})
+        self.assertEqual(len(queue), 0)
+        queue.put("b", 3)
+        self.assertEqual(queue.get(), ("b", 3, 0))
+
+    def test_parse_weights(self):
+        """Test weights are parsed and at least 1."""
+        self.assertEqual(parse_weights(" alice=3, bob=0,,"), {"alice": 3, "bob": 1})
+        self.assertEqual(parse_weights(""), {})
@@ -0,0 +1,75 @@
+"""Test shared HTTP client."""
+
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sda_orchestrator.utils.http_client import HTTPClient
+from sda_orchestrator.utils.metrics import HTTP_CONNECTIONS, HTTP_REQUESTS, HTTP_SECONDS, REGISTRY, endpoint
+
+
+class OKHandler(BaseHTTPRequestHandler):
+    """Answer every request with an empty JSON list."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        """Reply keeping the connection open."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    def log_message(self, format, *args):
+        """Keep test output quiet."""
+
+
+class HTTPClientTest(unittest.TestCase):
+    """Test for connection reuse."""
+
+    def setUp(self):
+        """Start a local HTTP server."""
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OKHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/resources"
+
+    def tearDown(self):
+        """Stop the local HTTP server."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        """Test sequential requests share one kept-alive connection."""
+        http = HTTPClient()
+
+        async def requests():
+            for _ in range(3):
+                response = await http.client.get(self.url)
+                self.assertEqual(response.status_code, 200)
+            await http.aclose()
+
+        requested, connected = HTTP_REQUESTS.value(host="127.0.0.1"), HTTP_CONNECTIONS.value(host="127.0.0.1")
+        asyncio.run(requests())
+        self.assertEqual(http.stats, {"requests": 3, "connections": 1, "tls_handshakes": 0, "reused": 2})
+        self.assertEqual(HTTP_REQUESTS.value(host="127.0.0.1"), requested + 3)
+        self.assertEqual(HTTP_CONNECTIONS.value(host="127.0.0.1"), connected + 1)
+        self.assertIn('sda_orchestrator_http_connections_total{host="127.0.0.1"}', REGISTRY.render())
+
+    def test_latency_by_endpoint(self):
+        """Test request latency is recorded for the handler endpoint and status code."""
+        http = HTTPClient()
+
+        @endpoint("_test_listing")
+        async def listing():
+            return await http.client.get(self.url)
+
+        async def requests():
+            await listing()
+            await http.client.get(self.url)
+            await http.aclose()
+
+        before = HTTP_SECONDS.count(endpoint="other", status="200")
+        asyncio.run(requests())
+        self.assertEqual(HTTP_SECONDS.count(endpoint="_test_listing", status="200"), 1)
+        self.assertEqual(HTTP_SECONDS.count(endpoint="other", status="200"), before + 1)
@@ -0,0 +1,172 @@
+"""Test the inbox consumer."""
+
+import json
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import MagicMock, patch
+
+from amqpstorm.base import IDLE_WAIT
+
+from sda_orchestrator.inbox_consume import InboxConsumer
+from sda_orchestrator.utils.metrics import BACKLOG, BACKLOG_LONGEST, BACKLOG_USERS, CANCELLED
+
+CHECKSUMS = [{"type": "sha256", "value": "82e4e60e7beb3db2e06a00a079788f7d71f75b61a4b75f28c4c942703dabb6d6"}]
+
+
+def event(operation, filepath="user/file.c4gh", user="user", **fields):
+    """Build an inbox message."""
+    message = MagicMock(redelivered=False)
+    message.body = json.dumps({"user": user, "filepath": filepath, "operation": operation, **fields})
+    return message
+
+
+class SleepingChannel:
+    """Channel that sleeps once its inbound queue is empty, like amqpstorm does."""
+
+    def __init__(self, messages):
+        """Queue the messages as delivered."""
+        self._inbound = list(messages)
+        self.consumer_tags = ["tag"]
+        self.is_closed = False
+
+    def build_inbound_messages(self, break_on_empty=False):
+        """Yield the queued messages, then sleep and stop."""
+        while self._inbound:
+            yield self._inbound.pop(0)
+        time.sleep(IDLE_WAIT)
+
+
+class InboxCancelTest(unittest.TestCase):
+    """Test ingestion is cancelled when an uploaded file is removed or renamed."""
+
+    def setUp(self):
+        """Set up an inbox consumer whose publishes succeed."""
+        with patch.dict("os.environ", {"INBOX_TRIGGER_SIZE": "2"}):
+            self.consumer = InboxConsumer(password="")  # nosec
+        self.consumer._publish = MagicMock()
+
+    def published(self):
+        """Return the triggers published."""
+        return [json.loads(call.args[1]) for call in self.consumer._publish.call_args_list]
+
+    def test_remove(self):
+        """Test removing an uploaded file publishes a cancel with the trigger's checksums."""
+        cancelled = CANCELLED.value(operation="remove")
+        self.consumer(event("upload", encrypted_checksums=CHECKSUMS))
+        self.consumer(event("remove"))
+        self.consumer(event("remove"))
+        cancel = {"type": "cancel", "user": "user", "filepath": "user/file.c4gh", "encrypted_checksums": CHECKSUMS}
+        self.assertEqual(self.published()[1:], [cancel])
+        self.assertEqual(CANCELLED.value(operation="remove"), cancelled + 1)
+
+    def test_rename(self):
+        """Test renaming an uploaded file cancels its ingestion and triggers it for the new path."""
+        self.consumer(event("upload", encrypted_checksums=CHECKSUMS))
+        self.consumer(event("rename", filepath="user/new.c4gh", oldpath="user/file.c4gh"))
+        self.consumer(event("remove", filepath="user/new.c4gh"))
+        self.assertEqual(
+            [(trigger["type"], trigger["filepath"]) for trigger in self.published()],
+            [
+                ("ingest", "user/file.c4gh"),
+                ("cancel", "user/file.c4gh"),
+                ("ingest", "user/new.c4gh"),
+                ("cancel", "user/new.c4gh"),
+            ],
+        )
+        self.assertEqual(self.published()[2]["encrypted_checksums"], CHECKSUMS)
+
+    def test_unknown_file(self):
+        """Test nothing is published for files not triggered recently, older triggers are evicted."""
+        for name in ("a", "b", "c"):
+            self.consumer(event("upload", filepath=f"user/{name}.c4gh"))
+        self.consumer(event("remove", filepath="user/a.c4gh"))
+        self.consumer(event("rename", filepath="user/d.c4gh", oldpath="user/other.c4gh"))
+        self.assertEqual(self.consumer._publish.call_count, 3)
+        self.assertEqual(len(self.consumer.triggers), 2)
+
+    def test_shared_store(self):
+        """Test an ingestion triggered by one worker process is cancelled by another."""
+        with TemporaryDirectory() as tmp:
+            with patch.dict("os.environ", {"INBOX_DEDUP_STORE": str(Path(tmp, "inbox.db"))}):
+                workers = [InboxConsumer(password="") for _ in range(2)]  # nosec
+            for worker in workers:
+                worker._publish = MagicMock()
+            workers[0](event("upload", encrypted_checksums=CHECKSUMS))
+            workers[1](event("rename", filepath="user/new.c4gh", oldpath="user/file.c4gh"))
+            workers[0](event("remove", filepath="user/new.c4gh"))
+            for worker in workers:
+                worker.store.close()
+        published = [json.loads(call.args[1]) for call in workers[1]._publish.call_args_list]
+        self.assertEqual(
+            [(trigger["type"], trigger["filepath"]) for trigger in published],
+            [
+                ("cancel", "user/file.c4gh"),
+                ("ingest", "user/new.c4gh"),
+            ],
+        )
+        self.assertEqual(json.loads(workers[0]._publish.call_args.args[1])["type"], "cancel")
+
+
+class InboxFairTest(unittest.TestCase):
+    """Test uploads are forwarded in round-robin across users."""
+
+    def setUp(self):
+        """Set up an inbox consumer in fair mode whose publishes succeed."""
+        with patch.dict("os.environ", {"INBOX_FAIR": "True", "INBOX_FAIR_WEIGHTS": "bulk=2"}):
+            self.consumer = InboxConsumer(password="")  # nosec
+        self.consumer._publish = MagicMock()
+        self.messages = [event("upload", f"bulk/{index}.c4gh", "bulk") for index in range(5)]
+        self.messages.append(event("upload", "small/0.c4gh", "small"))
+
+    def test_prefetch(self):
+        """Test the buffer is bounded by a prefetch count."""
+        self.assertEqual(self.consumer.prefetch_count, 1000)
+
+    def test_round_robin(self):
+        """Test a user with few uploads is not held up by one with many."""
+        channel = MagicMock(consumer_tags=["tag"], is_closed=False)
+        channel.build_inbound_messages.side_effect = [iter(self.messages)] + [iter(())] * 10
+
+        def publish(message, body, routing_key):
+            if self.consumer._publish.call_count == len(self.messages):
+                self.consumer.stopping = True
+
+        self.consumer._publish.side_effect = publish
+        self.consumer._consume(channel)
+        users = [json.loads(call.args[1])["user"] for call in self.consumer._publish.call_args_list]
+        self.assertEqual(users, ["bulk", "bulk", "small", "bulk", "bulk", "bulk"])
+        for message in self.messages:
+            message.ack.assert_called_once()
+
+    def test_buffer_drained_between_reads(self):
+        """Test buffered messages are handled without waiting for the channel once per message."""
+        uploads = [event("upload", f"user{index % 3}/{index}.c4gh", f"user{index % 3}") for index in range(300)]
+
+        def publish(message, body, routing_key):
+            if self.consumer._publish.call_count == len(uploads):
+                self.consumer.stopping = True
+
+        self.consumer._publish.side_effect = publish
+        started = time.monotonic()
+        self.consumer._consume(SleepingChannel(uploads))
+        self.assertEqual(self.consumer._publish.call_count, len(uploads))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_backlog(self):
+        """Test the backlog is exported per queue, with the users buffered and the longest backlog of one."""
+        for message in self.messages:
+            self.consumer(message)
+        backlog = {"queue": "base.queue"}
+        self.assertEqual((BACKLOG.value(**backlog), BACKLOG_USERS.value(**backlog)), (6, 2))
+        self.assertEqual(BACKLOG_LONGEST.value(**backlog), 5)
+        self.consumer.dispatch()
+        self.assertEqual(BACKLOG_LONGEST.value(**backlog), 4)
+        self.consumer.discard()
+        self.assertEqual(BACKLOG.value(**backlog), 0)
+        self.assertEqual(BACKLOG_USERS.value(**backlog), 0)
+        self.assertEqual(BACKLOG_LONGEST.value(**backlog), 0)
+        self.assertNotIn("bulk", "\n".join(BACKLOG.render() + BACKLOG_USERS.render() + BACKLOG_LONGEST.render()))
+        self.assertFalse(self.consumer.dispatch())
+        self.assertEqual(self.consumer._deliveries, {})
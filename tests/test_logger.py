@@ -0,0 +1,92 @@
+"""Test the logging pipeline."""
+
+import logging
+import subprocess  # nosec
+import sys
+import unittest
+from logging.handlers import QueueHandler
+from unittest.mock import patch
+
+from sda_orchestrator.utils import logger
+from sda_orchestrator.utils.logger import LOG, Fields, log_body
+
+
+class Counted:
+    """Object counting how often it is formatted."""
+
+    def __init__(self):
+        """Start at zero."""
+        self.calls = 0
+
+    def __str__(self):
+        """Count the call."""
+        self.calls += 1
+        return "counted"
+
+
+class LoggerTest(unittest.TestCase):
+    """Test lazy fields, body sampling and the queued handlers."""
+
+    def setUp(self):
+        """Keep the level of the package logger."""
+        self.level = LOG.level
+        self.addCleanup(LOG.setLevel, self.level)
+
+    def test_fields_formatted(self):
+        """Test fields are written as key=value pairs."""
+        self.assertEqual(str(Fields(corr_id="1", user="user")), "corr_id=1 user=user")
+
+    def test_fields_lazy(self):
+        """Test fields of a disabled level are not formatted."""
+        value = Counted()
+        LOG.setLevel(logging.INFO)
+        LOG.debug("Received work %s", Fields(value=value))
+        self.assertEqual(value.calls, 0)
+        with self.assertLogs(LOG, logging.INFO) as logs:
+            LOG.info("Received work %s", Fields(value=value))
+        self.assertEqual(logs.records[0].getMessage(), "Received work value=counted")
+
+    def test_log_body_sampled(self):
+        """Test bodies are logged for the configured share of messages."""
+        LOG.setLevel(logging.DEBUG)
+        with self.assertLogs(LOG, logging.DEBUG) as logs:
+            log_body('{"user": "user"}', "1")
+            with patch.object(logger, "BODY_SAMPLE_RATE", 0.0):
+                log_body('{"user": "other"}', "2")
+            LOG.debug("done")
+        self.assertEqual(len(logs.records), 2)
+        self.assertIn('{"user": "user"}', logs.records[0].getMessage())
+
+    def test_log_body_disabled(self):
+        """Test bodies are not logged above debug level."""
+        LOG.setLevel(logging.INFO)
+        with patch.object(LOG, "debug") as debug:
+            log_body("{}", "1")
+        debug.assert_not_called()
+
+    def test_records_queued(self):
+        """Test the root logger hands records to a queue written by the listener once logging is set up."""
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        self.addCleanup(logger.flush_logs)
+        with patch.dict("os.environ", {"LOG_QUEUE": "True"}):
+            logger.setup_logging()
+            listener = logger._listener
+            logger.setup_logging()
+        self.assertIsInstance(root.handlers[0], QueueHandler)
+        self.assertIs(logger._listener, listener)
+        self.assertEqual(logger._handlers, handlers)
+        logger.flush_logs()
+        self.assertIsNone(logger._listener)
+        self.assertEqual(root.handlers, handlers)
+
+    def test_import_side_effect_free(self):
+        """Test importing the module leaves the root logger without a queue and starts no thread."""
+        code = (
+            "import logging, threading\n"
+            "import sda_orchestrator.utils.logger\n"
+            "from logging.handlers import QueueHandler\n"
+            "assert not any(isinstance(h, QueueHandler) for h in logging.getLogger().handlers)\n"
+            "assert threading.active_count() == 1\n"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)  # nosec
@@ -0,0 +1,34 @@
+"""Test message encoding and decoding."""
+
+import json
+import unittest
+from unittest.mock import patch
+from jsonschema.exceptions import ValidationError
+from sda_orchestrator.utils import messages
+
+MAPPING = {"type": "mapping", "dataset_id": "urn:neic:ds", "accession_ids": ["urn:neic:file-å"]}
+
+
+class MessagesTest(unittest.TestCase):
+    """Test for the message builder."""
+
+    def test_build(self):
+        """Test a valid payload is encoded once to compact JSON bytes."""
+        body = messages.build("dataset-mapping", dict(MAPPING))
+        self.assertIsInstance(body, bytes)
+        self.assertEqual(json.loads(body), MAPPING)
+        self.assertNotIn(b", ", body)
+
+    def test_build_invalid(self):
+        """Test an invalid payload is not encoded."""
+        with patch.object(messages, "dumps") as dumps:
+            with self.assertRaises(ValidationError):
+                messages.build("dataset-mapping", {"type": "mapping"})
+        dumps.assert_not_called()
+
+    def test_without_orjson(self):
+        """Test the standard library codec gives the same bytes."""
+        with patch.object(messages, "orjson", None):
+            body = messages.dumps(MAPPING)
+            self.assertEqual(messages.loads(body), MAPPING)
+        self.assertEqual(body, messages.dumps(MAPPING))
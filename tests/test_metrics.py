@@ -0,0 +1,55 @@
+"""Test metrics rendering and serving."""
+
+import unittest
+import urllib.request
+from sda_orchestrator.utils.metrics import Counter, Histogram, Registry, serve
+
+
+class MetricsTest(unittest.TestCase):
+    """Test for the metrics."""
+
+    def test_counter(self):
+        """Test counters are rendered per label values."""
+        registry = Registry()
+        counter = registry.register(Counter("messages_total", "Messages.", ("queue", "outcome")))
+        counter.inc(queue="inbox", outcome="acked")
+        counter.inc(2, queue="inbox", outcome="acked")
+        counter.inc(queue='in"box', outcome="rejected")
+        self.assertEqual(
+            registry.render(),
+            "# HELP messages_total Messages.\n"
+            "# TYPE messages_total counter\n"
+            'messages_total{queue="inbox",outcome="acked"} 3\n'
+            'messages_total{queue="in\\"box",outcome="rejected"} 1\n',
+        )
+
+    def test_wrong_labels(self):
+        """Test labels have to match the label names."""
+        counter = Counter("messages_total", "Messages.", ("queue",))
+        with self.assertRaises(ValueError):
+            counter.inc(stage="inbox")
+
+    def test_histogram(self):
+        """Test histogram buckets are cumulative."""
+        histogram = Histogram("handle_seconds", "Handling.", ("queue",), buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, queue="inbox")
+        self.assertEqual(histogram.count(queue="inbox"), 4)
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'handle_seconds_bucket{queue="inbox",le="0.1"} 1',
+                'handle_seconds_bucket{queue="inbox",le="1"} 3',
+                'handle_seconds_bucket{queue="inbox",le="+Inf"} 4',
+                'handle_seconds_sum{queue="inbox"} 6.05',
+                'handle_seconds_count{queue="inbox"} 4',
+            ],
+        )
+
+    def test_serve(self):
+        """Test the metrics are served over HTTP."""
+        server = serve(0, "127.0.0.1")
+        self.assertIs(serve(0, "127.0.0.1"), server)
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:  # nosec
+            body = response.read().decode()
+        self.assertIn("# TYPE sda_orchestrator_messages_total counter", body)
@@ -0,0 +1,133 @@
+"""Test publishing channel with publisher confirms."""
+
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from amqpstorm import AMQPChannelError
+from pamqp import specification
+from sda_orchestrator.utils.publisher import Publisher
+from sda_orchestrator.utils.consumer import Consumer
+
+
+def fake_connection():
+    """Build a connection handing out a single mocked channel."""
+    channel = MagicMock()
+    channel.is_open = True
+    channel.rpc = SimpleNamespace(on_frame=lambda frame: False)
+    connection = MagicMock()
+    connection.channel.return_value = channel
+    return connection, channel
+
+
+class PublisherTest(unittest.TestCase):
+    """Test for the long-lived publisher."""
+
+    def test_channel_reused(self):
+        """Test one channel is opened for several publishes."""
+        connection, channel = fake_connection()
+        publisher = Publisher()
+        publisher.reset(connection)
+        publisher.publish("{}", "ingest", "sda")
+        publisher.publish("{}", "ingest", "sda")
+        connection.channel.assert_called_once()
+        self.assertEqual(channel.basic.publish.call_count, 2)
+
+    def test_queue_declared_once(self):
+        """Test a queue is declared once per channel."""
+        connection, channel = fake_connection()
+        publisher = Publisher()
+        publisher.reset(connection)
+        publisher.declare_queue("completed.retry.1", {"x-message-ttl": 30000})
+        publisher.declare_queue("completed.retry.1", {"x-message-ttl": 30000})
+        channel.queue.declare.assert_called_once_with(
+            "completed.retry.1", durable=True, arguments={"x-message-ttl": 30000}
+        )
+        publisher.reset(connection)
+        publisher.declare_queue("completed.retry.1", {"x-message-ttl": 30000})
+        self.assertEqual(channel.queue.declare.call_count, 2)
+
+    def test_confirm_callbacks(self):
+        """Test callbacks run when the broker confirms, nacks fail them."""
+        connection, channel = fake_connection()
+        publisher = Publisher(confirm=True, window=10)
+        publisher.reset(connection)
+        results = []
+        for _ in range(3):
+            publisher.publish("{}", "ingest", "sda", on_confirm=results.append)
+        self.assertEqual(publisher.unconfirmed, 3)
+        channel.rpc.on_frame(specification.Basic.Ack(delivery_tag=2, multiple=True))
+        self.assertEqual(results, [True, True])
+        channel.rpc.on_frame(specification.Basic.Nack(delivery_tag=3))
+        self.assertEqual(results, [True, True, False])
+        self.assertTrue(publisher.wait_for_confirms(timeout=0))
+
+    def test_reset_fails_unconfirmed(self):
+        """Test unconfirmed publishes are failed when the connection is replaced."""
+        connection, _ = fake_connection()
+        publisher = Publisher(confirm=True, window=10)
+        publisher.reset(connection)
+        results = []
+        publisher.publish("{}", "ingest", "sda", on_confirm=results.append)
+        publisher.reset(fake_connection()[0])
+        self.assertEqual(results, [False])
+
+    def test_channel_closed_while_waiting(self):
+        """Test a publish waiting for the window gives up when the channel closes, failing the unconfirmed."""
+        connection, channel = fake_connection()
+        publisher = Publisher(confirm=True, window=2)
+        publisher.reset(connection)
+        results = []
+        for _ in range(2):
+            publisher.publish("{}", "ingest", "sda", on_confirm=results.append)
+
+        def close():
+            channel.is_open = False
+            with publisher._cond:
+                publisher._cond.notify_all()
+
+        threading.Timer(0.1, close).start()
+        with self.assertRaises(AMQPChannelError):
+            publisher.publish("{}", "ingest", "sda", on_confirm=results.append)
+        self.assertEqual(results, [False, False])
+        self.assertEqual(channel.basic.publish.call_count, 2)
+        self.assertEqual(publisher.unconfirmed, 0)
+
+    def test_stopping_while_waiting(self):
+        """Test a publish waiting for the window gives up once stopping and no confirm comes."""
+        connection, _ = fake_connection()
+        stopping = threading.Event()
+        publisher = Publisher(confirm=True, window=1, stopping=stopping.is_set)
+        publisher.reset(connection)
+        publisher.publish("{}", "ingest", "sda")
+        threading.Timer(0.1, stopping.set).start()
+        with self.assertRaises(AMQPChannelError):
+            publisher.publish("{}", "ingest", "sda")
+
+
+class SettleTest(unittest.TestCase):
+    """Test messages are settled once their publishes are confirmed."""
+
+    def test_ack_after_confirm(self):
+        """Test the inbound message is acked only after the broker confirms."""
+        connection, channel = fake_connection()
+        consumer = Consumer(password="")  # nosec
+        consumer.connection = connection
+        consumer.publisher = Publisher(confirm=True, window=10)
+        message = MagicMock()
+        consumer.handle_message = lambda msg: consumer._publish(msg, "{}", "ingest")
+        consumer(message)
+        message.ack.assert_not_called()
+        channel.rpc.on_frame(specification.Basic.Ack(delivery_tag=1))
+        message.ack.assert_called_once()
+
+    def test_broker_lost_requeued(self):
+        """Test a message whose publish failed because the broker was lost is requeued, not reported."""
+        consumer = Consumer(password="")  # nosec
+        consumer._publish = MagicMock(side_effect=AMQPChannelError("closed"))
+        message = MagicMock()
+        consumer.handle_message = lambda msg: consumer._publish(msg, "{}", "ingest")
+        with self.assertRaises(AMQPChannelError):
+            consumer(message)
+        consumer._publish.assert_called_once()
+        message.reject.assert_called_once_with(requeue=True)
@@ -0,0 +1,98 @@
+"""Test the adaptive rate limiter for Datacite."""
+
+import asyncio
+import unittest
+from email.utils import formatdate
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sda_orchestrator.utils.circuit_breaker import ServiceUnavailable
+from sda_orchestrator.utils.id_ops import DOIHandler
+from sda_orchestrator.utils.metrics import RATE_LIMIT, RATE_LIMIT_WAITING
+from sda_orchestrator.utils.rate_limiter import AdaptiveRateLimiter, retry_after_seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    """Test the token bucket and how its rate adapts."""
+
+    def setUp(self):
+        """Set up a limiter with a small bucket and a controlled clock."""
+        self.now = 100.0
+        clock = patch("sda_orchestrator.utils.rate_limiter.time.monotonic", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.limiter = AdaptiveRateLimiter("test", rate=10, min_rate=1, max_rate=20, burst=2, increase=1)
+
+    def test_bucket(self):
+        """Test requests beyond the bucket wait for tokens in order."""
+        self.assertEqual([round(self.limiter._reserve(), 3) for _ in range(4)], [0, 0, 0.1, 0.2])
+        self.now += 0.2
+        self.assertEqual(round(self.limiter._reserve(), 3), 0.1)
+
+    def test_aimd(self):
+        """Test a 429 halves the rate once for requests sent before it, other responses raise it."""
+        self.limiter.update(429, sent=self.now)
+        self.limiter.update(429, sent=self.now - 1)
+        self.assertEqual(self.limiter.rate, 5)
+        self.assertEqual(RATE_LIMIT.value(dependency="test"), 5)
+        for _ in range(5):
+            self.limiter.update(201)
+        self.assertGreater(self.limiter.rate, 5.9)
+        self.assertLess(self.limiter.rate, 6.1)
+        for _ in range(10):
+            self.limiter.update(429, sent=self.now + 1)
+            self.now += 1
+        self.assertEqual(self.limiter.rate, 1)
+
+    def test_retry_after(self):
+        """Test no request is sent before the Retry-After delay has passed."""
+        self.limiter.update(429, "3", sent=self.now)
+        self.assertEqual(self.limiter._reserve(), 3)
+        self.assertEqual(retry_after_seconds(formatdate(usegmt=True)), 0)
+        self.assertEqual(retry_after_seconds("soon"), 0)
+        self.assertEqual(retry_after_seconds(None), 0)
+
+
+class RateLimiterWaitTest(unittest.TestCase):
+    """Test waiting for tokens on the event loop."""
+
+    def test_waiting_gauge(self):
+        """Test callers waiting for a token are counted."""
+        limiter = AdaptiveRateLimiter("waiting", rate=100, burst=1)
+        limiter.tokens = 0
+
+        async def acquire():
+            task = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            waiting = RATE_LIMIT_WAITING.value(dependency="waiting")
+            await task
+            return waiting
+
+        self.assertEqual(asyncio.run(acquire()), 1)
+        self.assertEqual(RATE_LIMIT_WAITING.value(dependency="waiting"), 0)
+
+
+class DOIRateLimitTest(unittest.TestCase):
+    """Test Datacite requests go through the limiter."""
+
+    def setUp(self):
+        """Set up a handler with its own limiter."""
+        self.handler = DOIHandler(http=MagicMock())
+        self.handler.limiter = AdaptiveRateLimiter("datacite-test", rate=1000, max_rate=1000, burst=1000)
+        self.handler.rate_limit_retries = 2
+
+    def test_rate_limited_sent_again(self):
+        """Test a rate limited request is sent again."""
+        limited = SimpleNamespace(status_code=429, headers={"Retry-After": "0"})
+        ok = SimpleNamespace(status_code=200, headers={})
+        request = AsyncMock(side_effect=[limited, ok])
+        self.assertIs(asyncio.run(self.handler._send(request)), ok)
+        self.assertEqual(request.await_count, 2)
+        self.assertEqual(self.handler.limiter.rate, 500.001)
+
+    def test_rate_limited_gives_up(self):
+        """Test requests still rate limited after the retries raise ServiceUnavailable."""
+        request = AsyncMock(return_value=SimpleNamespace(status_code=429, headers={}))
+        with self.assertRaises(ServiceUnavailable):
+            asyncio.run(self.handler._send(request))
+        self.assertEqual(request.await_count, 3)
@@ -0,0 +1,207 @@
+"""Test REMS registration."""
+
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from sda_orchestrator.utils.circuit_breaker import REMS, record_response
+from sda_orchestrator.utils.rems_ops import REMSHandler
+from sda_orchestrator.utils.rems_index import ResourceIndex
+
+DOI = "https://doi.org/10.0/aaaa-bbbbbb"
+ORG = {"organization/id": "NeIC"}
+
+
+def response(status_code, body):
+    """Build an HTTP response stand-in."""
+    return SimpleNamespace(status_code=status_code, json=lambda: body)
+
+
+class REMSHandlerTest(unittest.TestCase):
+    """Test for REMS registration."""
+
+    def setUp(self):
+        """Set up a handler with mocked REMS calls."""
+        REMSHandler.lookups.invalidate()
+        self.rems = REMSHandler()
+        self.rems._organization = AsyncMock(return_value=None)
+        self.rems._license = AsyncMock(return_value=1)
+        self.rems._form = AsyncMock(return_value=2)
+        self.rems._workflow = AsyncMock(return_value=3)
+        self.rems._resource = AsyncMock(return_value=4)
+        self.rems._catalogue_item = AsyncMock(return_value=None)
+        self.rems.sync_index = AsyncMock(return_value=None)
+
+    def test_lookups_cached(self):
+        """Test shared dependencies are looked up once across registrations."""
+
+        async def register():
+            await self.rems.warm()
+            await self.rems.register_resource("https://doi.org/10.0/aaaa-bbbbbb")
+            await self.rems.register_resource("https://doi.org/10.0/cccc-dddddd")
+
+        asyncio.run(register())
+        for lookup in (self.rems._organization, self.rems._license, self.rems._form, self.rems._workflow):
+            lookup.assert_awaited_once()
+        self.assertEqual(self.rems._resource.await_count, 2)
+        self.rems._catalogue_item.assert_awaited_with(2, 4, 3, "https://doi.org/10.0/cccc-dddddd")
+
+    def test_known_dataset_while_circuit_open(self):
+        """Test a dataset registered before skips REMS while its circuit is open, and is still published."""
+        self.rems.store = MagicMock()
+        self.rems.store.get.return_value = {"rems_resource_id": 4, "rems_catalogue_item_id": 5}
+        publish = AsyncMock()
+        for _ in range(REMS.failure_threshold):
+            REMS.failure()
+        self.addCleanup(REMS.success)
+        asyncio.run(self.rems.register_resource(DOI, publish))
+        publish.assert_awaited_once()
+        self.rems._resource.assert_not_awaited()
+        self.rems._catalogue_item.assert_not_awaited()
+
+    def test_failure_invalidates(self):
+        """Test a failed registration drops the cached ids."""
+        self.rems._resource.side_effect = Exception("Error occurred when creating resources.")
+        with self.assertRaises(Exception):
+            asyncio.run(self.rems.register_resource("https://doi.org/10.0/aaaa-bbbbbb"))
+        self.assertEqual(len(REMSHandler.lookups), 0)
+
+    def _record(self, events, name, result=None):
+        """Make a REMS step record when it starts and ends."""
+
+        async def step(*args):
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+            return result
+
+        return step
+
+    def test_steps_concurrent(self):
+        """Test lookups without dependencies run together and the catalogue item waits for all of them."""
+        events = []
+        for name, result in (("organization", None), ("license", 1), ("form", 2), ("workflow", 3), ("resource", 4)):
+            setattr(self.rems, f"_{name}", self._record(events, name, result))
+        self.rems._catalogue_item = self._record(events, "catalogue_item")
+
+        asyncio.run(self.rems.register_resource(DOI))
+        first_end = min(index for index, event in enumerate(events) if event.startswith("end"))
+        for name in ("organization", "license", "form", "workflow"):
+            self.assertLess(events.index(f"start {name}"), first_end)
+        self.assertGreater(events.index("start resource"), events.index("end license"))
+        self.assertEqual(events[-2:], ["start catalogue_item", "end catalogue_item"])
+
+    def test_publish_overlaps_catalogue_item(self):
+        """Test the DOI is published while the catalogue item is registered."""
+        events = []
+        self.rems._catalogue_item = self._record(events, "catalogue_item")
+
+        asyncio.run(self.rems.register_resource(DOI, self._record(events, "publish")))
+        self.assertEqual(sorted(events[:2]), ["start catalogue_item", "start publish"])
+
+    def test_create_waits_for_organization(self):
+        """Test objects are only created once the organization exists."""
+        events = []
+        self.rems._organization = self._record(events, "organization")
+        self.rems.http = MagicMock()
+
+        async def post(url, **kwargs):
+            events.append("create license")
+            return response(200, {"success": True, "id": 1})
+
+        self.rems.http.client.post = post
+        self.assertEqual(asyncio.run(self.rems._process_create("licenses", {})), 1)
+        self.assertEqual(events, ["start organization", "end organization", "create license"])
+
+
+class ResourceIndexTest(unittest.TestCase):
+    """Test for the local index of REMS resources."""
+
+    def setUp(self):
+        """Set up a handler with a fresh index and a mocked HTTP client."""
+        REMSHandler.index = ResourceIndex()
+        self.rems = REMSHandler(http=MagicMock())
+        self.client = self.rems.http.client
+        self.listing = {
+            "api/resources": [
+                {"id": 7, "resid": DOI, "organization": ORG},
+                {"id": 8, "resid": "https://doi.org/10.0/other", "organization": {"organization/id": "other"}},
+            ],
+            "api/catalogue-items": [{"id": 9, "resid": DOI, "formid": 2, "wfid": 3, "organization": ORG}],
+        }
+        self.client.get = AsyncMock(
+            side_effect=lambda url, **kwargs: response(200, self.listing[url.split("/", 1)[-1]])
+        )
+        self.client.post = AsyncMock(return_value=response(200, {"success": True, "id": 10}))
+
+    def tearDown(self):
+        """Restore a shared index and close the circuit."""
+        REMSHandler.index = ResourceIndex()
+        REMS.success()
+
+    def test_lookups_from_index(self):
+        """Test existing resources and catalogue items are found without listing REMS again."""
+
+        async def lookup():
+            resource_id = await self.rems._resource(DOI, 1)
+            await self.rems._catalogue_item(2, resource_id, 3, DOI)
+            return resource_id
+
+        self.assertEqual(asyncio.run(lookup()), 7)
+        self.assertEqual(self.client.get.await_count, 2)
+        self.client.post.assert_not_awaited()
+
+    def test_created_resource_indexed(self):
+        """Test a created resource is added to the index."""
+        doi = "https://doi.org/10.0/cccc-dddddd"
+
+        async def create():
+            await self.rems._resource(doi, 1)
+            return await self.rems._resource(doi, 1)
+
+        self.assertEqual(asyncio.run(create()), 10)
+        self.client.post.assert_awaited_once()
+        self.assertEqual(REMSHandler.index.resource(doi), 10)
+
+    def test_failed_sync_backs_off(self):
+        """Test a failed sync counts against REMS and is not retried on every lookup until the retry delay passes."""
+        now = [0.0]
+        REMSHandler.index = ResourceIndex(retry_delay=30, clock=lambda: now[0])
+        listing = self.client.get.side_effect
+
+        def get(url, **kwargs):
+            if kwargs.get("params"):
+                return listing(url, **kwargs)
+            # as the response hook of the HTTP client does
+            record_response(503)
+            return response(503, {})
+
+        self.client.get.side_effect = get
+        failures = REMS.failures
+
+        async def lookups():
+            return [await self.rems._resource(DOI, 1) for _ in range(3)]
+
+        self.assertEqual(asyncio.run(lookups()), [7, 7, 7])
+        # one failed sync of two listings, then DOIs looked up one by one from the index
+        self.assertEqual(self.client.get.await_count, 3)
+        self.assertEqual(REMS.failures, failures + 1)
+        self.assertFalse(REMSHandler.index.built)
+
+        now[0] = 31
+        self.client.get.side_effect = listing
+        asyncio.run(self.rems._ensure_index())
+        self.assertTrue(REMSHandler.index.built)
+
+    def test_refresh_keeps_index(self):
+        """Test a refresh adds resources listed in REMS and keeps the ones already indexed."""
+        now = [0.0]
+        REMSHandler.index = ResourceIndex(max_age=60, clock=lambda: now[0])
+        REMSHandler.index.add_resource("https://doi.org/10.0/ours", 11)
+        asyncio.run(self.rems.sync_index())
+        now[0] = 30
+        asyncio.run(self.rems.sync_index())
+        self.assertEqual(self.client.get.await_count, 2)
+        self.assertEqual(REMSHandler.index.resource("https://doi.org/10.0/ours"), 11)
+        self.assertEqual(REMSHandler.index.resource(DOI), 7)
+        self.assertEqual(REMSHandler.index.item(DOI, 2, 3), 9)
@@ -0,0 +1,32 @@
+"""Test the broker connection shared between consumers."""
+
+import unittest
+from unittest.mock import MagicMock
+from sda_orchestrator.utils.shared_connection import SharedConnection
+
+
+class SharedConnectionTest(unittest.TestCase):
+    """Test for the shared connection."""
+
+    def test_reconnect_once(self):
+        """Test only the first consumer to lose the connection opens a new one."""
+        connect = MagicMock(side_effect=lambda: MagicMock(is_open=True, is_closed=False))
+        shared = SharedConnection(connect)
+        first = shared.get()
+        self.assertIs(shared.get(), first)
+        second = shared.get(stale=first)
+        self.assertIsNot(second, first)
+        first.close.assert_called_once()
+        self.assertIs(shared.get(stale=first), second)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(shared.reconnects, 1)
+
+    def test_closed_connection_replaced(self):
+        """Test a closed connection is replaced."""
+        connect = MagicMock(side_effect=lambda: MagicMock(is_open=True, is_closed=False))
+        shared = SharedConnection(connect)
+        first = shared.get()
+        first.is_open = False
+        self.assertIsNot(shared.get(), first)
+        shared.close()
+        self.assertIsNone(shared.connection)
@@ -0,0 +1,30 @@
+"""Test schema validator registry."""
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from jsonschema.exceptions import ValidationError
+from sda_orchestrator.schemas.validate import SchemaRegistry, get_validator
+
+
+class SchemaRegistryTest(unittest.TestCase):
+    """Test for compiled schema validators."""
+
+    def test_validator_is_cached(self):
+        """Test the same validator instance is handed out for a schema."""
+        self.assertIs(get_validator("dataset-mapping"), get_validator("dataset-mapping"))
+
+    def test_validator_validates(self):
+        """Test the cached validator rejects a malformed message."""
+        validator = get_validator("dataset-mapping")
+        validator.validate({"type": "mapping", "dataset_id": "urn:neic:user", "accession_ids": ["id"]})
+        with self.assertRaises(ValidationError):
+            validator.validate({"type": "mapping", "dataset_id": "urn:neic:user"})
+
+    def test_missing_schema_fails_fast(self):
+        """Test requiring a schema that does not exist raises."""
+        with TemporaryDirectory() as tmp:
+            Path(tmp, "inbox-upload.json").write_text('{"type": "object"}')
+            registry = SchemaRegistry(Path(tmp))
+            with self.assertRaises(FileNotFoundError):
+                registry.require(["inbox-upload", "ingestion-trigger"])